@@ -0,0 +1,568 @@
+"""Time the pipeline stages on synthetic data and compare results between commits.
+
+    python benchmarks/run.py run --scale small --output results.json
+    python benchmarks/run.py run --meters 1000 --years 10 --stages ingest dedup
+    python benchmarks/run.py compare baseline.json results.json --threshold 0.1
+
+Stages, in pipeline order (each is timed on its own; the stages before a
+selected one run untimed to prepare the database):
+
+* ingest: read the CSV exports of all meters through the ingest ledger and
+  upsert their rows.
+* dedup: read all exports again (ledger cleared); every row is compared
+  with the stored one and left unchanged.
+* fetch: find the dates without weather per location, fetch them from a
+  local stub server and store raw responses and weather rows.
+* correlate: compute the correlation statistics of all meters from scratch.
+* correlate_incremental: change one reading per meter and update the
+  statistics (the nightly case).
+* plot: load the plot data of one meter and build the figure JSON.
+* startup: run the 'status' command of the command line in a new
+  interpreter, from start to exit. It must stay within
+  cli.STARTUP_BUDGET_S and must not import any of cli.HEAVY_MODULES;
+  'run' exits with code 1 otherwise.
+
+Results are written as JSON: wall and CPU seconds per stage (minimum over
+--repeat runs), row counts and metadata (commit, scale, Python version).
+'compare' exits with code 1 if a stage got slower than the threshold.
+
+'plans' (also run first by 'run') checks with EXPLAIN QUERY PLAN that the
+hot queries search an index of the schema created by
+pipeline.setup_databases() instead of scanning the table; it exits with
+code 1 otherwise.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+import pandas as pd
+import synthetic
+
+from smart_meter_vis import cli, pipeline
+from smart_meter_vis.utils import correlation, ingest, plotting, schema, utils, weather
+
+# Scale presets: number of meters and years per meter
+SCALES = {
+    "small": (1, 1),
+    "medium": (10, 3),
+    "large": (100, 5),
+    "xlarge": (1000, 10),
+    }
+STAGES = ["ingest", "dedup", "fetch", "correlate", "correlate_incremental", "plot", "startup"]
+
+# Meters sharing one location (and its weather data)
+METERS_PER_LOCATION = 10
+
+# Table names as in smart_meter_vis.pipeline
+NAME_DB = "benchmark.db"
+TABLE_ELECTRICITY = "electricity"
+TABLE_INGEST_FILES = "ingest_files"
+TABLE_ELECTRICITY_CHANGES = "electricity_changes"
+TABLE_CORRELATION_STATS = "correlation_stats"
+TABLE_CORRELATION_SYNC = "correlation_sync"
+TABLE_WEATHER = "weather"
+TABLE_RAW_RESPONSES = "raw_responses"
+TABLE_WEATHER_CHANGES = "weather_changes"
+
+# Run by the startup stage in a new interpreter: the 'status' command on the benchmark database,
+# then the heavy modules it imported (argv[1]: the pipeline.Config as JSON)
+STARTUP_SCRIPT = """
+import json, sys
+from smart_meter_vis import cli, pipeline
+config = pipeline.Config(**json.loads(sys.argv[1]))
+cli.main(config=config, argv=["status"])
+print(json.dumps([name for name in cli.HEAVY_MODULES if name in sys.modules]))
+"""
+
+
+class Benchmark:
+    """Database, input data and stages of one benchmark run."""
+
+    def __init__(self, folder_db: str, csv_folders: dict[str, str], url_weather: str) -> None:
+        self.folder_db = folder_db
+        self.csv_folders = csv_folders
+        self.url_weather = url_weather
+        self.meter_locations = {
+            meter_id: f"location_{number // METERS_PER_LOCATION:03d}"
+            for number, meter_id in enumerate(sorted(csv_folders))
+            }
+        self.locations = {
+            location_id: (48.0 + 0.01 * number, 16.0 + 0.01 * number)
+            for number, location_id in enumerate(sorted(set(self.meter_locations.values())))
+            }
+        self.create_tables()
+
+    def create_tables(self) -> None:
+        """Create the tables, change log triggers and indexes as pipeline.setup_databases() does."""
+        tables = [
+            (TABLE_ELECTRICITY, schema.COLUMNS_USAGE, schema.CONSTRAINTS_USAGE, True),
+            (TABLE_INGEST_FILES, ingest.COLUMNS_LEDGER, ingest.CONSTRAINTS_LEDGER, False),
+            (TABLE_WEATHER, schema.COLUMNS_WEATHER, None, True),
+            (TABLE_RAW_RESPONSES, schema.COLUMNS_RAW_RESPONSES, schema.CONSTRAINTS_RAW_RESPONSES, True),
+            (TABLE_CORRELATION_STATS, correlation.COLUMNS_STATS, correlation.CONSTRAINTS_STATS, False),
+            (TABLE_CORRELATION_SYNC, correlation.COLUMNS_SYNC, correlation.CONSTRAINTS_SYNC, False),
+            ]
+        for name_table, columns, constraints, add_id in tables:
+            utils.create_sql_table(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=name_table,
+                columns_name_type=columns,
+                constraints=constraints,
+                add_id=add_id,
+                )
+        utils.create_sql_indexes(
+            folder_db=self.folder_db,
+            name_db=NAME_DB,
+            name_table=TABLE_WEATHER,
+            indexes={"weather_location_date": ["location_id", "weather_date"]},
+            unique=True,
+            )
+        for name_table, name_table_changes, dimension_column, date_column in [
+                (TABLE_ELECTRICITY, TABLE_ELECTRICITY_CHANGES, "meter_id", "usage_date"),
+                (TABLE_WEATHER, TABLE_WEATHER_CHANGES, "location_id", "weather_date"),
+                ]:
+            correlation.create_change_triggers(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=name_table,
+                name_table_changes=name_table_changes,
+                dimension_column=dimension_column,
+                date_column=date_column,
+                )
+
+    def ingest(self) -> dict[str, int]:
+        """Ingest the new parts of all exports, as pipeline.ingest_meter() does."""
+        counts = {"files": 0, "rows": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+        for meter_id, folder_csv in self.csv_folders.items():
+            ledger = ingest.get_ledger(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_INGEST_FILES,
+                meter_id=meter_id,
+                )
+            csv_increments = {}
+            ledger_updates = {}
+            for path in utils.find_csv_paths_abs(folder_csv=folder_csv):
+                csv_increment, ledger_entry = ingest.read_csv_increment(path_abs=path, entry=ledger.get(path))
+                if csv_increment is not None:
+                    csv_increments[path] = csv_increment
+                    ledger_updates[path] = ledger_entry
+            usage_series = utils.load_csv_meter_series(paths_abs_list=list(csv_increments.values()))
+            report = utils.sql_upsert_rows(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_ELECTRICITY,
+                key_column=["meter_id", "usage_date"],
+                data=usage_series.to_frame(dimensions={"meter_id": meter_id}),
+                )
+            ingest.record_ingest(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_INGEST_FILES,
+                meter_id=meter_id,
+                entries=ledger_updates,
+                )
+            counts["files"] += len(csv_increments)
+            counts["rows"] += len(usage_series)
+            for key, value in report.items():
+                counts[key] += value
+        return counts
+
+    def dedup(self) -> dict[str, int]:
+        """Read all exports again: every row is compared with the stored one."""
+        conn = utils.get_sql_connection(folder_db=self.folder_db, name_db=NAME_DB)
+        conn.execute(f"DELETE FROM {TABLE_INGEST_FILES}")
+        conn.commit()
+        return self.ingest()
+
+    def fetch(self) -> dict[str, int]:
+        """Fetch and store the weather of all dates with usage, as pipeline.fetch() does."""
+        missing_dates_by_meter = {}
+        for meter_id, location_id in self.meter_locations.items():
+            usage_dates = [
+                row[0] for row in utils.sql_filter_where(
+                    folder_db=self.folder_db,
+                    name_db=NAME_DB,
+                    name_table=TABLE_ELECTRICITY,
+                    filter_col_and_value={"meter_id": meter_id},
+                    columns_select_list=["usage_date"],
+                    )
+                ]
+            missing_dates_by_meter[meter_id] = utils.sql_filter_new_values(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_WEATHER,
+                column_name="weather_date",
+                values=usage_dates,
+                filter_col_and_value={"location_id": location_id},
+                )
+        missing_dates_by_location = weather.plan_weather_requests(
+            missing_dates_by_meter=missing_dates_by_meter,
+            meter_locations=self.meter_locations,
+            )
+
+        counts = {"requests": 0, "failed": 0}
+        retrieval_date = datetime.today().strftime("%Y-%m-%d")
+        for location_id, dates in missing_dates_by_location.items():
+            lat, lon = self.locations[location_id]
+            api_responses, api_failures, _ = weather.fetch_day_summaries(
+                dates=dates,
+                api_params={"lat": lat, "lon": lon, "appid": "benchmark", "units": "metric"},
+                url=self.url_weather,
+                requests_per_second=1_000_000,
+                requests_per_minute=None,
+                max_workers=16,
+                backoff_base=0.01,
+                )
+            utils.sql_store_raw_responses(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_RAW_RESPONSES,
+                responses=api_responses,
+                lat=lat,
+                lon=lon,
+                retrieval_date=retrieval_date,
+                )
+            df_weather_new = weather.weather_frame_from_responses(responses=api_responses)
+            df_weather_new["location_id"] = location_id
+            df_weather_new["retrieval_date"] = retrieval_date
+            utils.sql_upsert_rows(
+                folder_db=self.folder_db,
+                name_db=NAME_DB,
+                name_table=TABLE_WEATHER,
+                key_column=["location_id", "weather_date"],
+                data=df_weather_new[list(schema.COLUMNS_WEATHER)],
+                )
+            counts["requests"] += len(dates)
+            counts["failed"] += len(api_failures)
+        return counts
+
+    def _update_correlations(self, rebuild: bool) -> dict[str, int]:
+        days = 0
+        for meter_id, location_id in self.meter_locations.items():
+            _, count = correlation.update_correlation_stats(
+                folder_db=self.folder_db,
+                name_db_usage=NAME_DB,
+                name_table_usage=TABLE_ELECTRICITY,
+                name_table_usage_changes=TABLE_ELECTRICITY_CHANGES,
+                name_db_weather=NAME_DB,
+                name_table_weather=TABLE_WEATHER,
+                name_table_weather_changes=TABLE_WEATHER_CHANGES,
+                name_table_stats=TABLE_CORRELATION_STATS,
+                name_table_sync=TABLE_CORRELATION_SYNC,
+                meter_id=meter_id,
+                location_id=location_id,
+                rebuild=rebuild,
+                )
+            days += count
+        return {"meters": len(self.meter_locations), "rows": days}
+
+    def correlate(self) -> dict[str, int]:
+        """Compute the correlation statistics of all meters from scratch."""
+        return self._update_correlations(rebuild=True)
+
+    def correlate_incremental(self) -> dict[str, int]:
+        """Change the latest reading of every meter, then update the statistics."""
+        conn = utils.get_sql_connection(folder_db=self.folder_db, name_db=NAME_DB)
+        conn.execute(f"""
+            UPDATE {TABLE_ELECTRICITY} SET usage_kwh = usage_kwh + 1
+            WHERE id IN (SELECT MAX(id) FROM {TABLE_ELECTRICITY} GROUP BY meter_id)
+            """)
+        conn.commit()
+        return self._update_correlations(rebuild=False)
+
+    def plot(self, top_n: int = 3) -> dict[str, int]:
+        """Build the figure of the first meter with its top features and serialize it."""
+        meter_id = min(self.meter_locations)
+        location_id = self.meter_locations[meter_id]
+        chunk_params = {
+            "folder_db": self.folder_db,
+            "name_db_usage": NAME_DB,
+            "name_table_usage": TABLE_ELECTRICITY,
+            "name_db_weather": NAME_DB,
+            "name_table_weather": TABLE_WEATHER,
+            "meter_id": meter_id,
+            "location_id": location_id,
+            }
+        df_correlations, _ = correlation.stream_correlations(**chunk_params)
+        features = df_correlations["target"].head(top_n).tolist()
+        df_plot = pd.concat(correlation.read_joined_chunks(**chunk_params, features=features))
+        df_plot["usage_date"] = pd.to_datetime(df_plot["usage_date"])
+        fig = plotting.plot_top_features(data=df_plot, features=features)
+        figure_json = fig.to_json()
+        return {"rows": len(df_plot), "json_bytes": len(figure_json)}
+
+    def startup(self) -> dict[str, int]:
+        """Run the 'status' command in a new interpreter, as a user starting main.py would."""
+        config = {
+            "meters": {
+                meter_id: {"csv_folder": folder_csv, "location": self.meter_locations[meter_id]}
+                for meter_id, folder_csv in self.csv_folders.items()
+                },
+            "locations": self.locations,
+            "folder_db": self.folder_db,
+            "name_db": NAME_DB,
+            }
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, json.dumps(config)],
+            capture_output=True, text=True, check=True,
+            ).stdout
+        heavy_modules = json.loads(output.splitlines()[-1])
+        return {"meters": len(self.csv_folders), "heavy_modules": len(heavy_modules)}
+
+
+def check_query_plans() -> dict[str, list[str]]:
+    """Return the plans of the hot queries that don't use an index (empty if all do).
+
+    The queries are built by the same functions as in the pipeline, on an
+    empty database set up by pipeline.setup_databases().
+    """
+    hot_queries = {
+        # Dates of a meter without weather yet (fetch): anti-join against the weather table
+        "new weather dates": (
+            pipeline.TABLE_WEATHER,
+            utils.build_query_filter_new_values(
+                name_table=pipeline.TABLE_WEATHER,
+                column_name="weather_date",
+                filter_columns=["location_id"],
+                ),
+            ("location",),
+            ),
+        # API calls made today (fetch)
+        "API calls today": (
+            pipeline.TABLE_WEATHER,
+            utils.build_query_count_value(name_table=pipeline.TABLE_WEATHER, column_name="retrieval_date"),
+            ("2024-01-01",),
+            ),
+        # Dates with usage of a meter (fetch)
+        "usage dates of a meter": (
+            pipeline.TABLE_ELECTRICITY,
+            utils.build_query_filter_where(
+                name_table=pipeline.TABLE_ELECTRICITY,
+                filter_columns=["meter_id"],
+                columns_select_list=["usage_date"],
+                ),
+            ("meter",),
+            ),
+        # Raw responses of a location (replay)
+        "raw responses of a location": (
+            pipeline.TABLE_RAW_RESPONSES,
+            utils.build_query_raw_responses(
+                name_table=pipeline.TABLE_RAW_RESPONSES,
+                columns_select_list=["response_date", "response"],
+                ),
+            (48.0, 16.0),
+            ),
+        }
+
+    folder_db = tempfile.mkdtemp(prefix="smart_meter_vis_plans_")
+    failures = {}
+    try:
+        config = pipeline.Config(
+            meters={"meter": {"csv_folder": folder_db, "location": "location"}},
+            locations={"location": (48.0, 16.0)},
+            folder_db=folder_db,
+            name_db=NAME_DB,
+            )
+        pipeline.setup_databases(config=config)
+        conn = utils.get_sql_connection(folder_db=folder_db, name_db=NAME_DB)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS candidates (value UNIQUE)")
+        for name, (name_table, query, values) in hot_queries.items():
+            plan = utils.sql_explain_query_plan(folder_db=folder_db, name_db=NAME_DB, query=query, values=values)
+            # The table is aliased 't' in the anti-join
+            scans_table = any(re.match(rf"SCAN ({name_table}|t)\b", step) for step in plan)
+            uses_index = any(re.search(rf"^SEARCH ({name_table}|t) USING (COVERING )?INDEX", step) for step in plan)
+            if scans_table or not uses_index:
+                failures[name] = plan
+        conn.execute("DROP TABLE temp.candidates")
+    finally:
+        utils.close_sql_connections()
+        shutil.rmtree(folder_db, ignore_errors=True)
+    return failures
+
+
+def measure(function: Callable[[], dict[str, int]]) -> dict:
+    """Run a stage and return its wall and CPU time with its counters."""
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    counters = function()
+    result = {
+        "wall_s": time.perf_counter() - wall_start,
+        "cpu_s": time.process_time() - cpu_start,
+        **counters,
+        }
+    if counters.get("rows"):
+        result["rows_per_s"] = counters["rows"] / result["wall_s"]
+    return result
+
+
+def git_commit() -> dict[str, str | bool | None]:
+    """Return the current commit and whether the tree has uncommitted changes."""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=folder, capture_output=True, text=True, check=True,  # noqa: S607
+            ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=folder, capture_output=True, text=True, check=True,  # noqa: S607
+            ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Generate the data, run the stages --repeat times and return the results."""
+    n_meters, n_years = SCALES[args.scale] if args.scale else (args.meters, args.years)
+    stages_selected = args.stages or STAGES
+    stage_last = max(STAGES.index(stage) for stage in stages_selected)
+
+    folder_work = args.workdir or tempfile.mkdtemp(prefix="smart_meter_vis_benchmark_")
+    runs = {stage: [] for stage in stages_selected}
+    try:
+        time_start = time.perf_counter()
+        csv_folders = synthetic.generate_usage_csvs(
+            folder=os.path.join(folder_work, "csv"),
+            n_meters=n_meters,
+            n_years=n_years,
+            seed=args.seed,
+            )
+        seconds_generate = time.perf_counter() - time_start
+        print(f"Generated {n_meters} meters x {n_years} years in {seconds_generate:.1f} s")
+
+        with synthetic.stub_weather_server(latency_s=args.latency, error_rate=args.error_rate) as url_weather:
+            for repetition in range(args.repeat):
+                folder_db = os.path.join(folder_work, f"db_{repetition}")
+                os.makedirs(folder_db)
+                benchmark = Benchmark(folder_db=folder_db, csv_folders=csv_folders, url_weather=url_weather)
+                for stage in STAGES[:stage_last + 1]:
+                    if stage in runs:
+                        runs[stage].append(measure(getattr(benchmark, stage)))
+                        print(f"Run {repetition + 1}/{args.repeat} {stage}: {runs[stage][-1]['wall_s']:.3f} s")
+                    else:
+                        getattr(benchmark, stage)()
+                utils.close_sql_connections()
+                shutil.rmtree(folder_db)
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(folder_work, ignore_errors=True)
+
+    # The fastest run is the least disturbed by other load
+    stages = {}
+    for stage, results in runs.items():
+        fastest = min(results, key=lambda result: result["wall_s"])
+        stages[stage] = {
+            **fastest,
+            "wall_s_median": statistics.median(result["wall_s"] for result in results),
+            "wall_s_runs": [result["wall_s"] for result in results],
+            }
+    return {
+        "meta": {
+            **git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "meters": n_meters,
+            "years": n_years,
+            "locations": len({number // METERS_PER_LOCATION for number in range(n_meters)}),
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "latency_s": args.latency,
+            "error_rate": args.error_rate,
+            },
+        "stages": stages,
+        }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """Print the change of each stage's wall time and return the stages that got slower than 'threshold'."""
+    if (baseline["meta"]["meters"], baseline["meta"]["years"]) != (current["meta"]["meters"], current["meta"]["years"]):
+        print("Warning: the results are for different scales")
+    regressions = []
+    print(f"{'stage':<24}{'baseline s':>12}{'current s':>12}{'change':>10}")
+    for stage, result in current["stages"].items():
+        if stage not in baseline["stages"]:
+            print(f"{stage:<24}{'-':>12}{result['wall_s']:>12.3f}{'new':>10}")
+            continue
+        wall_baseline = baseline["stages"][stage]["wall_s"]
+        change = result["wall_s"] / wall_baseline - 1 if wall_baseline else 0.0
+        flag = "  <- slower" if change > threshold else ""
+        print(f"{stage:<24}{wall_baseline:>12.3f}{result['wall_s']:>12.3f}{change:>+10.1%}{flag}")
+        if change > threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def main() -> int:
+    """Parse the command line and run or compare benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = subparsers.add_parser("run", help="run the benchmarks")
+    parser_run.add_argument("--scale", choices=SCALES, help="preset for --meters and --years")
+    parser_run.add_argument("--meters", type=int, default=1)
+    parser_run.add_argument("--years", type=int, default=1)
+    parser_run.add_argument("--stages", nargs="+", choices=STAGES, help="stages to time (default: all)")
+    parser_run.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest counts")
+    parser_run.add_argument("--latency", type=float, default=0.0, help="delay of the stub server in seconds")
+    parser_run.add_argument("--error-rate", type=float, default=0.0, help="share of stub responses failing with 503")
+    parser_run.add_argument("--seed", type=int, default=0)
+    parser_run.add_argument("--workdir", help="folder for generated data (default: temporary)")
+    parser_run.add_argument("--keep", action="store_true", help="keep the temporary folder")
+    parser_run.add_argument("--output", help="write the results to this JSON file")
+
+    subparsers.add_parser("plans", help="check that the hot queries use indexes")
+
+    parser_compare = subparsers.add_parser("compare", help="compare two result files")
+    parser_compare.add_argument("baseline")
+    parser_compare.add_argument("current")
+    parser_compare.add_argument("--threshold", type=float, default=0.1, help="accepted slowdown (0.1: 10%%)")
+
+    args = parser.parse_args()
+    if args.command in ("run", "plans"):
+        failures = check_query_plans()
+        for name, plan in failures.items():
+            print(f"Query '{name}' doesn't use an index: {plan}")
+        if failures:
+            return 1
+        print("All hot queries use an index")
+    if args.command == "plans":
+        return 0
+    if args.command == "run":
+        results = run(args)
+        output = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:  # noqa: PTH123
+                f.write(output)
+        else:
+            print(output)
+        startup = results["stages"].get("startup")
+        if startup and (startup["wall_s"] > cli.STARTUP_BUDGET_S or startup["heavy_modules"]):
+            print(
+                f"Startup over budget: {startup['wall_s']:.3f} s (budget {cli.STARTUP_BUDGET_S} s), "
+                f"{startup['heavy_modules']} heavy modules imported"
+                )
+            return 1
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:  # noqa: PTH123
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:  # noqa: PTH123
+        current = json.load(f)
+    regressions = compare(baseline=baseline, current=current, threshold=args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Synthetic input data for the benchmarks.
+
+* Daily usage exports in the Wiener Netze format ('Datum;Verbrauch [kWh]',
+  'DD.MM.YYYY;1,234'), one folder per meter. Usage follows a seasonal
+  curve (more in winter), a weekly pattern and noise; a few readings are
+  missing. Each meter's history is split into yearly files and every file
+  repeats the last days of the previous one, as re-downloaded exports do.
+* OpenWeatherMap day_summary payloads, derived from the date and location
+  only, so every request for the same date gets the same answer.
+* A local HTTP server answering day_summary requests with these payloads
+  (weather.fetch_day_summaries() can be pointed to it with 'url').
+"""
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+# Days each export file repeats from the previous one
+OVERLAP_DAYS = 30
+
+
+def generate_usage_csvs(
+        folder: str,
+        n_meters: int,
+        n_years: int,
+        start: str = "2015-01-01",
+        missing_rate: float = 0.01,
+        seed: int = 0,
+        ) -> dict[str, str]:
+    """Write synthetic usage exports for several meters.
+
+    Args:
+        folder (str): The folder to write to; one subfolder per meter.
+        n_meters (int): The number of meters.
+        n_years (int): The number of years per meter (one file per year).
+        start (str): The first date ('YYYY-MM-DD').
+        missing_rate (float): The share of readings left empty.
+        seed (int): The seed of the random numbers.
+
+    Returns:
+        dict[str, str]: The CSV folder by meter id.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, periods=365 * n_years, freq="D")
+    dates_csv = np.array(days.strftime("%d.%m.%Y"))
+    season = 1.0 + 0.5 * np.cos(2 * np.pi * (days.dayofyear.to_numpy() - 15) / 365.25)
+    weekend = np.where(days.dayofweek.to_numpy() >= 5, 1.2, 1.0)
+    file_starts = range(0, len(days), 365)
+
+    folders = {}
+    for meter_number in range(n_meters):
+        meter_id = f"meter_{meter_number:04d}"
+        folder_meter = os.path.join(folder, meter_id)
+        os.makedirs(folder_meter, exist_ok=True)
+
+        usage = rng.uniform(4, 12) * season * weekend * rng.lognormal(0, 0.2, len(days))
+        usage_csv = np.char.replace(np.char.mod("%.3f", usage), ".", ",")
+        usage_csv[rng.random(len(days)) < missing_rate] = ""
+        lines = np.char.add(np.char.add(dates_csv, ";"), usage_csv)
+
+        for file_number, index_start in enumerate(file_starts):
+            lines_file = lines[max(0, index_start - OVERLAP_DAYS):index_start + 365]
+            path = os.path.join(folder_meter, f"export_{file_number:02d}.csv")
+            with open(path, "w", encoding="utf-8") as f:  # noqa: PTH123
+                f.write("Datum;Verbrauch [kWh]\n")
+                f.write("\n".join(lines_file.tolist()))
+                f.write("\n")
+        folders[meter_id] = folder_meter
+    return folders
+
+
+def day_summary(date: str, lat: float, lon: float) -> dict:
+    """Return a day_summary payload for a date and location, the same on every call."""
+    rng = np.random.default_rng(zlib.crc32(f"{date}|{lat:.4f}|{lon:.4f}".encode()))
+    day_of_year = pd.Timestamp(date).dayofyear
+    temp_mean = 10 - 10 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25) + rng.normal(0, 3)
+    spread = rng.uniform(4, 12)
+    temps = np.round(temp_mean + spread * np.array([-0.5, 0.5, -0.2, 0.4, 0.1, -0.4]), 2)
+    return {
+        "lat": lat,
+        "lon": lon,
+        "tz": "+01:00",
+        "date": date,
+        "units": "metric",
+        "cloud_cover": {"afternoon": round(float(rng.uniform(0, 100)), 1)},
+        "humidity": {"afternoon": round(float(rng.uniform(30, 95)), 1)},
+        "precipitation": {"total": round(float(rng.exponential(1.5) * (rng.random() < 0.4)), 2)},
+        "temperature": dict(zip(["min", "max", "morning", "afternoon", "evening", "night"], temps.tolist())),
+        "pressure": {"afternoon": round(float(rng.normal(1015, 8)), 1)},
+        "wind": {"max": {"speed": round(float(rng.gamma(2, 2.5)), 2), "direction": round(float(rng.uniform(0, 360)), 1)}},
+        }
+
+
+@contextmanager
+def stub_weather_server(latency_s: float = 0.0, error_rate: float = 0.0) -> Iterator[str]:
+    """Serve day_summary payloads on a local port while the context is open.
+
+    Args:
+        latency_s (float): Delay before each response, to mimic the network.
+        error_rate (float): Share of requests answered with 503 (retried by
+            weather.fetch_day_summaries()).
+
+    Yields:
+        str: The URL to pass to weather.fetch_day_summaries().
+    """
+    rng = np.random.default_rng(0)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # noqa: N802
+            query = parse_qs(urlparse(self.path).query)
+            if latency_s:
+                time.sleep(latency_s)
+            with rng_lock:
+                failed = error_rate > 0 and rng.random() < error_rate
+            if failed:
+                status, body = 503, b'{"cod": 503, "message": "stub error"}'
+            else:
+                status = 200
+                body = json.dumps(day_summary(
+                    date=query["date"][0],
+                    lat=float(query["lat"][0]),
+                    lon=float(query["lon"][0]),
+                    )).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}/data/3.0/onecall/day_summary"
+    finally:
+        server.shutdown()
+        server.server_close()
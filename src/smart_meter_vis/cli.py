@@ -0,0 +1,128 @@
+"""Command line of the pipeline (see pipeline.py), run through main.py.
+
+    python main.py                 # all stages, as before (same as 'run')
+    python main.py status          # what is stored; starts without pandas
+    python main.py ingest          # only read new CSV exports
+    python main.py fetch           # only fetch missing weather data
+    python main.py analyze         # correlations, without plotting
+    python main.py plot --html plot.html
+
+Each command imports only what its stages need, so the light ones (status,
+--help) start in well under STARTUP_BUDGET_S.
+"""
+import argparse
+import dataclasses
+import logging
+
+from smart_meter_vis import pipeline
+from smart_meter_vis.utils import metrics
+
+# Seconds a light command (status, --help) may take from the start of the interpreter,
+# checked by the 'startup' stage of benchmarks/run.py
+STARTUP_BUDGET_S = 0.25
+
+# Modules a light command must not import (each costs from tens to hundreds of milliseconds)
+HEAVY_MODULES = ("numpy", "pandas", "plotly", "requests", "pyarrow")
+
+COMMANDS = {
+    "run": "all stages: ingest, fetch, export, correlate, analyze and plot (then watch if enabled)",
+    "status": "show what is stored per meter and location",
+    "ingest": "store the new rows of the meters' CSV files",
+    "fetch": "fetch weather data for dates with usage but without weather",
+    "replay": "rebuild the weather table from the stored raw responses",
+    "export": "write changed months to the columnar store",
+    "analyze": "print the correlations of the weather features with the usage",
+    "plot": "plot the usage with its most strongly correlated weather features",
+    "watch": "ingest new exports as they land (until Ctrl+C)",
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Return the parser of the command line."""
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="Visualise smart meter data together with the weather.",
+        )
+    parser.add_argument("--log-level", help="e.g. INFO to log one JSON line per stage (default: LOG_LEVEL)")
+    parser.add_argument("--metrics-path", help="write counters and timings to this file (default: METRICS_PATH)")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    for command, help_text in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=help_text, description=help_text)
+        if command in ("run", "plot"):
+            subparser.add_argument("--html", help="write the plot to this HTML file (default: PLOT_HTML_PATH)")
+    return parser
+
+
+def print_status(config: pipeline.Config) -> None:
+    """Print what is stored per meter and location (pipeline.status())."""
+    info = pipeline.status(config=config)
+    print(f"Databases in {config.folder_db}")
+    for meter in info["meters"]:
+        if meter["needs_migration"]:
+            print(f"Meter {meter['meter_id']}: database needs migration (done by any other command, e.g. 'ingest')")
+            continue
+        dates = f"{meter['first']} to {meter['last']}" if meter["days"] else "no usage yet"
+        print(f"Meter {meter['meter_id']}: {meter['days']} days ({dates}), {meter['files']} CSV files ingested")
+    api_calls_today = 0
+    for location in info["locations"]:
+        if location["needs_migration"]:
+            print(f"Location {location['location_id']}: database needs migration (done by any other command, e.g. 'fetch')")
+            continue
+        dates = f"{location['first']} to {location['last']}" if location["days"] else "no weather yet"
+        print(f"Location {location['location_id']}: {location['days']} days ({dates}), {location['failing']} dates failing")
+        api_calls_today += location["api_calls_today"]
+    print(f"API calls today: {api_calls_today} of {config.api_daily_limit}")
+
+
+def main(config: pipeline.Config, argv: list[str] | None = None) -> int:
+    """Run a command of the pipeline.
+
+    Args:
+        config (pipeline.Config): The settings (from main.py).
+        argv (list[str] | None): The arguments (default: sys.argv[1:]).
+
+    Returns:
+        int: The exit code.
+    """
+    args = build_parser().parse_args(argv)
+    config = dataclasses.replace(
+        config,
+        log_level=args.log_level or config.log_level,
+        metrics_path=args.metrics_path or config.metrics_path,
+        plot_html_path=getattr(args, "html", None) or config.plot_html_path,
+        )
+    logging.basicConfig(level=config.log_level, format="%(message)s")
+    command = args.command or "run"
+
+    if command == "status":
+        print_status(config=config)
+        return 0
+
+    if command == "export":
+        # Exporting explicitly creates the store's change logs if COLUMNAR_STORE is off
+        config = dataclasses.replace(config, columnar_store=True)
+    pipeline.setup_databases(config=config)
+    if command == "run":
+        pipeline.run(config=config)
+        return 0
+    if command == "ingest":
+        pipeline.ingest(config=config)
+    elif command == "fetch":
+        pipeline.fetch(config=config)
+    elif command == "replay":
+        pipeline.replay_weather(config=config)
+    elif command == "export":
+        pipeline.export(config=config)
+    elif command in ("analyze", "plot"):
+        df_correlations, correlation_days = pipeline.correlate(config=config, verify=config.verify_correlations)
+        df_correlations = pipeline.analyze(config=config, df_correlations=df_correlations)
+        if command == "plot":
+            pipeline.plot(config=config, df_correlations=df_correlations)
+        elif config.correlation_method == "pearson":  # other methods print their table in analyze()
+            print(f"Correlations with the usage of meter {config.plot_meter} ({correlation_days} days):")
+            print(df_correlations.to_string(index=False))
+    elif command == "watch":
+        pipeline.watch(config=config)
+    if config.metrics_path is not None:
+        metrics.write_metrics(config.metrics_path)
+    return 0
@@ -0,0 +1,1121 @@
+"""The pipeline of main.py as functions: one per stage, all settings in a Config.
+
+    setup_databases()  create and migrate the tables (once before the stages)
+    ingest()           store the new rows of the meters' CSV files
+    fetch()            fetch weather data for dates with usage but without weather
+    export()           write changed months to the columnar store (COLUMNAR_STORE)
+    correlate()        correlation of each weather feature with the usage
+    analyze()          Spearman/partial correlations and rolling correlations
+    plot()             the figure of the strongest weather features
+    watch()            ingest, fetch and correlate new exports as they land
+    status()           what is stored, read from the databases only
+
+Importing this module is cheap: pandas, numpy, plotly and requests are
+imported by the stages that need them, and nothing is read or written until
+a stage runs. status() only needs sqlite3, so it starts in a fraction of
+the time of the other stages (see the 'startup' stage of
+benchmarks/run.py).
+"""
+import os
+import shutil
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from smart_meter_vis.utils import metrics
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Table names
+TABLE_ELECTRICITY = "electricity"
+TABLE_ELECTRICITY_INTERVAL = "electricity_interval"
+TABLE_ELECTRICITY_HOURLY = "electricity_hourly"
+TABLE_INGEST_FILES = "ingest_files"
+TABLE_ELECTRICITY_CHANGES = "electricity_changes"
+TABLE_CORRELATION_STATS = "correlation_stats"
+TABLE_CORRELATION_SYNC = "correlation_sync"
+TABLE_WEATHER = "weather"
+TABLE_WEATHER_FAILURES = "weather_failures"
+TABLE_RAW_RESPONSES = "raw_responses"
+TABLE_API_REQUESTS = "api_requests"
+TABLE_WEATHER_CHANGES = "weather_changes"
+TABLE_ELECTRICITY_STORE_CHANGES = "electricity_store_changes"
+TABLE_WEATHER_STORE_CHANGES = "weather_store_changes"
+
+
+@dataclass
+class Config:
+    """Settings of the pipeline. main.py describes each of them (as UPPERCASE constants)."""
+
+    meters: dict[str, dict]
+    locations: dict[str, tuple[float, float]]
+    folder_db: str
+    name_db: str = "vienna_weather_and_electricity_testwo.db"
+    partition_databases: bool = False
+    plot_meter: str = "default"
+    api_key_path: str = "api_key.txt"
+    api_daily_limit: int = 1000
+    api_get_limit: int = 10
+    api_requests_per_second: float | None = 10
+    api_requests_per_minute: float | None = 600
+    api_max_retries: int = 3
+    api_max_failed_runs: int = 5
+    retry_failed_only: bool = False
+    replay_weather: bool = False
+    plot_usage_granularity: str = "daily"
+    plot_max_points: int | None = 2000
+    plot_downsampling: str = "lttb"
+    plot_webgl_threshold: int = 5000
+    plot_top_n: int = 1
+    plot_html_path: str | None = None
+    watch_folders: bool = False
+    watch_interval_s: float = 10
+    correlation_method: str = "pearson"
+    rolling_windows: list[int] = field(default_factory=lambda: [30, 90])
+    correlation_lags: list[int] = field(default_factory=lambda: [0, 1, 2])
+    verify_correlations: bool = False
+    columnar_store: bool = False
+    limit_costs: bool = True
+    log_level: str = "WARNING"
+    metrics_path: str | None = None
+    metrics_port: int | None = None
+
+
+def meter_db(config: Config, meter_id: str) -> str:
+    """Return the database file of a meter (the shared file unless partitioned)."""
+    from smart_meter_vis.utils import utils  # noqa: PLC0415
+
+    return utils.partition_db_name(
+        name_db=config.name_db,
+        partition=f"meter_{meter_id}" if config.partition_databases else None,
+        )
+
+
+def location_db(config: Config, location_id: str) -> str:
+    """Return the database file of a location (the shared file unless partitioned)."""
+    from smart_meter_vis.utils import utils  # noqa: PLC0415
+
+    return utils.partition_db_name(
+        name_db=config.name_db,
+        partition=f"location_{location_id}" if config.partition_databases else None,
+        )
+
+
+def store_folder(config: Config) -> str:
+    """Return the folder of the columnar store (see utils.columnar)."""
+    return os.path.join(str(config.folder_db), "columnar")
+
+
+def read_api_key(path: str) -> str:
+    """Return the OpenWeatherMap API key stored in a text file."""
+    with open(path, "r") as f:  # noqa: PTH123
+        return f.read().strip()
+
+
+############################################
+# Create SQL databases and tables for data #
+############################################
+
+def setup_databases(config: Config) -> None:
+    """Create the tables, migrate older databases and move a former JSON backup into the raw responses.
+
+    All of it is skipped quickly if the databases are up to date; run it
+    once before the other stages.
+    """
+    from smart_meter_vis.utils import columnar, correlation, ingest, intervals, migrations, schema, utils  # noqa: PLC0415
+
+    meter_dbs = sorted({meter_db(config, meter_id) for meter_id in config.meters})
+    location_dbs = sorted({location_db(config, location_id) for location_id in config.locations})
+
+    # Create tables for electricity usage (if they don't exist yet):
+    # daily usage, sub-daily readings, their hourly rollup and the ledger of processed CSV files
+    for name_db in meter_dbs:
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_ELECTRICITY,
+            columns_name_type=schema.COLUMNS_USAGE,
+            constraints=schema.CONSTRAINTS_USAGE,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_ELECTRICITY_INTERVAL,
+            columns_name_type=intervals.COLUMNS_INTERVAL,
+            constraints=intervals.CONSTRAINTS_INTERVAL,
+            add_id=False,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_ELECTRICITY_HOURLY,
+            columns_name_type=intervals.COLUMNS_HOURLY,
+            constraints=intervals.CONSTRAINTS_HOURLY,
+            add_id=False,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_INGEST_FILES,
+            columns_name_type=ingest.COLUMNS_LEDGER,
+            constraints=ingest.CONSTRAINTS_LEDGER,
+            add_id=False,
+            )
+
+    # Create tables for weather data (if they don't exist yet)
+    for name_db in location_dbs:
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            columns_name_type=schema.COLUMNS_WEATHER,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER_FAILURES,
+            columns_name_type=schema.COLUMNS_WEATHER_FAILURES,
+            constraints=schema.CONSTRAINTS_WEATHER_FAILURES,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_RAW_RESPONSES,
+            columns_name_type=schema.COLUMNS_RAW_RESPONSES,
+            constraints=schema.CONSTRAINTS_RAW_RESPONSES,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_API_REQUESTS,
+            columns_name_type=schema.COLUMNS_API_REQUESTS,
+            constraints=schema.CONSTRAINTS_API_REQUESTS,
+            add_id=False,
+            )
+
+    # Bring databases created by older versions up to date (see utils.migrations)
+    for name_db in sorted(set(meter_dbs) | set(location_dbs)):
+        migrations.run_migrations(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            )
+
+    # Keep the correlation statistics per month and log changed months of usage and weather
+    # (see utils.correlation). Created after the migrations, which may rebuild the tables.
+    for name_db in meter_dbs:
+        correlation.create_change_triggers(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_ELECTRICITY,
+            name_table_changes=TABLE_ELECTRICITY_CHANGES,
+            dimension_column="meter_id",
+            date_column="usage_date",
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_CORRELATION_STATS,
+            columns_name_type=correlation.COLUMNS_STATS,
+            constraints=correlation.CONSTRAINTS_STATS,
+            add_id=False,
+            )
+        utils.create_sql_table(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_CORRELATION_SYNC,
+            columns_name_type=correlation.COLUMNS_SYNC,
+            constraints=correlation.CONSTRAINTS_SYNC,
+            add_id=False,
+            )
+    for name_db in location_dbs:
+        correlation.create_change_triggers(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            name_table_changes=TABLE_WEATHER_CHANGES,
+            dimension_column="location_id",
+            date_column="weather_date",
+            )
+
+    # The columnar store has change logs of its own (see utils.columnar). They only exist while
+    # the store is on; without its log, a meter's or location's copy may be stale and is removed,
+    # so the next export writes it in full.
+    store_logs = [
+        (TABLE_ELECTRICITY, TABLE_ELECTRICITY_STORE_CHANGES, "meter_id", {
+            meter_id: meter_db(config, meter_id) for meter_id in config.meters
+            }),
+        (TABLE_WEATHER, TABLE_WEATHER_STORE_CHANGES, "location_id", {
+            location_id: location_db(config, location_id) for location_id in config.locations
+            }),
+        ]
+    for name_table, name_table_changes, dimension_column, dbs_by_dimension in store_logs:
+        for name_db in sorted(set(dbs_by_dimension.values())):
+            if not config.columnar_store:
+                correlation.drop_change_triggers(
+                    folder_db=config.folder_db,
+                    name_db=name_db,
+                    name_table_changes=name_table_changes,
+                    name_triggers=f"{name_table}_store",
+                    )
+                continue
+            conn = utils.get_sql_connection(folder_db=config.folder_db, name_db=name_db)
+            if migrations.table_exists(conn, name_table_changes):
+                continue
+            for dimension_id, name_db_dimension in dbs_by_dimension.items():
+                if name_db_dimension == name_db:
+                    shutil.rmtree(columnar.partition_folder(
+                        folder_store=store_folder(config),
+                        name_table=name_table,
+                        dimension_column=dimension_column,
+                        dimension_id=dimension_id,
+                        ), ignore_errors=True)
+
+    if config.columnar_store:
+        for name_db in meter_dbs:
+            correlation.create_change_triggers(
+                folder_db=config.folder_db,
+                name_db=name_db,
+                name_table=TABLE_ELECTRICITY,
+                name_table_changes=TABLE_ELECTRICITY_STORE_CHANGES,
+                dimension_column="meter_id",
+                date_column="usage_date",
+                name_triggers=f"{TABLE_ELECTRICITY}_store",
+                )
+        for name_db in location_dbs:
+            correlation.create_change_triggers(
+                folder_db=config.folder_db,
+                name_db=name_db,
+                name_table=TABLE_WEATHER,
+                name_table_changes=TABLE_WEATHER_STORE_CHANGES,
+                dimension_column="location_id",
+                date_column="weather_date",
+                name_triggers=f"{TABLE_WEATHER}_store",
+                )
+
+    # Create indexes for the weather tables (if they don't exist yet):
+    # one row per location and date, and fast counting of API calls per retrieval date
+    for name_db in location_dbs:
+        utils.create_sql_indexes(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            indexes={"weather_location_date": ["location_id", "weather_date"]},
+            unique=True,
+            )
+        utils.create_sql_indexes(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            indexes={"weather_retrieval_date": ["retrieval_date"]},
+            )
+        # The raw responses of a location in date order (replay), not only the lookup by date
+        utils.create_sql_indexes(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_RAW_RESPONSES,
+            indexes={"raw_responses_location_date": ["lat", "lon", "response_date"]},
+            )
+
+    # Move responses from the former JSON backup file into the table (runs once)
+    if migrations.DEFAULT_LOCATION_ID in config.locations:
+        migrated_responses = utils.migrate_json_responses_to_sql(
+            filepath="api_responses.json",
+            folder_db=config.folder_db,
+            name_db=location_db(config, migrations.DEFAULT_LOCATION_ID),
+            name_table=TABLE_RAW_RESPONSES,
+            lat=config.locations[migrations.DEFAULT_LOCATION_ID][0],
+            lon=config.locations[migrations.DEFAULT_LOCATION_ID][1],
+            )
+        if migrated_responses:
+            print(f"Moved {migrated_responses} responses from api_responses.json to {TABLE_RAW_RESPONSES}")
+
+
+############################
+# Read CSV with usage data #
+############################
+
+# Data generated via customer profile at https://smartmeter-web.wienernetze.at/ )
+
+def ingest_meter(config: Config, meter_id: str) -> bool:
+    """Store the new rows of a meter's CSV files; return True if any file was new or changed."""
+    from smart_meter_vis.utils import ingest, intervals, utils  # noqa: PLC0415
+
+    meter = config.meters[meter_id]
+    name_db = meter_db(config, meter_id)
+    # For all csv files in the meter's folder: generate absolute file path
+    filepaths = utils.find_csv_paths_abs(
+        folder_csv=meter["csv_folder"],
+        )
+
+    # Read only what's new since the last run: unchanged files are skipped,
+    # files that grew are read from where the last run stopped (see utils.ingest)
+    ledger = ingest.get_ledger(
+        folder_db=config.folder_db,
+        name_db=name_db,
+        name_table=TABLE_INGEST_FILES,
+        meter_id=meter_id,
+        )
+    csv_increments = {}
+    ledger_updates = {}
+    for path in filepaths:
+        csv_increment, ledger_entry = ingest.read_csv_increment(
+            path_abs=path,
+            entry=ledger.get(path),
+            )
+        if csv_increment is not None:
+            csv_increments[path] = csv_increment
+            ledger_updates[path] = ledger_entry
+    print(f"Meter {meter_id}: {len(csv_increments)} of {len(filepaths)} CSV files new or changed")
+    metrics.count("csv_files_total", len(filepaths), meter_id=meter_id)
+    metrics.count("csv_files_changed_total", len(csv_increments), meter_id=meter_id)
+    if not csv_increments:
+        return False
+
+    # Separate daily exports from exports with sub-daily (e.g. 15-minute) readings
+    filepaths_interval = [path for path in csv_increments if intervals.csv_is_interval_data(path)]
+    filepaths_daily = [path for path in csv_increments if path not in filepaths_interval]
+
+    # For all new parts of the csv files: collect contained smart meter data as a compact
+    # series (day numbers and values, see utils.series)
+    usage_series = utils.load_csv_meter_series(
+        paths_abs_list=[csv_increments[path] for path in filepaths_daily],
+        )
+    # Readings with integer timestamps (seconds since epoch) from interval exports
+    df_smart_meter_intervals = intervals.load_csv_meter_intervals(
+        paths_abs_list=[csv_increments[path] for path in filepaths_interval],
+        )
+
+    # Write usage data to SQL table in one transaction.
+    # Dates already stored are overwritten, so corrected re-exports replace stale values.
+    ingest_report = utils.sql_upsert_rows(
+        folder_db=config.folder_db,
+        name_db=name_db,
+        name_table=TABLE_ELECTRICITY,
+        key_column=["meter_id", "usage_date"],
+        data=usage_series.to_frame(
+            date_column="usage_date",
+            value_column="usage_kwh",
+            dimensions={"meter_id": meter_id},
+            ),
+        )
+    for result in ("inserted", "updated", "unchanged"):
+        metrics.count("rows_total", ingest_report[result], stage="ingest", table=TABLE_ELECTRICITY, result=result)
+    print(
+        f"Meter {meter_id}: usage rows inserted: {ingest_report['inserted']}, "
+        f"updated: {ingest_report['updated']}, "
+        f"unchanged: {ingest_report['unchanged']}"
+        )
+
+    # Store sub-daily readings and update the hourly rollup and the daily usage
+    # in the electricity table (complete days only) for the affected dates
+    if not df_smart_meter_intervals.empty:
+        interval_report = intervals.ingest_intervals(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table_interval=TABLE_ELECTRICITY_INTERVAL,
+            name_table_hourly=TABLE_ELECTRICITY_HOURLY,
+            name_table_daily=TABLE_ELECTRICITY,
+            meter_id=meter_id,
+            data=df_smart_meter_intervals,
+            )
+        for result in ("inserted", "updated", "unchanged"):
+            metrics.count(
+                "rows_total", interval_report[result], stage="ingest", table=TABLE_ELECTRICITY_INTERVAL, result=result,
+                )
+        print(
+            f"Meter {meter_id}: interval readings inserted: {interval_report['inserted']}, "
+            f"updated: {interval_report['updated']}, "
+            f"unchanged: {interval_report['unchanged']}; "
+            f"rollups updated for {interval_report['hours']} hours and {interval_report['days']} complete days"
+            )
+
+    # Remember what has been stored; files are only marked as processed after their rows are written
+    ingest.record_ingest(
+        folder_db=config.folder_db,
+        name_db=name_db,
+        name_table=TABLE_INGEST_FILES,
+        meter_id=meter_id,
+        entries=ledger_updates,
+        )
+    return True
+
+
+def ingest(config: Config, meter_ids: list[str] | None = None) -> int:
+    """Store the new rows of the meters' CSV files (all meters if None); return the number of meters changed."""
+    with metrics.stage("ingest") as stage_info:
+        stage_info["meters_changed"] = sum(
+            ingest_meter(config=config, meter_id=meter_id)
+            for meter_id in (config.meters if meter_ids is None else meter_ids)
+            )
+    return stage_info["meters_changed"]
+
+
+#################################
+# Retrieve weather data via API #
+#################################
+
+def replay_weather(config: Config) -> None:
+    """Recompute the weather table from the stored raw responses (no API calls)."""
+    from smart_meter_vis.utils import weather  # noqa: PLC0415
+
+    for location_id, (lat, lon) in config.locations.items():
+        replay_stats = weather.replay_weather_table(
+            folder_db=config.folder_db,
+            name_db=location_db(config, location_id),
+            name_table_raw=TABLE_RAW_RESPONSES,
+            name_table_weather=TABLE_WEATHER,
+            location_id=location_id,
+            lat=lat,
+            lon=lon,
+            )
+        print(
+            f"Location {location_id}: replayed {replay_stats['rows']} weather rows "
+            f"in {replay_stats['seconds']:.2f} s ({replay_stats['rows_per_second']:.0f} rows/s)"
+            )
+
+
+def fetch(config: Config, interactive: bool = True) -> None:
+    """Fetch weather data for dates with usage data but without weather data, within the API limits."""
+    with metrics.stage("fetch"):
+        _fetch(config=config, interactive=interactive)
+
+
+def _fetch(config: Config, interactive: bool) -> None:
+    from smart_meter_vis.utils import schema, utils, weather  # noqa: PLC0415
+
+    # Count API calls made today (over all locations): one per weather row retrieved today, plus
+    # retries and requests of failed dates
+    today = datetime.today().strftime("%Y-%m-%d")
+    api_call_count_today = sum(
+        utils.sql_count_value_in_column(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            count_value=today,
+            column_name="retrieval_date"
+            )
+        + utils.sql_sum_where(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_API_REQUESTS,
+            column_name="extra_requests",
+            filter_col_and_value={"request_date": today},
+            )
+        for name_db in {location_db(config, location_id) for location_id in config.locations}
+        )
+
+    # Number of API calls allowed in this run
+    api_calls_allowed = config.api_get_limit
+    metrics.set_gauge("api_quota_used", api_call_count_today)
+    metrics.set_gauge("api_quota_limit", config.api_daily_limit)
+
+    # Check if making API calls is allowed (or if it would exceed limits set by user)
+    if not config.limit_costs:  # don't limit costs
+        make_api_calls = True
+    elif api_call_count_today + config.api_get_limit < config.api_daily_limit:  # Set number of calls is fine
+        make_api_calls = True
+
+    # Without a user to ask (watch mode): use what's left of today's quota, the rest waits
+    elif not interactive:
+        api_calls_allowed = max(0, config.api_daily_limit - api_call_count_today)
+        make_api_calls = api_calls_allowed > 0
+        if not make_api_calls:
+            print("Daily API call limit reached, postponing API calls.")
+
+    # If api_daily_limit would be exceeded: ask user if they want to continue regardless
+    else:
+        accept_charges = utils.user_choice_api_call(
+            performed_calls=api_call_count_today,
+            limit=config.api_daily_limit,
+            )
+        # True: user has overridden the cost limitation
+        make_api_calls = bool(accept_charges)
+        if not make_api_calls:  # User respects cost limitation
+            print("Stopping API calls to avoid charges.")
+    metrics.set_gauge("api_calls_allowed", api_calls_allowed if make_api_calls else 0)
+    if not make_api_calls:
+        return
+
+    # Determine dates for which the SQL weather table contains no data, yet (per meter).
+    missing_dates_by_meter = {}
+    for meter_id, meter in config.meters.items():
+        usage_dates = [
+            row[0] for row in utils.sql_filter_where(
+                folder_db=config.folder_db,
+                name_db=meter_db(config, meter_id),
+                name_table=TABLE_ELECTRICITY,
+                filter_col_and_value={"meter_id": meter_id},
+                columns_select_list=["usage_date"],
+                )
+            ]
+        missing_dates_by_meter[meter_id] = utils.sql_filter_new_values(
+            folder_db=config.folder_db,
+            name_db=location_db(config, meter["location"]),
+            name_table=TABLE_WEATHER,
+            column_name="weather_date",
+            values=usage_dates,
+            filter_col_and_value={"location_id": meter["location"]},
+            )
+
+    # Meters sharing a location share their weather data: request each date once per location
+    missing_dates_by_location = weather.plan_weather_requests(
+        missing_dates_by_meter=missing_dates_by_meter,
+        meter_locations={meter_id: meter["location"] for meter_id, meter in config.meters.items()},
+        )
+
+    # Get current date to store as retrieval date
+    retrieval_date = datetime.today().strftime('%Y-%m-%d')
+
+    # Perform API calls. Number of API calls limited to api_get_limit
+    print(f"API calls made today: {api_call_count_today}")
+    print(f"API call daily limit: {config.api_daily_limit}")
+
+    api_key = None
+    for location_id, missing_dates in missing_dates_by_location.items():
+        name_db = location_db(config, location_id)
+        lat, lon = config.locations[location_id]
+        location_filter = {"location_id": location_id}
+
+        # Resume: retry dates that failed in earlier runs first, then fetch new dates.
+        # Dates that failed api_max_failed_runs times are skipped.
+        failed_dates_all = utils.sql_get_failed_keys(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER_FAILURES,
+            key_column="weather_date",
+            filter_col_and_value=location_filter,
+            )
+        failed_dates_retry = utils.sql_get_failed_keys(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER_FAILURES,
+            key_column="weather_date",
+            max_attempts=config.api_max_failed_runs,
+            filter_col_and_value=location_filter,
+            )
+        missing_dates_set = set(missing_dates)
+        dates_to_fetch = [date for date in failed_dates_retry if date in missing_dates_set]
+        if not config.retry_failed_only:
+            failed_dates_set = set(failed_dates_all)
+            dates_to_fetch += [date for date in missing_dates if date not in failed_dates_set]
+
+        dates_to_fetch = dates_to_fetch[:api_calls_allowed]
+        if not dates_to_fetch:
+            continue
+        print(f"Location {location_id}: fetching data via api for {len(dates_to_fetch)} dates")
+
+        # The API key is only needed (and read) once there is something to fetch
+        if api_key is None:
+            api_key = read_api_key(path=config.api_key_path)
+
+        # Fetch all dates concurrently; requests are rate limited, retries count against the limit
+        api_responses, api_failures, requests_made = weather.fetch_day_summaries(
+            dates=dates_to_fetch,
+            api_params={
+                "lat": lat,
+                "lon": lon,
+                "appid": api_key,
+                "units": "metric"
+                },
+            requests_per_second=config.api_requests_per_second,
+            requests_per_minute=config.api_requests_per_minute,
+            max_requests=api_calls_allowed,
+            max_retries=config.api_max_retries,
+            )
+        api_calls_allowed -= requests_made
+        utils.sql_add_to_counter(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_API_REQUESTS,
+            key_values={"request_date": retrieval_date, "location_id": location_id},
+            column_name="extra_requests",
+            value=requests_made - len(api_responses),
+            )
+
+        # Keep track of failed dates so that the next run retries them
+        utils.sql_record_failures(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER_FAILURES,
+            key_column="weather_date",
+            failures=api_failures,
+            attempt_date=retrieval_date,
+            dimensions=location_filter,
+            )
+        utils.sql_delete_values(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER_FAILURES,
+            column_name="weather_date",
+            values=list(api_responses.keys()),
+            filter_col_and_value=location_filter,
+            )
+
+        # Backup new JSON responses to the raw response store
+        utils.sql_store_raw_responses(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_RAW_RESPONSES,
+            responses=api_responses,
+            lat=lat,
+            lon=lon,
+            retrieval_date=retrieval_date,
+            )
+
+        # Insert weather data into weather table
+        # Extract values and calculate derived columns (e.g. temp medians) for all fetched dates
+        df_weather_new = weather.weather_frame_from_responses(responses=api_responses)
+        df_weather_new["location_id"] = location_id
+        df_weather_new["retrieval_date"] = retrieval_date
+        utils.sql_upsert_rows(
+            folder_db=config.folder_db,
+            name_db=name_db,
+            name_table=TABLE_WEATHER,
+            key_column=["location_id", "weather_date"],
+            data=df_weather_new[list(schema.COLUMNS_WEATHER)],
+            )
+
+        metrics.count("rows_total", len(df_weather_new), stage="fetch", table=TABLE_WEATHER, result="upserted")
+        metrics.count("api_dates_failed_total", len(api_failures), location_id=location_id)
+        print(f"Location {location_id}: dates fetched: {len(api_responses)}, failed: {len(api_failures)}")
+
+
+###############################################
+# Export changed months to the columnar store #
+###############################################
+
+def export(config: Config) -> None:
+    """Write the months of usage and weather that changed since the last export (see utils.columnar)."""
+    from smart_meter_vis.utils import columnar, schema  # noqa: PLC0415
+
+    with metrics.stage("export"):
+        for meter_id in config.meters:
+            months = columnar.export_changes(
+                folder_db=config.folder_db,
+                name_db=meter_db(config, meter_id),
+                name_table=TABLE_ELECTRICITY,
+                name_table_changes=TABLE_ELECTRICITY_STORE_CHANGES,
+                dimension_column="meter_id",
+                dimension_id=meter_id,
+                date_column="usage_date",
+                value_columns=["usage_kwh"],
+                folder_store=store_folder(config),
+                )
+            metrics.count("store_months_written_total", len(months), table=TABLE_ELECTRICITY)
+        for location_id in config.locations:
+            months = columnar.export_changes(
+                folder_db=config.folder_db,
+                name_db=location_db(config, location_id),
+                name_table=TABLE_WEATHER,
+                name_table_changes=TABLE_WEATHER_STORE_CHANGES,
+                dimension_column="location_id",
+                dimension_id=location_id,
+                date_column="weather_date",
+                value_columns=[column for column, column_type in schema.COLUMNS_WEATHER.items() if column_type == "REAL"],
+                folder_store=store_folder(config),
+                )
+            metrics.count("store_months_written_total", len(months), table=TABLE_WEATHER)
+
+
+##################################
+# Calculate stronges correlation #
+##################################
+
+def correlate(config: Config, verify: bool = False) -> tuple["pd.DataFrame", int]:
+    """Return the correlation of each weather feature with the usage of plot_meter and the number of days used.
+
+    The rows are ordered by the (absolute) correlation coefficient, strongest first.
+    """
+    with metrics.stage("correlate") as stage_info:
+        df_correlations, correlation_days = _correlate(config=config, verify=verify)
+        stage_info["days"] = correlation_days
+    return df_correlations, correlation_days
+
+
+def _correlate(config: Config, verify: bool) -> tuple["pd.DataFrame", int]:
+    from smart_meter_vis.utils import correlation  # noqa: PLC0415
+
+    # Stored statistics are updated for the months that changed since the last run (see utils.correlation)
+    plot_location = config.meters[config.plot_meter]["location"]
+    stats_params = {
+        "folder_db": config.folder_db,
+        "name_db_usage": meter_db(config, config.plot_meter),
+        "name_table_usage": TABLE_ELECTRICITY,
+        "name_table_usage_changes": TABLE_ELECTRICITY_CHANGES,
+        "name_db_weather": location_db(config, plot_location),
+        "name_table_weather": TABLE_WEATHER,
+        "name_table_weather_changes": TABLE_WEATHER_CHANGES,
+        "name_table_stats": TABLE_CORRELATION_STATS,
+        "name_table_sync": TABLE_CORRELATION_SYNC,
+        "meter_id": config.plot_meter,
+        "location_id": plot_location,
+        }
+    df_correlations, correlation_days = correlation.update_correlation_stats(**stats_params)
+    # Weather changes are kept until every meter at the location has processed them
+    correlation.prune_weather_changes(
+        folder_db=config.folder_db,
+        name_db_weather=location_db(config, plot_location),
+        name_table_weather_changes=TABLE_WEATHER_CHANGES,
+        name_dbs_usage=sorted({
+            meter_db(config, meter_id)
+            for meter_id, meter in config.meters.items()
+            if meter["location"] == plot_location
+            }),
+        name_table_sync=TABLE_CORRELATION_SYNC,
+        location_id=plot_location,
+        )
+    if not verify:
+        return df_correlations, correlation_days
+
+    # Verification: recompute from all rows, streamed in chunks
+    df_correlations_full, correlation_days_full = correlation.stream_correlations(
+        folder_db=config.folder_db,
+        name_db_usage=meter_db(config, config.plot_meter),
+        name_table_usage=TABLE_ELECTRICITY,
+        name_db_weather=location_db(config, plot_location),
+        name_table_weather=TABLE_WEATHER,
+        meter_id=config.plot_meter,
+        location_id=plot_location,
+        )
+    if correlation.verify_correlation_stats(
+            df_correlations=df_correlations,
+            count=correlation_days,
+            df_correlations_full=df_correlations_full,
+            count_full=correlation_days_full,
+            ):
+        print("Stored correlation statistics match a full recomputation.")
+        return df_correlations, correlation_days
+    print("Stored correlation statistics differ from a full recomputation, rebuilding them.")
+    return correlation.update_correlation_stats(**stats_params, rebuild=True)
+
+
+def load_daily_data(config: Config, features: list[str], complete_only: bool = True) -> "pd.DataFrame":
+    """Return the days of plot_meter with usage and 'features' (from the columnar store if enabled)."""
+    import pandas as pd  # noqa: PLC0415
+
+    from smart_meter_vis.utils import columnar, correlation  # noqa: PLC0415
+
+    plot_location = config.meters[config.plot_meter]["location"]
+    if config.columnar_store:
+        return columnar.read_joined(
+            folder_store=store_folder(config),
+            name_table_usage=TABLE_ELECTRICITY,
+            name_table_weather=TABLE_WEATHER,
+            meter_id=config.plot_meter,
+            location_id=plot_location,
+            features=features,
+            complete_only=complete_only,
+            )
+    df_daily = pd.concat(correlation.read_joined_chunks(
+        folder_db=config.folder_db,
+        name_db_usage=meter_db(config, config.plot_meter),
+        name_table_usage=TABLE_ELECTRICITY,
+        name_db_weather=location_db(config, plot_location),
+        name_table_weather=TABLE_WEATHER,
+        meter_id=config.plot_meter,
+        location_id=plot_location,
+        features=features,
+        complete_only=complete_only,
+        ))
+    df_daily["usage_date"] = pd.to_datetime(df_daily["usage_date"])
+    return df_daily
+
+
+def analyze(config: Config, df_correlations: "pd.DataFrame") -> "pd.DataFrame":
+    """Print the Spearman/partial correlations (correlation_method) and the strongest rolling correlations.
+
+    Args:
+        config (Config): The settings.
+        df_correlations (pd.DataFrame): The Pearson correlations of correlate().
+
+    Returns:
+        pd.DataFrame: The correlations ordered by correlation_method,
+        strongest first.
+    """
+    from smart_meter_vis.utils import correlation  # noqa: PLC0415
+
+    with metrics.stage("analyze") as stage_info:
+        # Spearman and partial correlations need all days at once: computed for all features in one
+        # matrix operation on an array read straight from SQLite or the columnar store (see utils.correlation)
+        if config.correlation_method != "pearson":
+            if config.columnar_store:
+                correlation_values = load_daily_data(
+                    config=config,
+                    features=correlation.FEATURES,
+                    ).drop(columns="usage_date").to_numpy(dtype="float64")
+            else:
+                plot_location = config.meters[config.plot_meter]["location"]
+                correlation_values = correlation.read_joined_array(
+                    folder_db=config.folder_db,
+                    name_db_usage=meter_db(config, config.plot_meter),
+                    name_table_usage=TABLE_ELECTRICITY,
+                    name_db_weather=location_db(config, plot_location),
+                    name_table_weather=TABLE_WEATHER,
+                    meter_id=config.plot_meter,
+                    location_id=plot_location,
+                    )
+            df_correlations = correlation.correlation_table(
+                values=correlation_values,
+                rank_by=config.correlation_method,
+                )
+            print(df_correlations.to_string(index=False))
+
+        # Rolling and lagged correlations of all features, computed at once (see utils.correlation)
+        df_daily = load_daily_data(config=config, features=correlation.FEATURES, complete_only=False)
+        df_rolling = correlation.rolling_lagged_correlations(
+            data=df_daily,
+            windows=config.rolling_windows,
+            lags=config.correlation_lags,
+            )
+        df_rolling_strongest = correlation.latest_strongest(df_rolling=df_rolling)
+        if not df_rolling_strongest.empty:
+            print(f"Strongest rolling correlations on {df_rolling.index[-1]:%Y-%m-%d} (window and lag in days):")
+            print(df_rolling_strongest.to_string(index=False))
+        stage_info["days"] = len(df_daily)
+    return df_correlations
+
+
+#################
+# Plotting data #
+#################
+
+def plot(config: Config, df_correlations: "pd.DataFrame") -> None:
+    """Plot the usage of plot_meter with its plot_top_n strongest weather features.
+
+    Args:
+        config (Config): The settings.
+        df_correlations (pd.DataFrame): The correlations of correlate() or
+            analyze(), strongest first.
+    """
+    from smart_meter_vis.utils import intervals, plotting  # noqa: PLC0415
+
+    with metrics.stage("plot") as stage_info:
+        plot_features = df_correlations["target"].head(config.plot_top_n).tolist()
+
+        # Load the days used for the correlation, with usage and the plot_top_n strongest weather features
+        df_merged_puredata = load_daily_data(config=config, features=plot_features)
+
+        # Select usage data in the requested resolution (sub-daily data from its own tables)
+        if config.plot_usage_granularity in ("hourly", "interval"):
+            hourly = config.plot_usage_granularity == "hourly"
+            df_usage_plot = intervals.load_usage_series(
+                folder_db=config.folder_db,
+                name_db=meter_db(config, config.plot_meter),
+                name_table=TABLE_ELECTRICITY_HOURLY if hourly else TABLE_ELECTRICITY_INTERVAL,
+                ts_column="hour_ts" if hourly else "usage_ts",
+                meter_id=config.plot_meter,
+                )
+        else:
+            df_usage_plot = None  # daily usage of df_merged_puredata
+
+        # One y-axis per feature; all lines are reduced to at most plot_max_points points (see utils.plotting)
+        fig = plotting.plot_top_features(
+            data=df_merged_puredata,
+            features=plot_features,
+            usage=df_usage_plot,
+            n_out=config.plot_max_points,
+            method=config.plot_downsampling,
+            webgl_threshold=config.plot_webgl_threshold,
+            )
+        # Show the plot (or write it to plot_html_path)
+        plotting.output_figure(fig=fig, path_html=config.plot_html_path)
+        stage_info["days"] = len(df_merged_puredata)
+
+
+##########################################
+# Watch mode: keep ingesting new exports #
+##########################################
+
+def watch(config: Config, catch_up: bool = True) -> None:
+    """Ingest new exports of the meters as they land, fetch their weather and update the correlations.
+
+    Runs until Ctrl+C. With 'catch_up', exports that arrived while nothing
+    was watching are ingested first (cheap thanks to the ingest ledger); run()
+    has just done that. An error in one iteration (e.g. a locked database or
+    a folder that is briefly gone) is logged and the work is retried in the
+    next one. Counters and timings are written to metrics_path after each
+    iteration and served on metrics_port (if set).
+    """
+    from smart_meter_vis.utils import watch as watch_utils  # noqa: PLC0415
+
+    print(f"Watching CSV folders of {len(config.meters)} meters every {config.watch_interval_s} s (stop with Ctrl+C)")
+    if config.metrics_port is not None:
+        metrics.serve_metrics(port=config.metrics_port)
+        print(f"Serving metrics at http://127.0.0.1:{config.metrics_port}/metrics")
+
+    # Meters with files not ingested yet, and the day weather was last fetched (None: fetch now)
+    meters_pending = set(config.meters) if catch_up else set()
+    fetch_date = None if catch_up else datetime.today().strftime("%Y-%m-%d")
+
+    def update() -> None:
+        nonlocal fetch_date
+        if meters_pending:
+            if ingest(config=config, meter_ids=sorted(meters_pending)) > 0:
+                fetch_date = None
+            meters_pending.clear()
+
+        # Fetch weather for new dates; retry postponed dates once the daily quota resets
+        today = datetime.today().strftime("%Y-%m-%d")
+        if fetch_date == today:
+            return
+        fetch(config=config, interactive=False)
+        if config.columnar_store:
+            export(config=config)
+
+        df_correlations, correlation_days = correlate(config=config)
+        print(
+            f"Strongest correlation for meter {config.plot_meter}: {df_correlations.iloc[0]['target']} "
+            f"({df_correlations.iloc[0]['correlation']:.3f}, {correlation_days} days)"
+            )
+        fetch_date = today
+        if config.metrics_path is not None:
+            metrics.write_metrics(config.metrics_path)
+
+    def update_logged() -> None:
+        try:
+            update()
+        except Exception:
+            metrics.count("watch_errors_total")
+            metrics.logger.exception("Watch iteration failed, retrying in %s s", config.watch_interval_s)
+
+    try:
+        update_logged()
+        for meters_changed in watch_utils.watch_folders(
+                folders={meter_id: str(meter["csv_folder"]) for meter_id, meter in config.meters.items()},
+                interval_s=config.watch_interval_s,
+                ):
+            meters_pending.update(meters_changed)
+            update_logged()
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def run(config: Config) -> None:
+    """Run all stages as main.py always did: ingest, fetch, export, correlate, analyze and plot, then watch."""
+    ingest(config=config)
+    if config.replay_weather:
+        replay_weather(config=config)
+    fetch(config=config)
+    if config.columnar_store:
+        export(config=config)
+    df_correlations, _ = correlate(config=config, verify=config.verify_correlations)
+    df_correlations = analyze(config=config, df_correlations=df_correlations)
+    plot(config=config, df_correlations=df_correlations)
+    if config.metrics_path is not None:
+        metrics.write_metrics(config.metrics_path)
+    if config.watch_folders:
+        watch(config=config, catch_up=False)
+
+
+##########
+# Status #
+##########
+
+def status(config: Config) -> dict[str, list[dict]]:
+    """Return what is stored per meter and location, without changing the databases.
+
+    Only sqlite3 is needed, so this is the fast path of the command line.
+    The files are opened read-only and not migrated: a database whose
+    schema version is behind utils.migrations is reported as needing a
+    migration (done by any other command) instead of being read.
+
+    Returns:
+        dict[str, list[dict]]: 'meters' (days with usage, first and last
+        date, CSV files ingested) and 'locations' (days with weather, first
+        and last date, dates failing, API calls today), each with
+        'needs_migration'. Databases or tables that don't exist yet count
+        as empty.
+    """
+    import sqlite3  # noqa: PLC0415
+    from pathlib import Path  # noqa: PLC0415
+
+    from smart_meter_vis.utils import migrations  # noqa: PLC0415
+
+    today = datetime.today().strftime("%Y-%m-%d")
+    # Plain read-only connections: utils.get_sql_connection() would set PRAGMAs such as the journal mode
+    connections = {}
+
+    def connect(name_db: str) -> sqlite3.Connection | None:
+        path = Path(str(config.folder_db), name_db)
+        if name_db not in connections and path.exists():
+            connections[name_db] = sqlite3.connect(f"{path.absolute().as_uri()}?mode=ro", uri=True)
+        return connections.get(name_db)
+
+    def table_exists(conn: sqlite3.Connection, name_table: str) -> bool:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name_table, )).fetchone() is not None
+
+    def needs_migration(name_db: str) -> bool:
+        conn = connect(name_db)
+        if conn is None:
+            return False
+        version = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] if table_exists(conn, "schema_version") else 0
+        return (version or 0) < len(migrations.MIGRATIONS)
+
+    def query(name_db: str, name_table: str, sql: str, parameters: tuple) -> tuple | None:
+        conn = connect(name_db)
+        if conn is None or needs_migration(name_db) or not table_exists(conn, name_table):
+            return None
+        return conn.execute(sql, parameters).fetchone()
+
+    meters = []
+    for meter_id in config.meters:
+        name_db = meter_db(config, meter_id)
+        days, first, last = query(
+            name_db,
+            TABLE_ELECTRICITY,
+            f"SELECT COUNT(usage_kwh), MIN(usage_date), MAX(usage_date) FROM {TABLE_ELECTRICITY} WHERE meter_id = ?",
+            (meter_id, ),
+            ) or (0, None, None)
+        (files_ingested, ) = query(
+            name_db,
+            TABLE_INGEST_FILES,
+            f"SELECT COUNT(*) FROM {TABLE_INGEST_FILES} WHERE meter_id = ?",
+            (meter_id, ),
+            ) or (0, )
+        meters.append({
+            "meter_id": meter_id,
+            "days": days,
+            "first": first,
+            "last": last,
+            "files": files_ingested,
+            "needs_migration": needs_migration(name_db),
+            })
+
+    locations = []
+    for location_id in config.locations:
+        name_db = location_db(config, location_id)
+        days, first, last, calls_today = query(
+            name_db,
+            TABLE_WEATHER,
+            f"""
+            SELECT COUNT(*), MIN(weather_date), MAX(weather_date), COALESCE(SUM(retrieval_date = ?), 0)
+            FROM {TABLE_WEATHER} WHERE location_id = ?
+            """,
+            (today, location_id),
+            ) or (0, None, None, 0)
+        (failing, ) = query(
+            name_db,
+            TABLE_WEATHER_FAILURES,
+            f"SELECT COUNT(*) FROM {TABLE_WEATHER_FAILURES} WHERE location_id = ?",
+            (location_id, ),
+            ) or (0, )
+        # Retries and requests of failed dates count as API calls, too
+        (extra_requests_today, ) = query(
+            name_db,
+            TABLE_API_REQUESTS,
+            f"SELECT COALESCE(SUM(extra_requests), 0) FROM {TABLE_API_REQUESTS} WHERE request_date = ? AND location_id = ?",
+            (today, location_id),
+            ) or (0, )
+        locations.append({
+            "location_id": location_id,
+            "days": days,
+            "first": first,
+            "last": last,
+            "failing": failing,
+            "api_calls_today": calls_today + extra_requests_today,
+            "needs_migration": needs_migration(name_db),
+            })
+    for conn in connections.values():
+        conn.close()
+    return {"meters": meters, "locations": locations}
@@ -0,0 +1,258 @@
+"""Columnar copy of the daily usage and weather tables for the analysis (needs pyarrow).
+
+SQLite stays the system of record: ingest and weather fetching write there.
+After they ran, the months that changed are exported to one Arrow IPC file
+per table, meter or location and month:
+
+    {folder_store}/{name_table}/{dimension_column}={dimension_id}/{YYYY-MM}.arrow
+
+Dates are stored as timestamps and values as float32, without compression,
+so the files are memory-mapped when read: no parsing of TEXT dates, no
+conversion row by row and only the columns used are touched.
+
+Changed months are found through a change log of the store's own, filled by
+triggers like the one of the correlation statistics (see
+correlation.create_change_triggers()), so both can be consumed independently.
+
+pyarrow is an optional dependency (pip install "smart-meter-vis[columnar]"),
+imported when the store is used.
+"""
+import os
+import shutil
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from smart_meter_vis.utils import utils
+
+if TYPE_CHECKING:
+    import pyarrow
+
+
+def _import_pyarrow():
+    """Return the pyarrow module, with a hint how to install it if it is missing."""
+    try:
+        import pyarrow as pa  # noqa: PLC0415
+        import pyarrow.ipc  # noqa: F401, PLC0415
+    except ImportError as error:
+        raise ImportError(
+            'The columnar store needs pyarrow: pip install "smart-meter-vis[columnar]"',
+            ) from error
+    return pa
+
+
+def partition_folder(folder_store: str, name_table: str, dimension_column: str, dimension_id: str) -> str:
+    """Return the folder with the month files of one meter or location."""
+    return os.path.join(folder_store, name_table, f"{dimension_column}={dimension_id}")
+
+
+def export_changes(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        name_table_changes: str,
+        dimension_column: str,
+        dimension_id: str,
+        date_column: str,
+        value_columns: list[str],
+        folder_store: str,
+        ) -> list[str]:
+    """Write the months of one meter or location that changed since the last export.
+
+    All months are written if the meter or location has no folder in the
+    store yet; they are written to a temporary folder that is renamed when
+    complete. Processed entries are removed from the change log afterwards,
+    so an interrupted export is repeated by the next call.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The table to export, e.g. 'electricity'.
+        name_table_changes (str): The store's change log of the table
+            (correlation.COLUMNS_CHANGES).
+        dimension_column (str): The column identifying the meter or location.
+        dimension_id (str): The meter or location to export.
+        date_column (str): The date column ('YYYY-MM-DD').
+        value_columns (list[str]): The columns to export (as float32).
+        folder_store (str): The root folder of the store.
+
+    Returns:
+        list[str]: The months written or removed ('YYYY-MM').
+    """
+    pa = _import_pyarrow()
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    folder_partition = partition_folder(
+        folder_store=folder_store,
+        name_table=name_table,
+        dimension_column=dimension_column,
+        dimension_id=dimension_id,
+        )
+
+    # Changes logged up to now; later changes are exported by the next call
+    change_id = conn.execute(f"SELECT COALESCE(MAX(change_id), 0) FROM {name_table_changes}").fetchone()[0]
+    columns_select_str = ", ".join([date_column, *value_columns])
+    if os.path.isdir(folder_partition):
+        periods = sorted(
+            period for (period, ) in conn.execute(
+                f"SELECT DISTINCT period FROM {name_table_changes} WHERE dimension_id = ? AND change_id <= ?",
+                (dimension_id, change_id),
+                ).fetchall()
+            if period is not None
+            )
+        condition_str = f"AND substr({date_column}, 1, 7) IN ({", ".join("?" * len(periods))})"
+        folder_write = folder_partition
+    else:
+        periods = None
+        condition_str = ""
+        folder_write = f"{folder_partition}.tmp"
+        shutil.rmtree(folder_write, ignore_errors=True)
+        os.makedirs(folder_write)
+
+    rows_by_period = {}
+    if periods is None or periods:
+        cursor = conn.execute(
+            f"""
+            SELECT {columns_select_str} FROM {name_table}
+            WHERE {dimension_column} = ? AND {date_column} IS NOT NULL {condition_str}
+            ORDER BY {date_column}
+            """,
+            [dimension_id, *(periods or [])],
+            )
+        for row in cursor:
+            rows_by_period.setdefault(row[0][:7], []).append(row)
+
+    # Months without rows left (e.g. deleted) are removed from the store
+    for period in periods or []:
+        if period not in rows_by_period:
+            path = os.path.join(folder_partition, f"{period}.arrow")
+            if os.path.exists(path):
+                os.remove(path)
+
+    for period, rows in rows_by_period.items():
+        dates, *values = zip(*rows)
+        arrays = [pa.array(np.array(dates, dtype="datetime64[s]"))]
+        for column_values in values:
+            array = np.array(column_values, dtype="float64").astype("float32")
+            arrays.append(pa.array(array, mask=np.isnan(array)))
+        table = pa.Table.from_arrays(arrays, names=[date_column, *value_columns])
+
+        # Write to a temporary file first, so readers never see a partial file
+        path = os.path.join(folder_write, f"{period}.arrow")
+        with pa.OSFile(f"{path}.tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(f"{path}.tmp", path)
+    if folder_write != folder_partition:
+        os.rename(folder_write, folder_partition)
+
+    conn.execute(
+        f"DELETE FROM {name_table_changes} WHERE dimension_id = ? AND change_id <= ?",
+        (dimension_id, change_id),
+        )
+    conn.commit()
+    return sorted(rows_by_period) if periods is None else periods
+
+
+def read_partition(
+        folder_store: str,
+        name_table: str,
+        dimension_column: str,
+        dimension_id: str,
+        columns: list[str] | None = None,
+        ) -> "pyarrow.Table | None":
+    """Return all months of one meter or location as one pyarrow Table, ordered by date.
+
+    The month files are memory-mapped; only the selected columns are read.
+
+    Args:
+        folder_store (str): The root folder of the store.
+        name_table (str): The exported table, e.g. 'electricity'.
+        dimension_column (str): The column identifying the meter or location.
+        dimension_id (str): The meter or location to read.
+        columns (list[str] | None): The columns to read (all if None).
+
+    Returns:
+        pyarrow.Table | None: The rows, None if nothing has been exported.
+    """
+    pa = _import_pyarrow()
+    folder_partition = partition_folder(
+        folder_store=folder_store,
+        name_table=name_table,
+        dimension_column=dimension_column,
+        dimension_id=dimension_id,
+        )
+    paths = sorted(
+        os.path.join(folder_partition, name)
+        for name in (os.listdir(folder_partition) if os.path.isdir(folder_partition) else [])
+        if name.endswith(".arrow")
+        )
+    tables = []
+    for path in paths:
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        tables.append(table.select(columns) if columns is not None else table)
+    if not tables:
+        return None
+    return pa.concat_tables(tables)
+
+
+def read_joined(
+        folder_store: str,
+        name_table_usage: str,
+        name_table_weather: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str],
+        complete_only: bool = True,
+        ) -> pd.DataFrame:
+    """Return the days with usage and weather features from the store, ordered by date.
+
+    The counterpart of correlation.read_joined_chunks() (all chunks at once),
+    but with 'usage_date' as datetime.
+
+    Args:
+        folder_store (str): The root folder of the store.
+        name_table_usage (str): The exported daily usage table.
+        name_table_weather (str): The exported weather table.
+        meter_id (str): The meter whose usage is read.
+        location_id (str): The location whose weather is read.
+        features (list[str]): The weather columns to read.
+        complete_only (bool): Leave out days without usage or with a missing
+            feature. Otherwise all days with usage are read, with NaN for
+            missing values.
+
+    Returns:
+        pd.DataFrame: The columns 'usage_date', 'usage_kwh' and 'features'.
+    """
+    usage = read_partition(
+        folder_store=folder_store,
+        name_table=name_table_usage,
+        dimension_column="meter_id",
+        dimension_id=meter_id,
+        columns=["usage_date", "usage_kwh"],
+        )
+    weather = read_partition(
+        folder_store=folder_store,
+        name_table=name_table_weather,
+        dimension_column="location_id",
+        dimension_id=location_id,
+        columns=["weather_date", *features],
+        )
+    columns = ["usage_date", "usage_kwh", *features]
+    if usage is None:
+        return pd.DataFrame(columns=columns).astype({column: "float32" for column in columns[1:]})
+    df_usage = usage.to_pandas()
+    if weather is None:
+        df_weather = pd.DataFrame(columns=["weather_date", *features])
+        df_weather["weather_date"] = df_weather["weather_date"].astype(df_usage["usage_date"].dtype)
+    else:
+        df_weather = weather.to_pandas()
+
+    # A left join keeps the order of the usage dates
+    df_joined = df_usage.merge(
+        df_weather.rename(columns={"weather_date": "usage_date"}),
+        on="usage_date",
+        how="left",
+        )[columns]
+    if complete_only:
+        df_joined = df_joined.dropna().reset_index(drop=True)
+    return df_joined
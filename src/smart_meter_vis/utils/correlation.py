@@ -0,0 +1,792 @@
+"""Correlate electricity usage with weather features in one streaming pass.
+
+Usage and weather are joined in SQLite and read in chunks. Each chunk
+updates the sufficient statistics of all columns: the row count, the means
+and the co-moments (centred sums of squares and cross-products). The whole
+correlation vector follows from these statistics, so memory use depends on
+the number of features, not on the length of the history.
+
+The statistics can also be kept in the database, one row per meter and
+month. Triggers log every change of the usage and weather tables, so later
+runs only recompute the months that changed and merge the stored rest
+(see update_correlation_stats()).
+"""
+import json
+import sqlite3
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from smart_meter_vis.utils import utils
+
+# Weather columns correlated with usage
+FEATURES = [
+    "temp_min",
+    "temp_max",
+    # "temp_median_no_minmax",
+    # "temp_median",
+    "temp_morning",
+    "temp_afternoon",
+    "temp_evening",
+    "temp_night",
+    "humidity",
+    "precipitation",
+    "wind_speed",
+    "wind_direction",
+    ]
+
+# Rows read from SQLite per chunk
+CHUNK_SIZE = 10_000
+
+# Change log filled by triggers (see create_change_triggers()); 'period' is the month ('YYYY-MM').
+# AUTOINCREMENT: ids of pruned rows are never assigned again, so a stored change id stays valid
+COLUMNS_CHANGES = {
+    "change_id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "dimension_id": "TEXT",  # meter_id or location_id of the changed row
+    "period": "TEXT",
+    }
+
+# Stored statistics per meter, location and month, and the last change processed
+COLUMNS_STATS = {
+    "meter_id": "TEXT NOT NULL",
+    "location_id": "TEXT NOT NULL",
+    "period": "TEXT NOT NULL",
+    "features": "TEXT",  # JSON list; rows for other features are recomputed
+    "count": "INTEGER",
+    "mean": "TEXT",  # JSON list: usage_kwh, then the features
+    "comoment": "TEXT",  # JSON matrix, same order
+    }
+CONSTRAINTS_STATS = ["PRIMARY KEY (meter_id, location_id, period)"]
+COLUMNS_SYNC = {
+    "meter_id": "TEXT NOT NULL",
+    "location_id": "TEXT NOT NULL",
+    "features": "TEXT",
+    "usage_change_id": "INTEGER",
+    "weather_change_id": "INTEGER",
+    }
+CONSTRAINTS_SYNC = ["PRIMARY KEY (meter_id, location_id)"]
+
+
+class CorrelationStats:
+    """Running count, means and co-moments of a fixed set of columns.
+
+    Chunks are combined with the pairwise update of Chan et al., which stays
+    accurate where raw sums of squares would cancel out (e.g. temperatures
+    around a large mean). Statistics of separate parts of the data can be
+    combined with merge().
+    """
+
+    def __init__(self, n_columns: int) -> None:
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self.comoment = np.zeros((n_columns, n_columns))
+
+    def update(self, values: np.ndarray) -> None:
+        """Add the rows of a 2D array (one column per statistic, no NaN)."""
+        if not len(values):
+            return
+        chunk = CorrelationStats(values.shape[1])
+        chunk.count = len(values)
+        chunk.mean = values.mean(axis=0)
+        centred = values - chunk.mean
+        chunk.comoment = centred.T @ centred
+        self.merge(chunk)
+
+    def merge(self, other: "CorrelationStats") -> None:
+        """Add the statistics of other rows."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment += other.comoment + np.outer(delta, delta) * (self.count * other.count / count)
+        self.mean += delta * (other.count / count)
+        self.count = count
+
+    def correlation_matrix(self) -> np.ndarray:
+        """Return the Pearson correlation matrix (NaN for constant columns)."""
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.comoment / np.outer(std, std)
+
+
+def read_joined_chunks(
+        folder_db: str,
+        name_db_usage: str,
+        name_table_usage: str,
+        name_db_weather: str,
+        name_table_weather: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str],
+        chunk_size: int = CHUNK_SIZE,
+        date_range: tuple[str, str] | None = None,
+        complete_only: bool = True,
+        ) -> Iterator[pd.DataFrame]:
+    """Yield the days with usage and all weather features in chunks, ordered by date.
+
+    The join runs in SQLite (the weather database is attached if it is a
+    separate file); days with a missing value are left out unless
+    'complete_only' is False.
+
+    Args:
+        folder_db (str): The path to the directory containing the database files.
+        name_db_usage (str): The database file with the usage table.
+        name_table_usage (str): The daily usage table ('meter_id', 'usage_date', 'usage_kwh').
+        name_db_weather (str): The database file with the weather table.
+        name_table_weather (str): The weather table ('location_id', 'weather_date', features).
+        meter_id (str): The meter whose usage is read.
+        location_id (str): The location whose weather is read.
+        features (list[str]): The weather columns to read.
+        chunk_size (int): The number of rows per chunk.
+        date_range (tuple[str, str] | None): Only read days from the first
+            date (inclusive) to the second (exclusive), e.g. one month.
+        complete_only (bool): Leave out days without usage or with a missing
+            feature. Otherwise all days with usage are read, with NaN for
+            missing values (e.g. for lagged correlations).
+
+    Yields:
+        pd.DataFrame: The columns 'usage_date' (str), 'usage_kwh' and
+        'features'. At least one chunk is yielded, empty if no day matches.
+    """
+    columns = ["usage_kwh", *features]
+    cursor = _execute_joined_query(
+        folder_db=folder_db,
+        name_db_usage=name_db_usage,
+        name_table_usage=name_table_usage,
+        name_db_weather=name_db_weather,
+        name_table_weather=name_table_weather,
+        meter_id=meter_id,
+        location_id=location_id,
+        features=features,
+        date_range=date_range,
+        complete_only=complete_only,
+        )
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        df_chunk = pd.DataFrame.from_records(rows, columns=["usage_date", *columns])
+        df_chunk[columns] = df_chunk[columns].astype("float64")
+        yield df_chunk
+        if len(rows) < chunk_size:
+            break
+
+
+def read_joined_array(
+        folder_db: str,
+        name_db_usage: str,
+        name_table_usage: str,
+        name_db_weather: str,
+        name_table_weather: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str] = FEATURES,
+        ) -> np.ndarray:
+    """Return the days with usage and all weather features as one float array.
+
+    Rows are converted from the SQLite cursor straight into NumPy, without
+    a DataFrame or Series per column. Arguments as for read_joined_chunks().
+
+    Returns:
+        np.ndarray: One row per day, ordered by date; the columns are
+        'usage_kwh' followed by 'features'.
+    """
+    cursor = _execute_joined_query(
+        folder_db=folder_db,
+        name_db_usage=name_db_usage,
+        name_table_usage=name_table_usage,
+        name_db_weather=name_db_weather,
+        name_table_weather=name_table_weather,
+        meter_id=meter_id,
+        location_id=location_id,
+        features=features,
+        select_date=False,
+        )
+    return np.array(cursor.fetchall(), dtype="float64").reshape(-1, 1 + len(features))
+
+
+def _execute_joined_query(
+        folder_db: str,
+        name_db_usage: str,
+        name_table_usage: str,
+        name_db_weather: str,
+        name_table_weather: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str],
+        date_range: tuple[str, str] | None = None,
+        complete_only: bool = True,
+        select_date: bool = True,
+        ) -> sqlite3.Cursor:
+    """Run the join of usage and weather used by read_joined_chunks() and read_joined_array()."""
+    schema_weather = utils.sql_attach_database(
+        folder_db=folder_db,
+        name_db=name_db_usage,
+        name_db_attach=name_db_weather,
+        alias="weather_db",
+        )
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db_usage)
+
+    columns_select_str = ", ".join(["u.usage_date"] * select_date + ["u.usage_kwh"] + [f"w.{feature}" for feature in features])
+    conditions = ["u.meter_id = ?"]
+    if complete_only:
+        conditions += ["u.usage_kwh IS NOT NULL", *(f"w.{feature} IS NOT NULL" for feature in features)]
+    values = [location_id, meter_id]
+    if date_range is not None:
+        conditions.append("u.usage_date >= ? AND u.usage_date < ?")
+        values += list(date_range)
+    query = f"""
+            SELECT {columns_select_str}
+            FROM {name_table_usage} u
+            {"JOIN" if complete_only else "LEFT JOIN"} {schema_weather}.{name_table_weather} w
+                ON w.weather_date = u.usage_date AND w.location_id = ?
+            WHERE {" AND ".join(conditions)}
+            ORDER BY u.usage_date
+            """
+    return conn.execute(query, values)
+
+
+def stream_correlations(
+        folder_db: str,
+        name_db_usage: str,
+        name_table_usage: str,
+        name_db_weather: str,
+        name_table_weather: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str] = FEATURES,
+        chunk_size: int = CHUNK_SIZE,
+        ) -> tuple[pd.DataFrame, int]:
+    """Correlate the daily usage of a meter with each weather feature of its location.
+
+    Rows are streamed with read_joined_chunks() into a CorrelationStats, so
+    only one chunk is held in memory at a time. Arguments as for
+    read_joined_chunks().
+
+    Returns:
+        tuple[pd.DataFrame, int]: The columns 'target' (feature),
+        'correlation' and 'Abs correlation', sorted by the absolute
+        correlation (strongest first), and the number of days used.
+    """
+    stats = CorrelationStats(1 + len(features))
+    for df_chunk in read_joined_chunks(
+            folder_db=folder_db,
+            name_db_usage=name_db_usage,
+            name_table_usage=name_table_usage,
+            name_db_weather=name_db_weather,
+            name_table_weather=name_table_weather,
+            meter_id=meter_id,
+            location_id=location_id,
+            features=features,
+            chunk_size=chunk_size,
+            ):
+        stats.update(df_chunk[["usage_kwh", *features]].to_numpy())
+    return correlation_frame(stats=stats, features=features), stats.count
+
+
+def correlation_frame(stats: CorrelationStats, features: list[str]) -> pd.DataFrame:
+    """Return the correlations of usage (first column of 'stats') with each feature, strongest first."""
+    df_correlations = pd.DataFrame({
+        "target": features,
+        "correlation": stats.correlation_matrix()[0, 1:] if stats.count else np.nan,
+        })
+    df_correlations["Abs correlation"] = df_correlations["correlation"].abs()
+    return df_correlations.sort_values("Abs correlation", ascending=False)
+
+
+def create_change_triggers(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        name_table_changes: str,
+        dimension_column: str,
+        date_column: str,
+        name_triggers: str | None = None,
+        ) -> None:
+    """Log the month of every inserted, updated or deleted row of a table.
+
+    Creates the change log table (COLUMNS_CHANGES) and the triggers if they
+    don't exist yet. Rebuilding the table (see utils.migrations) drops its
+    triggers; they are created again on the next call.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The table to watch, e.g. 'electricity'.
+        name_table_changes (str): The change log table, e.g. 'electricity_changes'.
+        dimension_column (str): The column identifying the meter or location.
+        date_column (str): The date column ('YYYY-MM-DD').
+        name_triggers (str | None): The prefix of the trigger names, 'name_table'
+            by default. Each change log of a table needs its own prefix.
+    """
+    if name_triggers is None:
+        name_triggers = name_table
+    utils.create_sql_table(
+        folder_db=folder_db,
+        name_db=name_db,
+        name_table=name_table_changes,
+        columns_name_type=COLUMNS_CHANGES,
+        add_id=False,
+        )
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+
+    def log_row(row: str) -> str:
+        return f"""
+                INSERT INTO {name_table_changes} (dimension_id, period)
+                VALUES ({row}.{dimension_column}, substr({row}.{date_column}, 1, 7));"""
+
+    triggers = {
+        "insert": log_row("NEW"),
+        "update": log_row("OLD") + log_row("NEW"),
+        "delete": log_row("OLD"),
+        }
+    for event, statements in triggers.items():
+        conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {name_triggers}_log_{event}
+                AFTER {event.upper()} ON {name_table}
+                BEGIN{statements}
+                END
+                """)
+    conn.commit()
+
+
+def drop_change_triggers(
+        folder_db: str,
+        name_db: str,
+        name_table_changes: str,
+        name_triggers: str,
+        ) -> None:
+    """Stop logging changes: drop the triggers of create_change_triggers() and their change log.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table_changes (str): The change log table, e.g. 'electricity_store_changes'.
+        name_triggers (str): The prefix of the trigger names, as for create_change_triggers().
+    """
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    for event in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name_triggers}_log_{event}")
+    conn.execute(f"DROP TABLE IF EXISTS {name_table_changes}")
+    conn.commit()
+
+
+def update_correlation_stats(
+        folder_db: str,
+        name_db_usage: str,
+        name_table_usage: str,
+        name_table_usage_changes: str,
+        name_db_weather: str,
+        name_table_weather: str,
+        name_table_weather_changes: str,
+        name_table_stats: str,
+        name_table_sync: str,
+        meter_id: str,
+        location_id: str,
+        features: list[str] = FEATURES,
+        rebuild: bool = False,
+        ) -> tuple[pd.DataFrame, int]:
+    """Bring the stored statistics up to date and return the correlations.
+
+    Only months with logged changes since the last call are recomputed
+    from the joined rows; all other months come from the stats table, so
+    the cost depends on the number of changed rows, not on the length of
+    the history. Everything is recomputed on the first call, with
+    'rebuild', or if 'features' changed.
+
+    Args:
+        folder_db (str): The path to the directory containing the database files.
+        name_db_usage (str): The database file with the usage table, its
+            change log and the stats tables.
+        name_table_usage (str): The daily usage table.
+        name_table_usage_changes (str): The change log of the usage table.
+        name_db_weather (str): The database file with the weather table and its change log.
+        name_table_weather (str): The weather table.
+        name_table_weather_changes (str): The change log of the weather table.
+        name_table_stats (str): The table with statistics per month (COLUMNS_STATS).
+        name_table_sync (str): The table with the last change processed (COLUMNS_SYNC).
+        meter_id (str): The meter whose usage is correlated.
+        location_id (str): The location whose weather is correlated.
+        features (list[str]): The weather columns to correlate.
+        rebuild (bool): Recompute all months.
+
+    Returns:
+        tuple[pd.DataFrame, int]: As for stream_correlations().
+    """
+    schema_weather = utils.sql_attach_database(
+        folder_db=folder_db,
+        name_db=name_db_usage,
+        name_db_attach=name_db_weather,
+        alias="weather_db",
+        )
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db_usage)
+    features_json = json.dumps(features)
+    key = (meter_id, location_id)
+
+    # Changes logged up to now; later changes are picked up by the next call
+    usage_change_id = conn.execute(f"SELECT COALESCE(MAX(change_id), 0) FROM {name_table_usage_changes}").fetchone()[0]
+    weather_change_id = conn.execute(
+        f"SELECT COALESCE(MAX(change_id), 0) FROM {schema_weather}.{name_table_weather_changes}",
+        ).fetchone()[0]
+
+    sync = conn.execute(
+        f"SELECT features, usage_change_id, weather_change_id FROM {name_table_sync} WHERE meter_id = ? AND location_id = ?",
+        key,
+        ).fetchone()
+    full_rebuild = rebuild or sync is None or sync[0] != features_json
+    if full_rebuild:
+        conn.execute(f"DELETE FROM {name_table_stats} WHERE meter_id = ? AND location_id = ?", key)
+        periods = []
+    else:
+        periods = conn.execute(
+            f"""
+            SELECT period FROM {name_table_usage_changes}
+            WHERE dimension_id = ? AND change_id > ? AND change_id <= ?
+            UNION
+            SELECT period FROM {schema_weather}.{name_table_weather_changes}
+            WHERE dimension_id = ? AND change_id > ? AND change_id <= ?
+            """,
+            (meter_id, sync[1], usage_change_id, location_id, sync[2], weather_change_id),
+            ).fetchall()
+
+    # Recompute the changed months: one pass over all rows for a rebuild, else one query per month
+    chunk_params = {
+        "folder_db": folder_db,
+        "name_db_usage": name_db_usage,
+        "name_table_usage": name_table_usage,
+        "name_db_weather": name_db_weather,
+        "name_table_weather": name_table_weather,
+        "meter_id": meter_id,
+        "location_id": location_id,
+        "features": features,
+        }
+    periods = [period for (period, ) in periods if period is not None]
+    if full_rebuild:
+        chunk_readers = [read_joined_chunks(**chunk_params)]
+    else:
+        month_starts = [pd.Timestamp(f"{period}-01") for period in periods]
+        chunk_readers = [
+            read_joined_chunks(**chunk_params, date_range=(
+                month_start.strftime("%Y-%m-%d"),
+                (month_start + pd.offsets.MonthBegin()).strftime("%Y-%m-%d"),
+                ))
+            for month_start in month_starts
+            ]
+
+    # Months without complete days keep a row with count 0
+    stats_by_period = {period: CorrelationStats(1 + len(features)) for period in periods}
+    for chunks in chunk_readers:
+        for df_chunk in chunks:
+            for period, df_period in df_chunk.groupby(df_chunk["usage_date"].str[:7]):
+                stats_by_period.setdefault(period, CorrelationStats(1 + len(features))).update(
+                    df_period[["usage_kwh", *features]].to_numpy(),
+                    )
+    conn.executemany(
+        f"""
+        INSERT OR REPLACE INTO {name_table_stats} (meter_id, location_id, period, features, count, mean, comoment)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (*key, period, features_json, stats.count, json.dumps(stats.mean.tolist()), json.dumps(stats.comoment.tolist()))
+            for period, stats in stats_by_period.items()
+            ],
+        )
+
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO {name_table_sync} (meter_id, location_id, features, usage_change_id, weather_change_id)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (*key, features_json, usage_change_id, weather_change_id),
+        )
+    # Each meter's usage changes are read by that meter only (weather changes: prune_weather_changes())
+    conn.execute(
+        f"DELETE FROM {name_table_usage_changes} WHERE dimension_id = ? AND change_id <= ?",
+        (meter_id, usage_change_id),
+        )
+    conn.commit()
+
+    # Merge the months
+    stats = CorrelationStats(1 + len(features))
+    query = f"SELECT count, mean, comoment FROM {name_table_stats} WHERE meter_id = ? AND location_id = ? AND count > 0"
+    for count, mean, comoment in conn.execute(query, key).fetchall():
+        stats_month = CorrelationStats(1 + len(features))
+        stats_month.count = count
+        stats_month.mean = np.array(json.loads(mean))
+        stats_month.comoment = np.array(json.loads(comoment))
+        stats.merge(stats_month)
+    return correlation_frame(stats=stats, features=features), stats.count
+
+
+def prune_weather_changes(
+        folder_db: str,
+        name_db_weather: str,
+        name_table_weather_changes: str,
+        name_dbs_usage: list[str],
+        name_table_sync: str,
+        location_id: str,
+        ) -> int:
+    """Delete the weather changes of a location that all of its meters have processed.
+
+    The weather of a location is shared by its meters, so its changes are
+    kept up to the smallest weather change id stored for any of them. A
+    meter without a row in the sync table recomputes everything on its
+    first update and needs no changes.
+
+    Args:
+        folder_db (str): The path to the directory containing the database files.
+        name_db_weather (str): The database file with the weather change log.
+        name_table_weather_changes (str): The change log of the weather table.
+        name_dbs_usage (list[str]): The database files with the sync tables of
+            the location's meters.
+        name_table_sync (str): The table with the last change processed (COLUMNS_SYNC).
+        location_id (str): The location whose changes are pruned.
+
+    Returns:
+        int: The number of changes deleted.
+    """
+    weather_change_ids = []
+    for name_db_usage in name_dbs_usage:
+        conn_usage = utils.get_sql_connection(folder_db=folder_db, name_db=name_db_usage)
+        weather_change_ids.extend(
+            weather_change_id for (weather_change_id, ) in conn_usage.execute(
+                f"SELECT weather_change_id FROM {name_table_sync} WHERE location_id = ?",
+                (location_id, ),
+                ).fetchall()
+            )
+    if not weather_change_ids:
+        return 0
+
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db_weather)
+    cursor = conn.execute(
+        f"DELETE FROM {name_table_weather_changes} WHERE dimension_id = ? AND change_id <= ?",
+        (location_id, min(weather_change_ids)),
+        )
+    conn.commit()
+    return cursor.rowcount
+
+
+def verify_correlation_stats(
+        df_correlations: pd.DataFrame,
+        count: int,
+        df_correlations_full: pd.DataFrame,
+        count_full: int,
+        tolerance: float = 1e-9,
+        ) -> bool:
+    """Compare stored statistics with a full recomputation.
+
+    Args:
+        df_correlations (pd.DataFrame): The result of update_correlation_stats().
+        count (int): The number of days of update_correlation_stats().
+        df_correlations_full (pd.DataFrame): The result of stream_correlations().
+        count_full (int): The number of days of stream_correlations().
+        tolerance (float): The largest accepted difference of a correlation.
+
+    Returns:
+        bool: True if the number of days and all correlations match.
+    """
+    correlations = df_correlations.set_index("target")["correlation"]
+    correlations_full = df_correlations_full.set_index("target")["correlation"].reindex(correlations.index)
+    both_nan = correlations.isna() & correlations_full.isna()
+    close = (correlations - correlations_full).abs() <= tolerance
+    return count == count_full and bool((both_nan | close).all())
+
+
+def rolling_lagged_correlations(
+        data: pd.DataFrame,
+        features: list[str] = FEATURES,
+        windows: list[int] = (30, 90),
+        lags: list[int] = (0, 1, 2),
+        min_periods: int | None = None,
+        ) -> pd.DataFrame:
+    """Correlate usage with each feature over rolling windows and with lagged features.
+
+    For lag L, usage on day t is paired with the feature on day t - L
+    (calendar days; missing days count as missing values). For window W,
+    the correlation on day t uses the pairs of the days t - W + 1 to t with
+    both values present. All windows, lags and features are computed at
+    once from cumulative sums (count, sums, sums of squares and
+    cross-products) of 3D arrays (lag x day x feature); window sums are
+    differences of cumulative sums, so the cost doesn't depend on the window
+    size. Values are centred by their means first to limit cancellation.
+
+    Args:
+        data (pd.DataFrame): Daily rows with the columns 'usage_date',
+            'usage_kwh' and 'features', e.g. from read_joined_chunks() with
+            complete_only=False.
+        features (list[str]): The feature columns to correlate.
+        windows (list[int]): Window lengths in days.
+        lags (list[int]): Lags of the features in days (0 for the same day).
+        min_periods (int | None): The minimum number of pairs in a window;
+            fewer give NaN. Defaults to half the window.
+
+    Returns:
+        pd.DataFrame: One row per calendar day (index 'usage_date') and one
+        column per (window, lag, feature).
+    """
+    windows = list(windows)
+    lags = list(lags)
+
+    # One row per calendar day, so that shifts and windows count days
+    series = data.assign(usage_date=pd.to_datetime(data["usage_date"])).set_index("usage_date")
+    days = pd.date_range(series.index.min(), series.index.max(), freq="D") if len(series) else pd.DatetimeIndex([])
+    series = series.reindex(days)
+    usage = series["usage_kwh"].to_numpy(dtype="float64")
+    values = series[features].to_numpy(dtype="float64")
+    n_days = len(days)
+
+    # Centre to keep the sums small
+    usage = usage - np.nanmean(usage) if n_days else usage
+    values = values - np.nanmean(values, axis=0) if n_days else values
+
+    # Lagged features: lag x day x feature, NaN before the first day
+    lag_max = max(lags, default=0)
+    values_padded = np.vstack([np.full((lag_max, len(features)), np.nan), values])
+    lag_index = (lag_max - np.array(lags))[:, None] + np.arange(n_days)[None, :]
+    x = values_padded[lag_index]
+    y = np.broadcast_to(usage[None, :, None], x.shape)
+
+    # Only days with both values count
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+
+    # Cumulative sums with a leading zero along the day axis
+    def cumulative(array: np.ndarray) -> np.ndarray:
+        return np.concatenate([np.zeros_like(array[:, :1]), np.cumsum(array, axis=1)], axis=1)
+
+    sums = {
+        "n": cumulative(valid.astype("float64")),
+        "x": cumulative(x),
+        "y": cumulative(y),
+        "xx": cumulative(x * x),
+        "yy": cumulative(y * y),
+        "xy": cumulative(x * y),
+        }
+
+    # Window sums for all windows: window x lag x day x feature
+    index_end = np.arange(1, n_days + 1)
+    index_start = np.clip(index_end[None, :] - np.array(windows)[:, None], 0, None)
+    window_sums = {
+        name: total[:, index_end][None] - total[:, index_start].swapaxes(0, 1)
+        for name, total in sums.items()
+        }
+    n = window_sums["n"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = n * window_sums["xy"] - window_sums["x"] * window_sums["y"]
+        variance_x = n * window_sums["xx"] - window_sums["x"] ** 2
+        variance_y = n * window_sums["yy"] - window_sums["y"] ** 2
+        correlations = covariance / np.sqrt(variance_x * variance_y)
+
+    # Require enough pairs per window
+    if min_periods is None:
+        min_periods_windows = np.array([max(2, window // 2) for window in windows])
+    else:
+        min_periods_windows = np.full(len(windows), max(2, min_periods))
+    correlations[n < min_periods_windows[:, None, None, None]] = np.nan
+
+    # window x lag x day x feature -> day x (window, lag, feature)
+    columns = pd.MultiIndex.from_product([windows, lags, features], names=["window", "lag", "feature"])
+    return pd.DataFrame(
+        correlations.transpose(2, 0, 1, 3).reshape(n_days, len(columns)),
+        index=pd.DatetimeIndex(days, name="usage_date"),
+        columns=columns,
+        )
+
+
+def latest_strongest(df_rolling: pd.DataFrame) -> pd.DataFrame:
+    """Return the strongest feature per window and lag on the last day of rolling_lagged_correlations().
+
+    Returns:
+        pd.DataFrame: The columns 'window', 'lag', 'feature' and
+        'correlation'; windows and lags without any value are left out.
+    """
+    latest = df_rolling.iloc[-1].dropna() if len(df_rolling) else pd.Series(dtype="float64")
+    if latest.empty:
+        return pd.DataFrame(columns=["window", "lag", "feature", "correlation"])
+    strongest = latest.loc[latest.abs().groupby(level=["window", "lag"]).idxmax()]
+    return strongest.rename("correlation").reset_index()
+
+
+def rank_columns(values: np.ndarray) -> np.ndarray:
+    """Return the rank of each value within its column (ties get their average rank, starting at 1).
+
+    All columns are ranked at once: one sort along the rows, then the
+    positions of equal values are averaged with a single np.bincount().
+    """
+    n_rows, n_columns = values.shape
+    order = np.argsort(values, axis=0, kind="stable")
+    values_sorted = np.take_along_axis(values, order, axis=0)
+
+    # Number the runs of equal values, unique over all columns
+    run_starts = np.ones_like(values_sorted, dtype=bool)
+    run_starts[1:] = values_sorted[1:] != values_sorted[:-1]
+    run_ids = np.cumsum(run_starts, axis=0) - 1 + np.arange(n_columns) * n_rows
+    positions = np.broadcast_to(np.arange(1, n_rows + 1, dtype="float64")[:, None], values.shape)
+    rank_by_run = np.bincount(run_ids.ravel(), weights=positions.ravel()) / np.maximum(np.bincount(run_ids.ravel()), 1)
+
+    ranks = np.empty_like(values_sorted, dtype="float64")
+    np.put_along_axis(ranks, order, rank_by_run[run_ids], axis=0)
+    return ranks
+
+
+def correlation_kernel(values: np.ndarray) -> dict[str, np.ndarray]:
+    """Correlate the first column with each other column, by three methods at once.
+
+    'pearson' and 'spearman' (Pearson of the ranks) come from one
+    correlation matrix each. 'partial' is the correlation with a feature
+    after removing the linear effect of all other features, read off the
+    (pseudo-)inverse of the Pearson matrix; it separates collinear features
+    such as the temperatures of the day.
+
+    Args:
+        values (np.ndarray): One row per day without NaN; usage first, then the features.
+
+    Returns:
+        dict[str, np.ndarray]: The correlations with each feature by method
+        ('pearson', 'spearman', 'partial'); NaN if there are too few rows.
+    """
+    n_features = values.shape[1] - 1
+    if len(values) < 3:
+        return {method: np.full(n_features, np.nan) for method in ["pearson", "spearman", "partial"]}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pearson = np.corrcoef(values, rowvar=False)
+        spearman = np.corrcoef(rank_columns(values), rowvar=False)
+        # Constant columns have no correlation; leave them out of the inverse
+        constant = np.isnan(np.diag(pearson))
+        pearson_filled = np.where(np.isnan(pearson), 0.0, pearson)
+        pearson_filled[np.diag_indices_from(pearson_filled)] = 1.0
+        precision = np.linalg.pinv(pearson_filled)
+        partial = -precision[0] / np.sqrt(precision[0, 0] * np.diag(precision))
+    partial[constant] = np.nan
+
+    return {
+        "pearson": pearson[0, 1:],
+        "spearman": spearman[0, 1:],
+        "partial": partial[1:],
+        }
+
+
+def correlation_table(
+        values: np.ndarray,
+        features: list[str] = FEATURES,
+        rank_by: str = "pearson",
+        ) -> pd.DataFrame:
+    """Return the Pearson, Spearman and partial correlations of usage with each feature, ranked.
+
+    Args:
+        values (np.ndarray): As for correlation_kernel(), e.g. from read_joined_array().
+        features (list[str]): The names of the feature columns.
+        rank_by (str): The method ordering the table by its absolute value:
+            'pearson', 'spearman' or 'partial'.
+
+    Returns:
+        pd.DataFrame: The columns 'target' (feature), 'pearson', 'spearman',
+        'partial' and 'Abs correlation' (of 'rank_by'), strongest first.
+    """
+    correlations = correlation_kernel(values)
+    if rank_by not in correlations:
+        raise ValueError(f"Unknown correlation method {rank_by!r}, expected one of {list(correlations)}")
+    df_correlations = pd.DataFrame({"target": features, **correlations})
+    df_correlations["Abs correlation"] = df_correlations[rank_by].abs()
+    return df_correlations.sort_values("Abs correlation", ascending=False)
@@ -0,0 +1,112 @@
+"""Reduce long time series to a fixed number of points for plotting.
+
+A browser can't draw millions of points interactively, and a chart is only
+about 2000 pixels wide anyway. Two methods select which rows to keep:
+
+* LTTB ("largest triangle three buckets", Steinarsson 2013) keeps the point
+  per bucket that spans the largest triangle with its neighbours, which
+  preserves the visual shape of the line.
+* Min-max decimation keeps the lowest and highest point per bucket, so no
+  peak is lost (e.g. for usage spikes).
+
+Rows without a value are dropped first.
+"""
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Return the indices of the points kept by LTTB, in order.
+
+    Args:
+        x (np.ndarray): Ascending x values (numbers or datetime64).
+        y (np.ndarray): The y values, without NaN.
+        n_out (int): The number of points to keep (at least 3).
+
+    Returns:
+        np.ndarray: 'n_out' indices including the first and the last point,
+        or all indices if there are no more than 'n_out' points.
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = x.astype("int64").astype("float64") if np.issubdtype(x.dtype, np.datetime64) else x.astype("float64")
+    y = y.astype("float64")
+
+    # Buckets between the first and the last point; the last point is a bucket of its own
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype("int64"), n)
+    cumsum_x = np.concatenate([[0.0], np.cumsum(x)])
+    cumsum_y = np.concatenate([[0.0], np.cumsum(y)])
+    mean_x = (cumsum_x[edges[1:]] - cumsum_x[edges[:-1]]) / (edges[1:] - edges[:-1])
+    mean_y = (cumsum_y[edges[1:]] - cumsum_y[edges[:-1]]) / (edges[1:] - edges[:-1])
+
+    selected = np.empty(n_out, dtype="int64")
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Triangle of the previously selected point, a candidate and the mean of the next bucket
+        area = np.abs(
+            (x[a] - mean_x[bucket + 1]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (mean_y[bucket + 1] - y[a])
+            )
+        a = start + int(np.argmax(area))
+        selected[bucket + 1] = a
+    return selected
+
+
+def min_max_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Return the indices of the lowest and highest point per bucket, in order.
+
+    All buckets are handled at once: the rows are sorted by bucket and
+    value, so each bucket's minimum and maximum are its first and last row.
+
+    Args:
+        y (np.ndarray): The y values, without NaN.
+        n_out (int): The maximum number of points to keep (two per bucket).
+
+    Returns:
+        np.ndarray: The indices including the first and the last point, or
+        all indices if there are no more than 'n_out' points.
+    """
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+    n_buckets = (n_out - 2) // 2
+    edges = np.linspace(0, n, n_buckets + 1).astype("int64")
+    bucket_ids = np.repeat(np.arange(n_buckets), np.diff(edges))
+    order = np.lexsort((y, bucket_ids))
+    return np.unique(np.concatenate([[0, n - 1], order[edges[:-1]], order[edges[1:] - 1]]))
+
+
+def downsample(
+        data: pd.DataFrame,
+        x_column: str,
+        y_column: str,
+        n_out: int | None = 2000,
+        method: str = "lttb",
+        ) -> pd.DataFrame:
+    """Return at most 'n_out' rows of a time series that look like the full series.
+
+    Args:
+        data (pd.DataFrame): The series, ascending in 'x_column'.
+        x_column (str): The column with the x values (e.g. dates).
+        y_column (str): The column with the y values.
+        n_out (int | None): The number of points to keep. None keeps all rows.
+        method (str): 'lttb' or 'minmax'.
+
+    Returns:
+        pd.DataFrame: The selected rows (all columns), in order.
+    """
+    data = data[data[y_column].notna()]
+    if n_out is None or len(data) <= n_out:
+        return data
+    y = data[y_column].to_numpy(dtype="float64")
+    if method == "lttb":
+        indices = lttb_indices(x=data[x_column].to_numpy(), y=y, n_out=n_out)
+    elif method == "minmax":
+        indices = min_max_indices(y=y, n_out=n_out)
+    else:
+        raise ValueError(f"Unknown downsampling method {method!r}, expected 'lttb' or 'minmax'")
+    return data.iloc[indices]
@@ -0,0 +1,166 @@
+"""Ingest ledger: remember which part of each CSV file has been stored.
+
+For every file the ledger keeps its size, modification time, the number of
+bytes processed (always the end of a complete line) and a hash of those
+bytes. On the next run unchanged files are skipped without reading them,
+files that only grew are parsed from the processed offset and files whose
+processed part changed are parsed again in full.
+"""
+import hashlib
+import io
+import os
+import time
+
+import pandas as pd
+
+from smart_meter_vis.utils import utils
+
+# Table definition for the ledger (one row per meter and file)
+COLUMNS_LEDGER = {
+    "meter_id": "TEXT NOT NULL",
+    "path": "TEXT NOT NULL",
+    "size_bytes": "INTEGER",
+    "mtime_ns": "INTEGER",
+    "offset_bytes": "INTEGER",  # end of the last complete line processed
+    "content_hash": "TEXT",  # sha256 of the first offset_bytes bytes
+    "rows_processed": "INTEGER",
+    }
+CONSTRAINTS_LEDGER = ["PRIMARY KEY (meter_id, path)"]
+
+# Size of the blocks read while hashing
+_CHUNK_SIZE = 1 << 20
+
+# A last line without a line break is only read from a file that hasn't changed for this
+# long (seconds); in a file that is still being written it may be cut off
+STABLE_AFTER_S = 2.0
+
+
+def get_ledger(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        meter_id: str,
+        ) -> dict[str, dict]:
+    """Return the ledger entries of a meter by file path.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the ledger table (COLUMNS_LEDGER).
+        meter_id (str): The meter whose files are looked up.
+
+    Returns:
+        dict[str, dict]: The columns of COLUMNS_LEDGER (except 'meter_id' and
+        'path') by path.
+    """
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    columns = [column for column in COLUMNS_LEDGER if column != "meter_id"]
+    cursor = conn.execute(
+        f"SELECT {", ".join(columns)} FROM {name_table} WHERE meter_id = ?",
+        (meter_id, ),
+        )
+    return {row[0]: dict(zip(columns[1:], row[1:])) for row in cursor.fetchall()}
+
+
+def read_csv_increment(
+        path_abs: str,
+        entry: dict | None = None,
+        ) -> tuple[io.BytesIO | None, dict]:
+    """Read the part of a CSV file that hasn't been processed yet.
+
+    The file is skipped if its size and modification time match the ledger
+    entry. Otherwise its processed part is hashed and compared to the entry:
+    if it is unchanged, only the bytes after it are returned (file grew),
+    else the whole file (file was rewritten). Either way the file is read
+    once. A last line without a line break is only returned at the end of
+    a stable file (unchanged while read and for STABLE_AFTER_S), and never
+    counted as processed, so it is read again if the file grows. In a
+    file that is still being written it is left for the next call.
+
+    Args:
+        path_abs (str): The absolute path to the CSV file.
+        entry (dict | None): The file's ledger entry from get_ledger(), if any.
+
+    Returns:
+        tuple[io.BytesIO | None, dict]: The header line followed by the new
+        lines (None if the file is unchanged) and the new ledger entry.
+    """
+    stat = os.stat(path_abs)
+    if entry and entry["size_bytes"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return None, entry
+
+    with open(path_abs, mode="rb") as f:  # noqa: PTH123
+        digest = hashlib.sha256()
+        rows_processed = 0
+        # Hash the processed part and check whether it is unchanged
+        if entry and entry["offset_bytes"] <= stat.st_size:
+            remaining = entry["offset_bytes"]
+            while remaining:
+                chunk = f.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if digest.hexdigest() == entry["content_hash"]:
+                rows_processed = entry["rows_processed"]
+            else:
+                f.seek(0)
+                digest = hashlib.sha256()
+
+        offset_start = f.tell()
+        data_new = f.read()
+        if offset_start:
+            f.seek(0)
+            header = f.readline()
+        else:
+            header = b""
+        stat_after = os.fstat(f.fileno())
+
+    # Only complete lines count as processed
+    data_complete = data_new[:data_new.rfind(b"\n") + 1]
+    file_stable = (
+        (stat_after.st_size, stat_after.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+        and offset_start + len(data_new) == stat.st_size
+        and time.time() - stat.st_mtime_ns / 1e9 >= STABLE_AFTER_S
+        )
+    digest.update(data_complete)
+    rows_new = data_complete.count(b"\n")
+    if not offset_start and rows_new:
+        rows_new -= 1  # header line
+
+    entry_new = {
+        # A file whose last line was left out must not be skipped as unchanged next time
+        "size_bytes": stat.st_size if file_stable else offset_start + len(data_complete),
+        "mtime_ns": stat.st_mtime_ns,
+        "offset_bytes": offset_start + len(data_complete),
+        "content_hash": digest.hexdigest(),
+        "rows_processed": rows_processed + rows_new,
+        }
+    return io.BytesIO(header + (data_new if file_stable else data_complete)), entry_new
+
+
+def record_ingest(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        meter_id: str,
+        entries: dict[str, dict],
+        ) -> None:
+    """Store ledger entries once their rows have been written to the database.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the ledger table (COLUMNS_LEDGER).
+        meter_id (str): The meter the files belong to.
+        entries (dict[str, dict]): The entries from read_csv_increment() by path.
+    """
+    if not entries:
+        return
+    utils.sql_upsert_rows(
+        folder_db=folder_db,
+        name_db=name_db,
+        name_table=name_table,
+        key_column=["meter_id", "path"],
+        data=pd.DataFrame([{"meter_id": meter_id, "path": path, **entry} for path, entry in entries.items()]),
+        )
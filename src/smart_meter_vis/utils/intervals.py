@@ -0,0 +1,308 @@
+"""Store sub-daily (e.g. 15-minute) smart meter readings and their rollups.
+
+Interval readings are stored per meter with integer timestamps (seconds since the
+epoch, UTC, start of the interval) and their duration in seconds. Hourly
+and daily rollups are kept up to date incrementally: after each ingest only
+the hours and days touched by the new readings are recomputed.
+"""
+from typing import IO
+
+import pandas as pd
+
+from smart_meter_vis.utils import utils
+
+# Timezone of the timestamps in the CSV exports of Wiener Netze
+TIMEZONE_METER = "Europe/Vienna"
+
+# Table definitions for interval readings and the hourly rollup (one row per meter and time)
+COLUMNS_INTERVAL = {
+    "meter_id": "TEXT NOT NULL",
+    "usage_ts": "INTEGER NOT NULL",  # start of the interval, seconds since epoch (UTC)
+    "duration_s": "INTEGER",
+    "usage_kwh": "REAL",
+    }
+CONSTRAINTS_INTERVAL = ["PRIMARY KEY (meter_id, usage_ts)"]
+COLUMNS_HOURLY = {
+    "meter_id": "TEXT NOT NULL",
+    "hour_ts": "INTEGER NOT NULL",  # start of the hour, seconds since epoch (UTC)
+    "usage_kwh": "REAL",
+    "covered_s": "INTEGER",  # seconds of the hour with a reading
+    }
+CONSTRAINTS_HOURLY = ["PRIMARY KEY (meter_id, hour_ts)"]
+
+_EPOCH = pd.Timestamp("1970-01-01", tz="UTC")
+
+
+def csv_is_interval_data(path_abs: str) -> bool:
+    """Return True if a CSV export holds sub-daily readings.
+
+    Daily exports have the header 'Datum;Verbrauch [kWh]', interval exports
+    have time columns, e.g. 'Datum;Zeit von;Zeit bis;Verbrauch [kWh]'.
+    """
+    with open(path_abs, mode="r", encoding="utf-8") as f:  # noqa: PTH123
+        header = f.readline().strip().split(";")
+    return len(header) >= 3 and "zeit" in header[1].lower()
+
+
+def to_epoch_seconds(timestamps: pd.Series) -> pd.Series:
+    """Convert timezone-aware timestamps to integer seconds since the epoch."""
+    return ((timestamps - _EPOCH) // pd.Timedelta(seconds=1)).astype("int64")
+
+
+def load_csv_meter_intervals(
+        paths_abs_list: list[str | IO[bytes]],
+        timezone: str = TIMEZONE_METER,
+        ) -> pd.DataFrame:
+    """Load interval readings from a list of CSV file paths.
+
+    Expects the columns date ('DD.MM.YYYY'), start time, end time (optional)
+    and usage ('1,23'). Local times are converted to UTC; the duplicate hour
+    at the end of daylight saving time is resolved by the order of the rows.
+    All readings of a file are assumed to have the same duration: the most
+    common difference between end and start time, or without an end time
+    column, the most common gap between consecutive readings. If an interval
+    occurs in several files, the value from the last file wins.
+
+    Args:
+        paths_abs_list (list[str | IO[bytes]]): A list of absolute paths to the
+            CSV files, or file objects such as those returned by
+            ingest.read_csv_increment().
+        timezone (str): The timezone of the timestamps in the files.
+
+    Returns:
+        pd.DataFrame: A dataframe with the columns 'usage_ts' (int, seconds
+        since epoch), 'duration_s' (int) and 'usage_kwh' (float, NaN for
+        missing readings), sorted by 'usage_ts'.
+    """
+    frames = []
+    for path_abs in paths_abs_list:
+        df_csv = pd.read_csv(
+            path_abs,
+            sep=";",
+            header=0,
+            dtype=str,
+            encoding="utf-8",
+            keep_default_na=False,
+            )
+        has_end_time = len(df_csv.columns) >= 4
+        col_date, col_start = df_csv.columns[0], df_csv.columns[1]
+        col_usage = df_csv.columns[3] if has_end_time else df_csv.columns[2]
+
+        time_start = pd.to_timedelta(df_csv[col_start].str.strip())
+        local_start = pd.to_datetime(df_csv[col_date], format="%d.%m.%Y") + time_start
+        try:
+            local_start = local_start.dt.tz_localize(timezone, ambiguous="infer", nonexistent="shift_forward")
+        except ValueError:
+            # Order of rows doesn't resolve the repeated hour: assume standard time
+            local_start = local_start.dt.tz_localize(timezone, ambiguous=False, nonexistent="shift_forward")
+        usage_ts = to_epoch_seconds(local_start)
+
+        if has_end_time:
+            # Wall clock difference; an end time of 00:00:00 belongs to the next day
+            time_end = pd.to_timedelta(df_csv[df_csv.columns[2]].str.strip())
+            duration_s = ((time_end - time_start) % pd.Timedelta(days=1)) // pd.Timedelta(seconds=1)
+            # Wall clock times jump at daylight saving changes; intervals have a fixed length
+            duration_mode = duration_s.mode()
+            if len(duration_mode):
+                duration_s = duration_s.where(duration_s == duration_mode.iloc[0], duration_mode.iloc[0])
+        else:
+            gaps = usage_ts.sort_values().diff().dropna()
+            duration_s = pd.Series(int(gaps.mode().iloc[0]) if len(gaps) else 900, index=usage_ts.index)
+
+        usage_kwh = pd.to_numeric(
+            df_csv[col_usage].str.strip().str.replace(",", ".", regex=False).replace("", None),
+            )
+        frames.append(pd.DataFrame({
+            "usage_ts": usage_ts,
+            "duration_s": duration_s.astype("int64"),
+            "usage_kwh": usage_kwh.astype("float64"),
+            }))
+
+    if not frames:
+        return pd.DataFrame({
+            "usage_ts": pd.Series(dtype="int64"),
+            "duration_s": pd.Series(dtype="int64"),
+            "usage_kwh": pd.Series(dtype="float64"),
+            })
+
+    df_intervals = pd.concat(frames, ignore_index=True)
+    df_intervals = df_intervals.drop_duplicates(subset="usage_ts", keep="last")
+    return df_intervals.sort_values("usage_ts").reset_index(drop=True)
+
+
+def update_rollups(
+        folder_db: str,
+        name_db: str,
+        name_table_interval: str,
+        name_table_hourly: str,
+        name_table_daily: str,
+        meter_id: str,
+        ts_min: int,
+        ts_max: int,
+        timezone: str = TIMEZONE_METER,
+        ) -> dict[str, int]:
+    """Recompute the hourly and daily rollups for a range of interval readings.
+
+    Only hours and (local) days overlapping [ts_min, ts_max] are recomputed,
+    from all readings stored for them. The hourly rollup is computed in SQL.
+    The daily rollup is written to the daily usage table ('meter_id',
+    'usage_date', 'usage_kwh', e.g. the electricity table) for complete days only, i.e.
+    days whose readings cover all 23, 24 or 25 hours, so partial days at the
+    end of an export don't overwrite correct values.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table_interval (str): The name of the interval table (COLUMNS_INTERVAL).
+        name_table_hourly (str): The name of the hourly rollup table (COLUMNS_HOURLY).
+        name_table_daily (str): The name of the daily usage table.
+        meter_id (str): The meter whose readings changed.
+        ts_min (int): The first interval start affected (seconds since epoch).
+        ts_max (int): The last interval start affected (seconds since epoch).
+        timezone (str): The timezone defining the days.
+
+    Returns:
+        dict[str, int]: The number of 'hours' and complete 'days' recomputed.
+    """
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    # Hourly rollup (UTC hours coincide with local hours in whole-hour offset timezones)
+    hour_min = ts_min // 3600 * 3600
+    hour_max = ts_max // 3600 * 3600
+    query_hourly = f"""
+            INSERT INTO {name_table_hourly} (meter_id, hour_ts, usage_kwh, covered_s)
+            SELECT
+                meter_id,
+                usage_ts / 3600 * 3600,
+                SUM(usage_kwh),
+                SUM(CASE WHEN usage_kwh IS NOT NULL THEN duration_s ELSE 0 END)
+            FROM {name_table_interval}
+            WHERE meter_id = ? AND usage_ts >= ? AND usage_ts < ?
+            GROUP BY usage_ts / 3600
+            ON CONFLICT(meter_id, hour_ts) DO UPDATE SET
+                usage_kwh = excluded.usage_kwh,
+                covered_s = excluded.covered_s
+            """
+    cursor.execute(query_hourly, (meter_id, hour_min, hour_max + 3600))
+    hours = cursor.rowcount
+    conn.commit()
+
+    # Local days overlapping the range, with their start and end in UTC seconds
+    local_min = pd.Timestamp(ts_min, unit="s", tz="UTC").tz_convert(timezone).normalize()
+    local_max = pd.Timestamp(ts_max, unit="s", tz="UTC").tz_convert(timezone).normalize()
+    days = pd.date_range(local_min.tz_localize(None), local_max.tz_localize(None), freq="D")
+    day_starts = to_epoch_seconds(pd.Series(days.tz_localize(timezone)))
+    day_ends = to_epoch_seconds(pd.Series((days + pd.Timedelta(days=1)).tz_localize(timezone)))
+
+    query_daily = f"""
+            SELECT hour_ts, usage_kwh, covered_s FROM {name_table_hourly}
+            WHERE meter_id = ? AND hour_ts >= ? AND hour_ts < ?
+            """
+    df_hourly = pd.read_sql_query(
+        sql=query_daily,
+        con=conn,
+        params=(meter_id, int(day_starts.iloc[0]), int(day_ends.iloc[-1])),
+        )
+
+    # Assign each hour to its local day and keep days covered completely
+    day_index = day_starts.searchsorted(df_hourly["hour_ts"], side="right") - 1
+    df_daily = df_hourly.groupby(day_index).agg(usage_kwh=("usage_kwh", "sum"), covered_s=("covered_s", "sum"))
+    day_lengths = (day_ends - day_starts).to_numpy()
+    df_daily = df_daily[df_daily["covered_s"].to_numpy() == day_lengths[df_daily.index]]
+
+    df_daily = pd.DataFrame({
+        "meter_id": meter_id,
+        "usage_date": days[df_daily.index].strftime("%Y-%m-%d"),
+        "usage_kwh": df_daily["usage_kwh"].to_numpy(),
+        })
+    utils.sql_upsert_rows(
+        folder_db=folder_db,
+        name_db=name_db,
+        name_table=name_table_daily,
+        key_column=["meter_id", "usage_date"],
+        data=df_daily,
+        )
+
+    return {"hours": hours, "days": len(df_daily)}
+
+
+def ingest_intervals(
+        folder_db: str,
+        name_db: str,
+        name_table_interval: str,
+        name_table_hourly: str,
+        name_table_daily: str,
+        meter_id: str,
+        data: pd.DataFrame,
+        timezone: str = TIMEZONE_METER,
+        ) -> dict[str, int]:
+    """Store interval readings of a meter in bulk and update the rollups they affect.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table_interval (str): The name of the interval table (COLUMNS_INTERVAL).
+        name_table_hourly (str): The name of the hourly rollup table (COLUMNS_HOURLY).
+        name_table_daily (str): The name of the daily usage table.
+        meter_id (str): The meter the readings belong to.
+        data (pd.DataFrame): Readings as returned by load_csv_meter_intervals().
+        timezone (str): The timezone defining the days.
+
+    Returns:
+        dict[str, int]: The counts of sql_upsert_rows() ('inserted', 'updated',
+        'unchanged') and of update_rollups() ('hours', 'days').
+    """
+    report = utils.sql_upsert_rows(
+        folder_db=folder_db,
+        name_db=name_db,
+        name_table=name_table_interval,
+        key_column=["meter_id", "usage_ts"],
+        data=data.assign(meter_id=meter_id)[list(COLUMNS_INTERVAL)],
+        )
+    report.update({"hours": 0, "days": 0})
+    if report["inserted"] or report["updated"]:
+        report.update(update_rollups(
+            folder_db=folder_db,
+            name_db=name_db,
+            name_table_interval=name_table_interval,
+            name_table_hourly=name_table_hourly,
+            name_table_daily=name_table_daily,
+            meter_id=meter_id,
+            ts_min=int(data["usage_ts"].min()),
+            ts_max=int(data["usage_ts"].max()),
+            timezone=timezone,
+            ))
+    return report
+
+
+def load_usage_series(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        ts_column: str,
+        meter_id: str,
+        timezone: str = TIMEZONE_METER,
+        ) -> pd.DataFrame:
+    """Load interval readings or an hourly rollup of a meter for plotting.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The interval table or the hourly rollup table.
+        ts_column (str): The timestamp column ('usage_ts' or 'hour_ts').
+        meter_id (str): The meter to load.
+        timezone (str): The timezone for the returned timestamps.
+
+    Returns:
+        pd.DataFrame: The columns 'usage_date' (local timestamps) and 'usage_kwh'.
+    """
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    df_usage = pd.read_sql_query(
+        sql=f"SELECT {ts_column} AS usage_ts, usage_kwh FROM {name_table} WHERE meter_id = ? ORDER BY {ts_column}",
+        con=conn,
+        params=(meter_id, ),
+        )
+    usage_date = pd.to_datetime(df_usage.pop("usage_ts"), unit="s", utc=True).dt.tz_convert(timezone)
+    df_usage.insert(0, "usage_date", usage_date.dt.tz_localize(None))
+    return df_usage
@@ -0,0 +1,295 @@
+"""Counters, histograms and stage timers for the pipeline.
+
+All measurements go to one registry per process (REGISTRY):
+
+* stage() times a pipeline stage (wall and CPU seconds) and logs the result
+  as one JSON line on the 'smart_meter_vis' logger.
+* count() adds to a counter, e.g. rows inserted.
+* observe() records a value in a histogram, e.g. the latency of an API call.
+* set_gauge() sets a current value, e.g. the API calls left today.
+
+SQL statements are counted and timed by the connections of
+utils.get_sql_connection() (InstrumentedConnection), API calls by
+weather.fetch_day_summaries(). The registry can be written as JSON or in the
+Prometheus text format (write_metrics()) or served over HTTP while the
+process runs (serve_metrics()), e.g. in watch mode.
+
+Recording a value takes about a microsecond, so it stays enabled.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger("smart_meter_vis")
+
+# Prefix of all metric names in the Prometheus output
+PREFIX = "smart_meter_vis_"
+
+# Upper bounds of the histogram buckets in seconds (from 0.1 ms to 10 s)
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms with labels."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, str]) -> tuple:
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add 'value' to a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge to 'value'."""
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels: str) -> None:
+        """Record a value in a histogram (cumulative bucket counts, sum and count)."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for position, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][position] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def reset(self) -> None:
+        """Remove all values."""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def to_dict(self) -> dict[str, list[dict]]:
+        """Return all values as lists of {'name', 'labels', ...} entries."""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                    ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                    ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "buckets": dict(zip(map(str, histogram["buckets"]), histogram["counts"])),
+                        "sum": histogram["sum"],
+                        "count": histogram["count"],
+                        }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                    ],
+                }
+
+    def to_prometheus(self) -> str:
+        """Return all values in the Prometheus text exposition format."""
+        def labels_str(labels: dict[str, str]) -> str:
+            if not labels:
+                return ""
+            escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+            return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+        values = self.to_dict()
+        lines = []
+        types_written = set()
+
+        def write_type(name: str, metric_type: str) -> None:
+            if name not in types_written:
+                lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+                types_written.add(name)
+
+        for entry in values["counters"]:
+            write_type(entry["name"], "counter")
+            lines.append(f"{PREFIX}{entry['name']}{labels_str(entry['labels'])} {entry['value']}")
+        for entry in values["gauges"]:
+            write_type(entry["name"], "gauge")
+            lines.append(f"{PREFIX}{entry['name']}{labels_str(entry['labels'])} {entry['value']}")
+        for entry in values["histograms"]:
+            write_type(entry["name"], "histogram")
+            for bound, bucket_count in entry["buckets"].items():
+                lines.append(f"{PREFIX}{entry['name']}_bucket{labels_str({**entry['labels'], 'le': bound})} {bucket_count}")
+            lines.append(f"{PREFIX}{entry['name']}_bucket{labels_str({**entry['labels'], 'le': '+Inf'})} {entry['count']}")
+            lines.append(f"{PREFIX}{entry['name']}_sum{labels_str(entry['labels'])} {entry['sum']}")
+            lines.append(f"{PREFIX}{entry['name']}_count{labels_str(entry['labels'])} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# The registry of this process
+REGISTRY = Registry()
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Add 'value' to a counter of REGISTRY, e.g. count("rows_total", 10, stage="ingest")."""
+    REGISTRY.count(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    """Set a gauge of REGISTRY."""
+    REGISTRY.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """Record a value in a histogram of REGISTRY (LATENCY_BUCKETS)."""
+    REGISTRY.observe(name, value, **labels)
+
+
+def log_event(event: str, **fields) -> None:
+    """Log one JSON line with 'event' and 'fields' (INFO level)."""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+@contextmanager
+def stage(name: str) -> Iterator[dict]:
+    """Time a pipeline stage and log its wall and CPU seconds when it ends.
+
+    Yields a dict; values put into it (e.g. row counts) are logged with the
+    timings. Stages may be nested.
+
+    Example:
+        with metrics.stage("ingest") as info:
+            info["rows"] = ...
+    """
+    info = {}
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    status = "ok"
+    try:
+        yield info
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall_s = time.perf_counter() - wall_start
+        cpu_s = time.process_time() - cpu_start
+        count("stage_wall_seconds_total", wall_s, stage=name)
+        count("stage_cpu_seconds_total", cpu_s, stage=name)
+        count("stage_runs_total", stage=name, status=status)
+        log_event("stage", stage=name, status=status, wall_s=round(wall_s, 6), cpu_s=round(cpu_s, 6), **info)
+
+
+def _statement_kind(sql: str) -> str:
+    """Return the first keyword of an SQL statement (SELECT, INSERT, ...)."""
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else ""
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that counts and times its statements (execute() only, not fetching the rows)."""
+
+    def execute(self, sql: str, parameters=(), /) -> sqlite3.Cursor:  # noqa: D102
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_statement(sql, time.perf_counter() - start, rows=self.rowcount)
+
+    def executemany(self, sql: str, seq_of_parameters, /) -> sqlite3.Cursor:  # noqa: D102
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_statement(sql, time.perf_counter() - start, rows=self.rowcount)
+
+    def executescript(self, sql_script: str, /) -> sqlite3.Cursor:  # noqa: D102
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_statement("SCRIPT", time.perf_counter() - start, rows=-1)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose statements are counted and timed (pass as 'factory' to sqlite3.connect())."""
+
+    def cursor(self, factory=InstrumentedCursor) -> sqlite3.Cursor:  # noqa: D102
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters=(), /) -> sqlite3.Cursor:  # noqa: D102
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters, /) -> sqlite3.Cursor:  # noqa: D102
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script: str, /) -> sqlite3.Cursor:  # noqa: D102
+        return self.cursor().executescript(sql_script)
+
+
+def _record_statement(sql: str, seconds: float, rows: int) -> None:
+    """Count and time a statement; 'rows' is the cursor's rowcount (-1 if not a change)."""
+    kind = _statement_kind(sql)
+    count("sql_statements_total", kind=kind)
+    if rows > 0:
+        count("sql_rows_changed_total", rows, kind=kind)
+    observe("sql_statement_seconds", seconds, kind=kind)
+
+
+def write_metrics(path: str) -> None:
+    """Write REGISTRY to a file: Prometheus text format for '.prom' or '.txt', else JSON."""
+    if path.endswith((".prom", ".txt")):
+        content = REGISTRY.to_prometheus()
+    else:
+        content = json.dumps(REGISTRY.to_dict(), indent=2)
+    with open(path, "w", encoding="utf-8") as f:  # noqa: PTH123
+        f.write(content)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+    """Serve REGISTRY over HTTP in a background thread until the process ends.
+
+    GET /metrics returns the Prometheus text format, GET /metrics.json JSON.
+
+    Args:
+        port (int): The port to listen on (0 for any free port).
+        host (str): The address to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The server (call shutdown() to stop it early).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: PLC0415
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path == "/metrics":
+                body, content_type = REGISTRY.to_prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(REGISTRY.to_dict()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,342 @@
+"""Versioned schema migrations for the SQLite database.
+
+The version of a database is stored in the table 'schema_version'. Each
+entry of MIGRATIONS is a function taking an open connection; entry n
+upgrades a database from version n to version n + 1. Steps must be safe to
+run again if they were interrupted, since the version is only recorded once
+a step has finished.
+"""
+import sqlite3
+from datetime import datetime
+from typing import Callable
+
+from smart_meter_vis.utils import utils
+
+# Meter and location assigned to data stored before these dimensions existed
+DEFAULT_METER_ID = "default"
+DEFAULT_LOCATION_ID = "default"
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the schema version of a database (0 for an unversioned database)."""
+    conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_date TEXT
+            )
+            """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(
+        folder_db: str,
+        name_db: str,
+        migrations: list[Callable[[sqlite3.Connection], None]] | None = None,
+        ) -> int:
+    """Apply all migrations a database hasn't seen yet, in order.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        migrations (list[Callable[[sqlite3.Connection], None]] | None): The
+            ordered migration steps. Defaults to MIGRATIONS.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    if migrations is None:
+        migrations = MIGRATIONS
+
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    # Rebuilds interrupted after their copy was complete are finished first
+    names_rebuild = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_rebuild' ESCAPE '\\'",
+        ).fetchall()
+    for (name_rebuild, ) in names_rebuild:
+        finish_rebuild(conn, name_table=name_rebuild.removesuffix("_rebuild"))
+    version = get_schema_version(conn)
+
+    for version_new, migration in enumerate(migrations[version:], start=version + 1):
+        print(f"Migrating {name_db} to schema version {version_new}: {migration.__name__}")
+        try:
+            migration(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, applied_date) VALUES (?, ?)",
+                (version_new, datetime.today().strftime("%Y-%m-%d")),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = version_new
+
+    return version
+
+
+def rebuild_table(
+        conn: sqlite3.Connection,
+        name_table: str,
+        columns_name_type: dict[str, str],
+        constraints: list[str] | None = None,
+        column_sources: dict[str, str] | None = None,
+        batch_size: int = 50_000,
+        add_id: bool = True,
+        ) -> int:
+    """Rebuild a table with a new definition, copying its rows in batches.
+
+    A new table is created next to the old one and filled with
+    INSERT ... SELECT in batches of 'batch_size' rows (ordered by rowid),
+    committing after each batch. Rows never pass through Python, so memory
+    use doesn't depend on the table size. Finally the old table is dropped
+    and the new one renamed in one transaction. A rebuild interrupted while
+    copying starts over on the next run; one interrupted before it was
+    committed keeps the old table (see finish_rebuild()). Indexes of the old
+    table are dropped with it and must be created again.
+
+    Args:
+        conn (sqlite3.Connection): The open connection.
+        name_table (str): The name of the table to rebuild.
+        columns_name_type (dict[str, str]): The new column definitions, as for
+            utils.create_sql_table(). The 'id' primary key is added (and
+            copied) unless 'add_id' is False.
+        constraints (list[str] | None): Table constraints, as for
+            utils.create_sql_table().
+        column_sources (dict[str, str] | None): SQL expressions over the old
+            table's columns for new columns, e.g. {"usage_ts": "unixepoch(usage_date)"}.
+            Columns not listed are copied by name.
+        batch_size (int): The number of rows copied per transaction.
+        add_id (bool): Add the 'id' primary key, as for utils.create_sql_table().
+
+    Returns:
+        int: The number of rows copied.
+    """
+    if column_sources is None:
+        column_sources = {}
+
+    name_table_new = f"{name_table}_rebuild"
+    if finish_rebuild(conn, name_table=name_table):
+        return conn.execute(f"SELECT COUNT(*) FROM {name_table}").fetchone()[0]
+    columns_block = utils.build_columns_string(columns_dict=columns_name_type)
+    if constraints:
+        columns_block = ",\n    ".join([columns_block, *constraints])
+    if add_id:
+        columns_block = ",\n    ".join(["id INTEGER PRIMARY KEY", columns_block])
+
+    conn.execute(f"DROP TABLE IF EXISTS {name_table_new}")
+    conn.execute(f"""
+            CREATE TABLE {name_table_new} (
+                {columns_block}
+            )
+            """)
+
+    column_names = ["id", *columns_name_type] if add_id else list(columns_name_type)
+    column_names_str = ", ".join(column_names)
+    select_str = ", ".join(column_sources.get(column, column) for column in column_names)
+
+    rows_copied = 0
+    last_rowid = -1
+    while True:
+        row = conn.execute(
+            f"SELECT MAX(rowid), COUNT(*) FROM (SELECT rowid FROM {name_table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, batch_size),
+            ).fetchone()
+        batch_last_rowid, batch_count = row
+        if not batch_count:
+            break
+        conn.execute(
+            f"""
+            INSERT INTO {name_table_new} ({column_names_str})
+            SELECT {select_str} FROM {name_table}
+            WHERE rowid > ? AND rowid <= ?
+            """,
+            (last_rowid, batch_last_rowid),
+            )
+        conn.commit()
+        rows_copied += batch_count
+        last_rowid = batch_last_rowid
+
+    # DDL doesn't open a transaction in sqlite3: without one, a crash between the two statements
+    # would leave the rows in the rebuild table only
+    conn.commit()
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"DROP TABLE {name_table}")
+        conn.execute(f"ALTER TABLE {name_table_new} RENAME TO {name_table}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return rows_copied
+
+
+def finish_rebuild(conn: sqlite3.Connection, name_table: str) -> bool:
+    """Finish a rebuild of rebuild_table() that was interrupted after copying all rows.
+
+    This is the case if the rebuild table exists but the old table doesn't,
+    or is empty: versions before the drop and rename were one transaction
+    could stop in between, and the next start created the table again
+    without rows. The rebuild table then replaces it.
+
+    Args:
+        conn (sqlite3.Connection): The open connection.
+        name_table (str): The name of the rebuilt table.
+
+    Returns:
+        bool: True if a rebuild was finished.
+    """
+    name_table_new = f"{name_table}_rebuild"
+    if not table_exists(conn, name_table_new):
+        return False
+    if table_exists(conn, name_table) and conn.execute(f"SELECT 1 FROM {name_table} LIMIT 1").fetchone():
+        return False
+    print(f"Finishing the interrupted rebuild of table {name_table}")
+    conn.commit()
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {name_table}")
+        conn.execute(f"ALTER TABLE {name_table_new} RENAME TO {name_table}")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return True
+
+
+def table_exists(conn: sqlite3.Connection, name_table: str) -> bool:
+    """Return True if the database contains a table called 'name_table'."""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (name_table, ),
+        ).fetchone()
+    return row is not None
+
+
+def column_exists(conn: sqlite3.Connection, name_table: str, column_name: str) -> bool:
+    """Return True if the table 'name_table' has a column called 'column_name'."""
+    return any(row[1] == column_name for row in conn.execute(f"PRAGMA table_info({name_table})"))
+
+
+def migration_001_deduplicate_weather(conn: sqlite3.Connection) -> None:
+    """Keep only the latest weather row per date.
+
+    Older versions could store a date more than once, which prevents the
+    unique index on weather.weather_date.
+    """
+    if not table_exists(conn, "weather"):
+        return
+    group_by_str = "location_id, weather_date" if column_exists(conn, "weather", "location_id") else "weather_date"
+    conn.execute(f"""
+            DELETE FROM weather
+            WHERE id NOT IN (SELECT MAX(id) FROM weather GROUP BY {group_by_str})
+            """)
+
+
+def migration_002_meter_and_location_dimensions(conn: sqlite3.Connection) -> None:
+    """Add meter and location columns to the usage and weather tables.
+
+    Existing rows are assigned to DEFAULT_METER_ID and DEFAULT_LOCATION_ID.
+    Unique keys change from the date alone to (meter, date) and
+    (location, date), which requires rebuilding the tables.
+    """
+    meter_source = {"meter_id": f"'{DEFAULT_METER_ID}'"}
+    location_source = {"location_id": f"'{DEFAULT_LOCATION_ID}'"}
+
+    if table_exists(conn, "electricity") and not column_exists(conn, "electricity", "meter_id"):
+        rebuild_table(
+            conn,
+            name_table="electricity",
+            columns_name_type={"meter_id": "TEXT NOT NULL", "usage_date": "TEXT", "usage_kwh": "REAL"},
+            constraints=["UNIQUE (meter_id, usage_date)"],
+            column_sources=meter_source,
+            )
+    if table_exists(conn, "electricity_interval") and not column_exists(conn, "electricity_interval", "meter_id"):
+        rebuild_table(
+            conn,
+            name_table="electricity_interval",
+            columns_name_type={
+                "meter_id": "TEXT NOT NULL",
+                "usage_ts": "INTEGER NOT NULL",
+                "duration_s": "INTEGER",
+                "usage_kwh": "REAL",
+                },
+            constraints=["PRIMARY KEY (meter_id, usage_ts)"],
+            column_sources=meter_source,
+            add_id=False,
+            )
+    if table_exists(conn, "electricity_hourly") and not column_exists(conn, "electricity_hourly", "meter_id"):
+        rebuild_table(
+            conn,
+            name_table="electricity_hourly",
+            columns_name_type={
+                "meter_id": "TEXT NOT NULL",
+                "hour_ts": "INTEGER NOT NULL",
+                "usage_kwh": "REAL",
+                "covered_s": "INTEGER",
+                },
+            constraints=["PRIMARY KEY (meter_id, hour_ts)"],
+            column_sources=meter_source,
+            add_id=False,
+            )
+    if table_exists(conn, "weather") and not column_exists(conn, "weather", "location_id"):
+        # The unique index is recreated on (location_id, weather_date) at startup
+        conn.execute("DROP INDEX IF EXISTS weather_weather_date")
+        conn.execute(f"ALTER TABLE weather ADD COLUMN location_id TEXT NOT NULL DEFAULT '{DEFAULT_LOCATION_ID}'")
+    if table_exists(conn, "weather_failures") and not column_exists(conn, "weather_failures", "location_id"):
+        rebuild_table(
+            conn,
+            name_table="weather_failures",
+            columns_name_type={
+                "location_id": "TEXT NOT NULL",
+                "weather_date": "TEXT",
+                "attempts": "INTEGER",
+                "last_error": "TEXT",
+                "last_attempt_date": "TEXT",
+                },
+            constraints=["UNIQUE (location_id, weather_date)"],
+            column_sources=location_source,
+            )
+
+
+def migration_003_autoincrement_change_logs(conn: sqlite3.Connection) -> None:
+    """Never reuse the ids of the change logs.
+
+    Without AUTOINCREMENT, SQLite numbers a new row after the largest id
+    left, so pruned ids were assigned again and the last change id stored
+    per meter (correlation_sync) could skip new changes. The logs are
+    rebuilt with their ids; their triggers are dropped first (a trigger
+    naming a missing table blocks the rename) and created again at startup.
+    """
+    # Change log: prefix of the names of the triggers writing to it
+    change_logs = {
+        "electricity_changes": "electricity",
+        "weather_changes": "weather",
+        "electricity_store_changes": "electricity_store",
+        "weather_store_changes": "weather_store",
+        }
+    for name_table, name_triggers in change_logs.items():
+        if not table_exists(conn, name_table):
+            continue
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (name_table, )).fetchone()
+        if "AUTOINCREMENT" in row[0].upper():
+            continue
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {name_triggers}_log_{event}")
+        rebuild_table(
+            conn,
+            name_table=name_table,
+            columns_name_type={
+                "change_id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+                "dimension_id": "TEXT",
+                "period": "TEXT",
+                },
+            add_id=False,
+            )
+
+
+# Ordered migration steps; append new steps at the end, never reorder
+MIGRATIONS = [
+    migration_001_deduplicate_weather,
+    migration_002_meter_and_location_dimensions,
+    migration_003_autoincrement_change_logs,
+    ]
@@ -0,0 +1,179 @@
+"""Plot electricity usage against the weather features that correlate most strongly with it.
+
+Each feature gets its own y-axis (stacked on the left), usage is on the
+right. Daily traces share one downsampled x array: the points kept for
+the different lines are merged into a single selection, so the figure
+holds one set of dates for all of them. When that selection is a gapless
+daily series, the dates are written as a start and a step (x0/dx) and no
+date array is stored in the figure at all.
+"""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from smart_meter_vis.utils import downsample
+
+# Axis labels of the weather features
+FEATURE_SPECS = {
+    "temp_min": {"name": "Min. temperature", "unit": "°C"},
+    "temp_max": {"name": "Max. temperature", "unit": "°C"},
+    "temp_median_no_minmax": {"name": "Median temperature (without min/max)", "unit": "°C"},
+    "temp_median": {"name": "Median temperature", "unit": "°C"},
+    "temp_morning": {"name": "Morning temperature", "unit": "°C"},
+    "temp_afternoon": {"name": "Afternoon temperature", "unit": "°C"},
+    "temp_evening": {"name": "Evening temperature", "unit": "°C"},
+    "temp_night": {"name": "Night temperature", "unit": "°C"},
+    "humidity": {"name": "Humidity", "unit": "%"},
+    "precipitation": {"name": "Precipitation", "unit": "mm"},
+    "wind_speed": {"name": "Wind speed", "unit": "m/s"},
+    "wind_direction": {"name": "Wind direction", "unit": "°"},
+    }
+
+# Horizontal space per additional y-axis on the left (fraction of the plot width)
+AXIS_OFFSET = 0.07
+
+_DAY_MS = 24 * 60 * 60 * 1000
+
+
+def shared_indices(
+        data: pd.DataFrame,
+        x_column: str,
+        y_columns: list[str],
+        n_out: int | None = 2000,
+        method: str = "lttb",
+        ) -> np.ndarray:
+    """Return one selection of rows that keeps the shape of several series.
+
+    Each series contributes the rows downsample.downsample() keeps with an
+    equal share of 'n_out'; the result is their union, in order.
+
+    Args:
+        data (pd.DataFrame): The series, ascending in 'x_column', without NaN.
+        x_column (str): The column with the x values.
+        y_columns (list[str]): The columns of the series.
+        n_out (int | None): The maximum number of rows. None keeps all rows.
+        method (str): 'lttb' or 'minmax'.
+
+    Returns:
+        np.ndarray: The positions of the selected rows.
+    """
+    if n_out is None or len(data) <= n_out or not y_columns:
+        return np.arange(len(data))
+    data = data.reset_index(drop=True)
+    n_out_column = max(4, n_out // len(y_columns))
+    selections = [
+        downsample.downsample(data=data, x_column=x_column, y_column=column, n_out=n_out_column, method=method).index
+        for column in y_columns
+        ]
+    return np.unique(np.concatenate(selections))
+
+
+def scatter_trace(n_points: int, webgl_threshold: int, **trace_params) -> go.Scatter | go.Scattergl:
+    """Return a line trace; WebGL (Scattergl) if its series has more than 'webgl_threshold' points.
+
+    'n_points' is the length of the series before downsampling, so long
+    histories are drawn with WebGL even when only part of them is plotted.
+    """
+    trace_class = go.Scattergl if n_points > webgl_threshold else go.Scatter
+    return trace_class(mode="lines", **trace_params)
+
+
+def plot_top_features(
+        data: pd.DataFrame,
+        features: list[str],
+        usage: pd.DataFrame | None = None,
+        n_out: int | None = 2000,
+        method: str = "lttb",
+        webgl_threshold: int = 5000,
+        title: str = "Electricity Usage vs. Weather Conditions",
+        ) -> go.Figure:
+    """Return a figure with usage and several weather features, each on its own y-axis.
+
+    Args:
+        data (pd.DataFrame): Daily rows with 'usage_date' (datetime),
+            'usage_kwh' and the 'features', e.g. from
+            correlation.read_joined_chunks(), ordered by date.
+        features (list[str]): The features to plot, e.g. the top rows of
+            the ranked correlation table.
+        usage (pd.DataFrame | None): Usage in another resolution ('usage_date',
+            'usage_kwh'), e.g. hourly. Defaults to the usage in 'data'.
+        n_out (int | None): The maximum number of points per line. None keeps all.
+        method (str): The downsampling method ('lttb' or 'minmax').
+        webgl_threshold (int): Lines of series with more points (before
+            downsampling) are drawn with WebGL.
+        title (str): The title of the figure.
+
+    Returns:
+        go.Figure: The figure.
+    """
+    data = data.dropna(subset=features).reset_index(drop=True)
+    # Daily usage shares the dates of the features
+    y_columns = features + ["usage_kwh"] if usage is None else features
+
+    # One set of dates for all daily traces
+    selected = data.iloc[shared_indices(data=data, x_column="usage_date", y_columns=y_columns, n_out=n_out, method=method)]
+    dates = selected["usage_date"]
+    x_params = {"x": dates.to_numpy()}
+    steps = dates.diff().dropna()
+    if len(dates) > 1 and (steps == pd.Timedelta(days=1)).all():
+        x_params = {"x0": dates.iloc[0], "dx": _DAY_MS}
+
+    traces = []
+    layout_axes = {}
+    n_left = len(features)
+    for position, feature in enumerate(features):
+        spec = FEATURE_SPECS.get(feature, {"name": feature, "unit": ""})
+        axis_name = "y" if position == 0 else f"y{position + 2}"
+        traces.append(scatter_trace(
+            n_points=len(data),
+            webgl_threshold=webgl_threshold,
+            y=selected[feature].to_numpy(),
+            name=spec["name"],
+            yaxis=axis_name,
+            **x_params,
+            ))
+        axis = {
+            "title": f"{spec['name']} ({spec['unit']})" if spec["unit"] else spec["name"],
+            "side": "left",
+            }
+        if position:
+            # Additional axes are placed left of the first one, without a second grid
+            axis.update(overlaying="y", anchor="free", position=AXIS_OFFSET * (n_left - 1 - position), showgrid=False)
+        layout_axes[f"yaxis{position + 2}" if position else "yaxis"] = axis
+
+    if usage is None:
+        usage_params = {"y": selected["usage_kwh"].to_numpy(), **x_params}
+    else:
+        usage_plot = downsample.downsample(data=usage, x_column="usage_date", y_column="usage_kwh", n_out=n_out, method=method)
+        usage_params = {"x": usage_plot["usage_date"].to_numpy(), "y": usage_plot["usage_kwh"].to_numpy()}
+    traces.append(scatter_trace(
+        n_points=len(data) if usage is None else len(usage),
+        webgl_threshold=webgl_threshold,
+        name="Electricity Usage (kWh)",
+        yaxis="y2",
+        **usage_params,
+        ))
+    layout_axes["yaxis2"] = {"title": "Electricity Usage (kWh)", "overlaying": "y", "side": "right", "showgrid": False}
+    if n_left > 1:
+        layout_axes["yaxis"]["anchor"] = "free"
+        layout_axes["yaxis"]["position"] = AXIS_OFFSET * (n_left - 1)
+
+    fig = go.Figure(traces)
+    fig.update_layout(
+        title=title,
+        xaxis={"title": "Date", "domain": [AXIS_OFFSET * (n_left - 1), 1]},
+        **layout_axes,
+        )
+    return fig
+
+
+def output_figure(fig: go.Figure, path_html: str | None = None) -> None:
+    """Show a figure in the browser, or write it to a standalone HTML file (for runs without a display).
+
+    The HTML file loads plotly.js from a CDN instead of embedding it (~3 MB).
+    """
+    if path_html is None:
+        fig.show()
+    else:
+        fig.write_html(path_html, include_plotlyjs="cdn")
+        print(f"Plot written to {path_html}")
@@ -0,0 +1,62 @@
+"""Column definitions of the usage and weather tables ("column": "TYPE").
+
+Shared by the pipeline and the benchmarks. Migrations keep their own copies of
+the definitions they were written for (see utils.migrations).
+"""
+
+# Daily electricity usage per meter
+COLUMNS_USAGE = {
+    "meter_id": "TEXT NOT NULL",
+    "usage_date": "TEXT",
+    "usage_kwh": "REAL",
+    }
+CONSTRAINTS_USAGE = ["UNIQUE (meter_id, usage_date)"]
+
+# Define new columns with their respective types. These are defined by the API response
+# For JSON schema see API documentation: https://openweathermap.org/api/one-call-3#hist_agr_parameter
+COLUMNS_WEATHER = {
+    "location_id": "TEXT NOT NULL",
+    "weather_date": "TEXT",
+    "temp_min": "REAL",
+    "temp_max": "REAL",
+    "temp_median_no_minmax": "REAL",
+    "temp_median": "REAL",
+    "temp_morning": "REAL",
+    "temp_afternoon": "REAL",
+    "temp_evening": "REAL",
+    "temp_night": "REAL",
+    "humidity": "REAL",
+    "precipitation": "REAL",
+    "wind_speed": "REAL",
+    "wind_direction": "REAL",
+    "retrieval_date": "TEXT",
+    }
+
+# Ledger for dates whose weather data could not be fetched
+COLUMNS_WEATHER_FAILURES = {
+    "location_id": "TEXT NOT NULL",
+    "weather_date": "TEXT",
+    "attempts": "INTEGER",
+    "last_error": "TEXT",
+    "last_attempt_date": "TEXT",
+    }
+CONSTRAINTS_WEATHER_FAILURES = ["UNIQUE (location_id, weather_date)"]
+
+# API requests per day that stored no weather row: retries and requests of failed dates. Together
+# with the weather rows retrieved on a day they are the API calls made that day.
+COLUMNS_API_REQUESTS = {
+    "request_date": "TEXT",
+    "location_id": "TEXT NOT NULL",
+    "extra_requests": "INTEGER",
+    }
+CONSTRAINTS_API_REQUESTS = ["UNIQUE (request_date, location_id)"]
+
+# Every raw API response (keyed by date and location)
+COLUMNS_RAW_RESPONSES = {
+    "response_date": "TEXT",
+    "lat": "REAL",
+    "lon": "REAL",
+    "retrieval_date": "TEXT",
+    "response": "TEXT",
+    }
+CONSTRAINTS_RAW_RESPONSES = ["UNIQUE (response_date, lat, lon)"]
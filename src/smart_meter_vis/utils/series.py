@@ -0,0 +1,153 @@
+"""Compact daily time series: one value per date, held in two arrays.
+
+A reading takes 12 bytes: the date as days since 1970-01-01 (int32) and the
+value (float64, NaN for a missing reading). Dates are kept sorted and
+unique, so a lookup is a binary search and set operations (union,
+intersection, difference) are vectorized over the whole series. Date
+strings ('YYYY-MM-DD') are only created when the series is written out.
+"""
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+
+def _to_days(dates: Iterable[str] | np.ndarray | pd.Series) -> np.ndarray:
+    """Convert dates ('YYYY-MM-DD' strings or datetimes) to days since 1970-01-01."""
+    if isinstance(dates, pd.Series):
+        dates = dates.to_numpy()
+    return np.asarray(dates, dtype="datetime64[D]").astype("int32")
+
+
+class DailySeries:
+    """Values by date, sorted by date, at most one value per date.
+
+    Args:
+        days (np.ndarray): Days since 1970-01-01, in any order.
+        values (np.ndarray): One value per day (NaN for missing readings).
+            For a day given more than once, the last value is kept.
+    """
+
+    __slots__ = ("days", "values")
+
+    def __init__(self, days: np.ndarray, values: np.ndarray) -> None:
+        days = np.asarray(days, dtype="int32")
+        values = np.asarray(values, dtype="float64")
+        if len(days) != len(values):
+            raise ValueError(f"Got {len(days)} days but {len(values)} values")
+        if len(days) > 1 and not (np.diff(days) > 0).all():
+            # Keep the last value per day: sort the reversed arrays stably, take the first per day
+            order = np.argsort(days[::-1], kind="stable")
+            days_sorted = days[::-1][order]
+            first = np.concatenate([[True], np.diff(days_sorted) > 0])
+            days = days_sorted[first]
+            values = values[::-1][order][first]
+        self.days = days
+        self.values = values
+
+    @classmethod
+    def from_dates(
+            cls,
+            dates: Iterable[str] | np.ndarray | pd.Series,
+            values: Iterable[float | None] | np.ndarray,
+            ) -> "DailySeries":
+        """Return a series from dates ('YYYY-MM-DD' or datetimes) and values (None for missing)."""
+        return cls(days=_to_days(dates), values=np.array(values, dtype="float64"))
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, date_column: str, value_column: str) -> "DailySeries":
+        """Return a series from a date column and a value column of a dataframe."""
+        return cls.from_dates(dates=data[date_column], values=data[value_column].to_numpy(dtype="float64"))
+
+    @classmethod
+    def empty(cls) -> "DailySeries":
+        """Return a series without dates."""
+        return cls(days=np.empty(0, dtype="int32"), values=np.empty(0, dtype="float64"))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __repr__(self) -> str:
+        if not len(self):
+            return "DailySeries(0 days)"
+        first, last = np.datetime_as_string(self.dates()[[0, -1]])
+        return f"DailySeries({len(self)} days, {first} to {last})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DailySeries):
+            return NotImplemented
+        return np.array_equal(self.days, other.days) and np.array_equal(self.values, other.values, equal_nan=True)
+
+    def _positions(self, days: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the position of each day in the series and whether it is there."""
+        positions = np.searchsorted(self.days, days)
+        found = positions < len(self.days)
+        found[found] = self.days[positions[found]] == days[found]
+        return positions, found
+
+    def __contains__(self, date: str) -> bool:
+        return bool(self._positions(_to_days([date]))[1][0])
+
+    def get(self, date: str, default: float | None = None) -> float | None:
+        """Return the value of a date ('YYYY-MM-DD'), or 'default' if the date isn't in the series."""
+        positions, found = self._positions(_to_days([date]))
+        return float(self.values[positions[0]]) if found[0] else default
+
+    def lookup(self, dates: Iterable[str] | np.ndarray) -> np.ndarray:
+        """Return the values of many dates at once (NaN for dates not in the series)."""
+        positions, found = self._positions(_to_days(dates))
+        result = np.full(len(positions), np.nan)
+        result[found] = self.values[positions[found]]
+        return result
+
+    def dates(self) -> np.ndarray:
+        """Return the dates as datetime64[D]."""
+        return self.days.astype("datetime64[D]")
+
+    def date_strings(self) -> np.ndarray:
+        """Return the dates as 'YYYY-MM-DD' strings."""
+        return np.datetime_as_string(self.dates())
+
+    @property
+    def nbytes(self) -> int:
+        """The memory used by the dates and values."""
+        return self.days.nbytes + self.values.nbytes
+
+    def union(self, other: "DailySeries") -> "DailySeries":
+        """Return the dates of both series; for dates in both, the value of 'other' is kept."""
+        return DailySeries(
+            days=np.concatenate([self.days, other.days]),
+            values=np.concatenate([self.values, other.values]),
+            )
+
+    def intersection(self, other: "DailySeries") -> "DailySeries":
+        """Return the dates (and values) of this series that are also in 'other'."""
+        keep = np.isin(self.days, other.days, assume_unique=True)
+        return DailySeries(days=self.days[keep], values=self.values[keep])
+
+    def difference(self, other: "DailySeries") -> "DailySeries":
+        """Return the dates (and values) of this series that are not in 'other'."""
+        keep = ~np.isin(self.days, other.days, assume_unique=True)
+        return DailySeries(days=self.days[keep], values=self.values[keep])
+
+    def to_frame(
+            self,
+            date_column: str = "usage_date",
+            value_column: str = "usage_kwh",
+            dimensions: dict[str, str] | None = None,
+            ) -> pd.DataFrame:
+        """Return the series as a dataframe, e.g. for utils.sql_upsert_rows().
+
+        Args:
+            date_column (str): The name of the date column ('YYYY-MM-DD' strings).
+            value_column (str): The name of the value column (NaN for missing readings).
+            dimensions (dict[str, str] | None): Constant columns put first,
+                e.g. {"meter_id": "default"}.
+
+        Returns:
+            pd.DataFrame: One row per date, ordered by date.
+        """
+        data = dict(dimensions or {})
+        data[date_column] = self.date_strings()
+        data[value_column] = self.values
+        return pd.DataFrame(data, index=pd.RangeIndex(len(self)))
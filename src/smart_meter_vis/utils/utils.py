@@ -1,11 +1,35 @@
-import pandas as pd
 import json
-import requests
 import os
 from importlib.resources import files
 import csv
 from datetime import datetime
 import sqlite3
+import threading
+import atexit
+from typing import IO, TYPE_CHECKING
+
+from smart_meter_vis.utils import metrics
+
+# numpy, pandas and requests are imported by the functions that need them, so that commands
+# which only query the database (e.g. 'status') start without loading them
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from smart_meter_vis.utils.series import DailySeries
+
+# PRAGMAs applied once to every connection opened by get_sql_connection()
+SQL_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 268435456,  # 256 MiB
+    "cache_size": -65536,  # 64 MiB (negative values are KiB)
+    "temp_store": "MEMORY",
+    }
+
+# Open connections, one per database file and thread
+_sql_connections = threading.local()
+_sql_connections_all = []
+_sql_connections_lock = threading.Lock()
 
 def build_columns_string(columns_dict):
     """Return a string for specifying SQL columns and their types.
@@ -25,6 +49,103 @@ def build_columns_string(columns_dict):
     """
     return ",\n    ".join(f"{key} {value}" for key, value in columns_dict.items())
 
+def get_sql_connection(folder_db: str, name_db: str) -> sqlite3.Connection:
+    """Return the shared SQLite connection for a database file.
+
+    The first call per database file and thread opens the connection and
+    applies SQL_PRAGMAS; later calls return the same connection. All SQL
+    helpers in this module use it, so they no longer open (and leak) a
+    connection per call. Connections are closed by close_sql_connections()
+    or at interpreter exit.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The open connection.
+    """
+    path_abs_db = f"{folder_db}/{name_db}"
+    if not hasattr(_sql_connections, "by_path"):
+        _sql_connections.by_path = {}
+
+    conn = _sql_connections.by_path.get(path_abs_db)
+    if conn is None:
+        # Each connection is used by one thread only; closing may happen at exit.
+        # Statements are counted and timed (see utils.metrics)
+        conn = sqlite3.connect(path_abs_db, check_same_thread=False, factory=metrics.InstrumentedConnection)
+        for pragma, value in SQL_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        _sql_connections.by_path[path_abs_db] = conn
+        with _sql_connections_lock:
+            _sql_connections_all.append(conn)
+    return conn
+
+def close_sql_connections() -> None:
+    """Close all connections opened by get_sql_connection() in this thread."""
+    by_path = getattr(_sql_connections, "by_path", {})
+    with _sql_connections_lock:
+        for conn in by_path.values():
+            conn.close()
+            _sql_connections_all.remove(conn)
+    by_path.clear()
+
+@atexit.register
+def _close_all_sql_connections() -> None:
+    """Close the connections of all threads at interpreter exit."""
+    with _sql_connections_lock:
+        for conn in _sql_connections_all:
+            conn.close()
+        _sql_connections_all.clear()
+
+def sql_attach_database(
+        folder_db: str,
+        name_db: str,
+        name_db_attach: str,
+        alias: str,
+        ) -> str:
+    """Make a second database file readable through the shared connection of a first one.
+
+    Lets a single query join tables stored in different files, e.g. usage
+    of a meter and weather of its location when databases are partitioned.
+    The file is attached once per connection and alias.
+
+    Args:
+        folder_db (str): The path to the directory containing both database files.
+        name_db (str): The name of the database file whose connection is used.
+        name_db_attach (str): The name of the database file to attach.
+        alias (str): The schema name for the attached file.
+
+    Returns:
+        str: The schema name to prefix the attached tables with: 'alias', or
+        'main' if both names refer to the same file.
+    """
+    if name_db_attach == name_db:
+        return "main"
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    path_abs_attach = os.path.abspath(f"{folder_db}/{name_db_attach}")
+    attached = {row[1]: row[2] for row in conn.execute("PRAGMA database_list")}
+    if attached.get(alias) != path_abs_attach:
+        # The alias may still point to another file (e.g. another location)
+        if alias in attached:
+            conn.execute(f"DETACH DATABASE {alias}")
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (path_abs_attach, ))
+    return alias
+
+def partition_db_name(name_db: str, partition: str | None) -> str:
+    """Return the database file name for a partition (e.g. a meter or location).
+
+    Example: partition_db_name("usage.db", "meter_home") returns
+    "usage_meter_home.db". Without a partition, 'name_db' is returned
+    unchanged, i.e. all data shares one database.
+    """
+    if not partition:
+        return name_db
+    stem, dot, suffix = name_db.rpartition(".")
+    if not dot:
+        return f"{name_db}_{partition}"
+    return f"{stem}_{partition}.{suffix}"
+
 def find_csv_paths_abs(folder_csv: str) -> list[str]:
     """Get a list of absolute paths for all CSV files in a directory.
 
@@ -43,12 +164,79 @@ def find_csv_paths_abs(folder_csv: str) -> list[str]:
     paths_abs_list = [f"{folder_csv}/{filename}" for filename in filenames]
     return paths_abs_list
 
+def load_csv_meter_series(paths_abs_list: list[str | IO[bytes]]) -> "DailySeries":
+    """Load smart meter data from a list of CSV file paths into a DailySeries.
+
+    Each CSV file is parsed in one pass: dates in the first column are
+    converted from 'DD.MM.YYYY' straight to day numbers for the whole column
+    at once (no date strings are created), usage values in the second
+    column are converted from '1,23' to 1.23 and empty cells become NaN
+    (stored as NULL in SQL). If a date occurs in several files, the value
+    from the last file wins.
+
+    Args:
+        paths_abs_list (list[str | IO[bytes]]): A list of absolute paths to the
+            CSV files, or file objects such as those returned by
+            ingest.read_csv_increment().
+
+    Returns:
+        DailySeries: The usage by date (NaN for missing readings).
+    """
+    import numpy as np  # noqa: PLC0415
+    import pandas as pd  # noqa: PLC0415
+
+    from smart_meter_vis.utils.series import DailySeries  # noqa: PLC0415
+
+    days = []
+    values = []
+    for path_abs in paths_abs_list:
+        # Read date and usage column as raw strings; skip the header row
+        df_csv = pd.read_csv(
+            path_abs,
+            sep=";",
+            usecols=[0, 1],
+            names=["usage_date", "usage_kwh"],
+            header=0,
+            dtype=str,
+            encoding="utf-8",
+            keep_default_na=False,
+            )
+        days.append(pd.to_datetime(df_csv["usage_date"], format="%d.%m.%Y").to_numpy().astype("datetime64[D]"))
+        # Reformat usage data from 1,23 to 1.23; empty cells become NaN
+        values.append(pd.to_numeric(
+            df_csv["usage_kwh"].str.strip().str.replace(",", ".", regex=False).replace("", None),
+            ).to_numpy(dtype="float64"))
+
+    if not days:
+        return DailySeries.empty()
+    # Later files come last, so their readings win
+    return DailySeries.from_dates(dates=np.concatenate(days), values=np.concatenate(values))
+
+def load_csv_meter_columns(paths_abs_list: list[str | IO[bytes]]) -> "pd.DataFrame":
+    """Load smart meter data from a list of CSV file paths into columns.
+
+    Thin wrapper around load_csv_meter_series().
+
+    Args:
+        paths_abs_list (list[str | IO[bytes]]): A list of absolute paths to the
+            CSV files, or file objects such as those returned by
+            ingest.read_csv_increment().
+
+    Returns:
+        pd.DataFrame: A dataframe with the columns 'usage_date' (str,
+        'YYYY-MM-DD') and 'usage_kwh' (float, NaN for missing readings),
+        ordered by date.
+    """
+    return load_csv_meter_series(paths_abs_list=paths_abs_list).to_frame()
+
 def load_csv_meter_data(paths_abs_list: list[str]) -> dict[str, dict[str, float | str]]:
     """Load smart meter data from a list of CSV file paths.
 
     Reads CSV files, extracts date and usage information, and stores it
     in a dictionary. Dates are formatted to 'YYYY-MM-DD', and usage is
-    converted to a float.
+    converted to a float. Thin wrapper around load_csv_meter_series(); use
+    that for large exports, it needs 12 bytes per reading instead of two
+    dictionaries.
 
     Args:
         paths_abs_list (list[str]): A list of absolute paths to the CSV files.
@@ -58,36 +246,15 @@ def load_csv_meter_data(paths_abs_list: list[str]) -> dict[str, dict[str, float
         ('YYYY-MM-DD') and values are dictionaries containing the 'date' and
         'usage_kwh'.
     """
-    # Define dictionary to store data loaded from CSV
+    import numpy as np  # noqa: PLC0415
+
+    usage_series = load_csv_meter_series(paths_abs_list=paths_abs_list)
+
     smart_meter_dict = {}
-    # Process all present CSV files:
-    for path_abs in paths_abs_list:
-        with open(path_abs, mode="r", encoding="utf-8") as f:  # noqa: PTH123
-            # Read the individual CSV file
-            usage_data = csv.reader(f, delimiter=";")
-            # Load the header row and advance to next row
-            header = next(usage_data)
-            for row in usage_data:
-                # print(row)
-                # Get date from first column and format to YYYY-MM-DD
-                date_csv = row[0]
-                date_csv = datetime.strptime(date_csv, "%d.%m.%Y")
-                date_csv = date_csv.strftime("%Y-%m-%d")
-
-                # Get power consumption from second column
-                usage = row[1]
-
-                # If the current row of the usage csv is empty:
-                #   i) report missing data
-                #   ii) leave loop, work to next row
-                if not usage:
-                    usage = None
-                # Otherwise: reformat usage data from 1,12 to 1.23
-                else:
-                    usage = float(usage.replace(",", "."))
-
-                smart_meter_dict[date_csv] = {"usage_date": date_csv, "usage_kwh": usage}
-                # print(date_csv, ": ", usage)
+    for date_csv, usage in zip(usage_series.date_strings().tolist(), usage_series.values.tolist()):
+        # Missing readings are stored as None (NULL in SQL)
+        usage = None if np.isnan(usage) else usage
+        smart_meter_dict[date_csv] = {"usage_date": date_csv, "usage_kwh": usage}
 
     return smart_meter_dict
 
@@ -116,8 +283,7 @@ def check_sql_cell_not_null(
         bool: True if a non-null value exists for the given label and feature,
               False otherwise.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     query = f"SELECT {feature_name} FROM {name_table} WHERE {label_name} = ?"
@@ -130,6 +296,75 @@ def check_sql_cell_not_null(
         # print(f"{feature_name} kWh on {label}: (Already in database)")
         return True
 
+def build_query_filter_new_values(name_table: str, column_name: str, filter_columns: list[str]) -> str:
+    """Return the anti-join of sql_filter_new_values() (needs the table temp.candidates).
+
+    The table is aliased 't'; placeholders are the values of 'filter_columns'.
+    """
+    filter_str = "".join(f" AND t.{col_name} = ?" for col_name in filter_columns)
+    return f"""
+            SELECT c.value
+            FROM temp.candidates c
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM {name_table} t
+                WHERE t.{column_name} = c.value{filter_str}
+            )
+            ORDER BY c.rowid
+            """
+
+def sql_filter_new_values(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        column_name: str,
+        values: list[str | int | float],
+        filter_col_and_value: dict[str, str | int | float] | None = None,
+        ) -> list[str | int | float]:
+    """Return the values that are not yet stored in a column of an SQL table.
+
+    All candidate values are checked in a single query: they are loaded into
+    a temporary table which is then anti-joined against the target table.
+    Works for any key column, e.g. 'usage_date' in the electricity table or
+    'weather_date' in the weather table.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to check against.
+        column_name (str): The name of the key column in that table.
+        values (list[str | int | float]): The candidate values.
+        filter_col_and_value (dict[str, str | int | float] | None): Only consider
+            rows matching these column values, e.g. {"location_id": "vienna"}.
+
+    Returns:
+        list[str | int | float]: The candidate values absent from the column,
+                                 in input order and without duplicates.
+    """
+    if filter_col_and_value is None:
+        filter_col_and_value = {}
+    query = build_query_filter_new_values(
+        name_table=name_table,
+        column_name=column_name,
+        filter_columns=list(filter_col_and_value),
+        )
+
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    # Committed (or rolled back) at the end: the INSERT opens a transaction on the shared connection
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS temp.candidates")
+        cursor.execute("CREATE TEMP TABLE candidates (value UNIQUE)")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO temp.candidates (value) VALUES (?)",
+            ((value, ) for value in values),
+            )
+        cursor.execute(query, tuple(filter_col_and_value.values()))
+        result = [row[0] for row in cursor.fetchall()]
+        cursor.execute("DROP TABLE temp.candidates")
+
+    return result
+
 def sql_get_column_as_list(
         folder_db: str,
         name_db: str,
@@ -149,8 +384,7 @@ def sql_get_column_as_list(
                                  The data type of the elements in the list will match
                                  the data type of the column in the database.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     query = f"SELECT {column_name} FROM {name_table}"
@@ -162,6 +396,12 @@ def sql_get_column_as_list(
     return rows_as_list
 
 
+def build_query_filter_where(name_table: str, filter_columns: list[str], columns_select_list: list[str]) -> str:
+    """Return the query of sql_filter_where(); placeholders are the values of 'filter_columns'."""
+    columns_where_str = " AND ".join(f"{col_name} = ?" for col_name in filter_columns)
+    return f"SELECT {", ".join(columns_select_list)} FROM {name_table} WHERE {columns_where_str}"
+
+
 def sql_filter_where(
         folder_db: str,
         name_db: str,
@@ -187,18 +427,19 @@ def sql_filter_where(
               filter conditions and contains the selected columns.
     """
 
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     if type(columns_select_list) is str:
         columns_select_list = [columns_select_list]
 
-    columns_where_str = " AND ".join(f"{col_name} = ?" for col_name, value in filter_col_and_value.items())
     values_filter = tuple(filter_col_and_value.values())
 
-    print(f"values filter: {values_filter}")
-    query = f"SELECT {", ".join(columns_select_list)} FROM {name_table} WHERE {columns_where_str}"
+    query = build_query_filter_where(
+        name_table=name_table,
+        filter_columns=list(filter_col_and_value),
+        columns_select_list=columns_select_list,
+        )
     # print(query, values_filter)
     cursor.execute(query, values_filter)
     result = cursor.fetchall()
@@ -229,8 +470,7 @@ def sql_filter_is_none(
         list: A list of tuples, where each tuple represents a row where the
               specified columns are NULL and contains the selected columns.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     if type(columns_select_list) is str:
@@ -239,11 +479,17 @@ def sql_filter_is_none(
     columns_is_none_str = " AND ".join(f"{col_name} IS NULL" for col_name in columns_is_none.keys())
 
     query = f"SELECT {", ".join(columns_select_list)} FROM {name_table} WHERE {columns_is_none_str}"
-    print(query)
     cursor.execute(query)
     result = cursor.fetchall()
     return result
 
+def build_query_count_value(name_table: str, column_name: str) -> str:
+    """Return the query of sql_count_value_in_column(); the placeholder is the value to count."""
+    return f"""SELECT COUNT (*) FROM {name_table}
+                    WHERE {column_name} = ?
+                    GROUP BY {column_name}
+                    ORDER BY {column_name}"""
+
 def sql_count_value_in_column(
         folder_db: str,
         name_db: str,
@@ -264,24 +510,83 @@ def sql_count_value_in_column(
         int | None: The number of times the `count_value` appears in the
                     `column_name`. Returns 0 (instead of None) if the value is not found. Returns None if there's an issue executing the query.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
-    query = f"""SELECT COUNT (*) FROM {name_table}
-                    WHERE {column_name} = ?
-                    GROUP BY {column_name}
-                    ORDER BY {column_name}"""
+    query = build_query_count_value(name_table=name_table, column_name=column_name)
     cursor.execute(query, (count_value, ))
     row = cursor.fetchone()
     if row is None:
         return 0
     return row[0] # fetch without row content
 
-def create_sql_table(folder_db: str, name_db: str, name_table: str, columns_name_type: dict[str, str]) -> None:
+def sql_sum_where(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        column_name: str,
+        filter_col_and_value: dict[str, str | int | float],
+        ) -> int | float:
+    """Return the sum of a column over the rows matching all filter values (0 if none match).
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to query.
+        column_name (str): The column to sum.
+        filter_col_and_value (dict[str, str | int | float]): The column values
+            to match, e.g. {"request_date": "2024-01-01"}.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    conditions_str = " AND ".join(f"{column} = ?" for column in filter_col_and_value)
+    query = f"SELECT COALESCE(SUM({column_name}), 0) FROM {name_table} WHERE {conditions_str}"
+    return conn.execute(query, tuple(filter_col_and_value.values())).fetchone()[0]
+
+def sql_add_to_counter(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        key_values: dict[str, str | int | float],
+        column_name: str,
+        value: int | float,
+        ) -> None:
+    """Add 'value' to a counter column, creating its row if needed.
+
+    The table needs a UNIQUE constraint on the columns of 'key_values'.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table.
+        key_values (dict[str, str | int | float]): The key of the row,
+            e.g. {"request_date": "2024-01-01", "location_id": "vienna"}.
+        column_name (str): The counter column.
+        value (int | float): The amount to add.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    key_columns_str = ", ".join(key_values)
+    placeholder_str = ", ".join("?" for _ in key_values)
+    conn.execute(
+        f"""
+        INSERT INTO {name_table} ({key_columns_str}, {column_name})
+        VALUES ({placeholder_str}, ?)
+        ON CONFLICT({key_columns_str}) DO UPDATE SET {column_name} = {column_name} + excluded.{column_name}
+        """,
+        (*key_values.values(), value),
+        )
+    conn.commit()
+
+def create_sql_table(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        columns_name_type: dict[str, str],
+        constraints: list[str] | None = None,
+        add_id: bool = True,
+        ) -> None:
     """Connect to SQLite3 file and CREATE TABLE IF NOT EXISTS.
 
-    Adds an ID as primary key.
+    Adds an ID as primary key, unless 'add_id' is False.
 
     Args:
         folder_db (str): The path to the directory where the database file will be located.
@@ -289,24 +594,94 @@ def create_sql_table(folder_db: str, name_db: str, name_table: str, columns_name
         name_table (str): The name of the table to create.
         columns_name_type (dict[str, str]): A dictionary defining the columns and their SQL data types,
                                             e.g., {"column_name": "TEXT", "value": "REAL"}.
+        constraints (list[str] | None): Table constraints spanning several columns,
+                                        e.g., ["UNIQUE (date, lat, lon)"].
+        add_id (bool): Add the 'id' primary key. Set to False if
+                       'columns_name_type' defines its own primary key,
+                       e.g., {"usage_ts": "INTEGER PRIMARY KEY"}.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     # Construct the SQL query for creating a table if it doesn't exist
     columns_block = build_columns_string(columns_dict=columns_name_type)
+    if constraints:
+        columns_block = ",\n    ".join([columns_block, *constraints])
+
+    if add_id:
+        columns_block = ",\n    ".join(["id INTEGER PRIMARY KEY", columns_block])
 
     query = f"""
             CREATE TABLE IF NOT EXISTS {name_table} (
-                id INTEGER PRIMARY KEY,
                 {columns_block}
             )
             """
     # Execute the query and commit the results to the database
     cursor.execute(query)
     conn.commit()
-    conn.close()
+
+def create_sql_indexes(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        indexes: dict[str, list[str]],
+        unique: bool = False,
+        ) -> None:
+    """Connect to SQLite3 file and CREATE INDEX IF NOT EXISTS for each index.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to index.
+        indexes (dict[str, list[str]]): A dictionary defining index names and
+                                        the columns they cover,
+                                        e.g., {"weather_retrieval_date": ["retrieval_date"]}.
+        unique (bool): Create UNIQUE indexes, which also allow
+                       'INSERT ... ON CONFLICT' on these columns.
+
+    Raises:
+        ValueError: If a UNIQUE index can't be created because the table
+                    already contains duplicate values.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    unique_str = "UNIQUE " if unique else ""
+    for name_index, columns in indexes.items():
+        query = f"CREATE {unique_str}INDEX IF NOT EXISTS {name_index} ON {name_table} ({", ".join(columns)})"
+        try:
+            cursor.execute(query)
+        except sqlite3.IntegrityError as error:
+            raise ValueError(
+                f"Can't create unique index {name_index}: {name_table} contains duplicate values in {columns}"
+                ) from error
+    conn.commit()
+
+def sql_explain_query_plan(
+        folder_db: str,
+        name_db: str,
+        query: str,
+        values: tuple = (),
+        ) -> list[str]:
+    """Return SQLite's query plan for a query, one step per list entry.
+
+    Useful to check that a query uses an index ('SEARCH ... USING INDEX')
+    instead of a full table scan ('SCAN ...').
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        query (str): The query to explain.
+        values (tuple): The values for the query's placeholders.
+
+    Returns:
+        list[str]: The 'detail' column of EXPLAIN QUERY PLAN.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    cursor.execute(f"EXPLAIN QUERY PLAN {query}", values)
+    return [row[3] for row in cursor.fetchall()]
 
 def add_new_columns(
         folder_db: str,
@@ -325,8 +700,7 @@ def add_new_columns(
                                    e.g., {"new_column": "INTEGER", "another_field": "TEXT"}.
                                    If a column already exists, it will be skipped without error.
     """
-    path_abs_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_abs_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     for column, col_type in columns.items():
@@ -341,7 +715,6 @@ def add_new_columns(
 
     # Commit changes
     conn.commit()
-    conn.close()
 
 def sql_insert_row(
         folder_db: str,
@@ -361,8 +734,7 @@ def sql_insert_row(
     
     INSERT INTO table (column_one, column_two) VALUES (?, ?)
     """
-    path_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     values = tuple(data.values())
@@ -374,6 +746,254 @@ def sql_insert_row(
     cursor.execute(query, values) 
     conn.commit()
 
+def sql_upsert_rows(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        key_column: str | list[str],
+        data: "pd.DataFrame",
+        ) -> dict[str, int]:
+    """Insert or update all rows of a dataframe in a single transaction.
+
+    The dataframe's column names must match the SQL column names and
+    'key_column' must carry a UNIQUE constraint (e.g. 'usage_date' or
+    ['meter_id', 'usage_date']).
+    Rows with a new key are inserted; rows whose key already exists
+    overwrite the stored values, so corrected re-exports replace stale
+    data. NaN values are stored as NULL.
+
+    INSERT INTO table (key, value) SELECT ... ON CONFLICT(key) DO UPDATE ...
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to write to.
+        key_column (str | list[str]): The name of the UNIQUE column (or the
+                                      columns of a UNIQUE constraint)
+                                      identifying a row.
+        data (pd.DataFrame): The rows to write.
+
+    Returns:
+        dict[str, int]: The number of rows 'inserted', 'updated' and
+                        'unchanged'.
+    """
+    key_columns = [key_column] if isinstance(key_column, str) else list(key_column)
+    key_columns_str = ", ".join(key_columns)
+    column_names = list(data.columns)
+    value_columns = [col for col in column_names if col not in key_columns]
+    column_names_str = ", ".join(column_names)
+    placeholder_str = ", ".join(["?" for _ in column_names])
+
+    # Convert NaN to None so that missing values are stored as NULL
+    rows = data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    # Load the batch into a staging table to compare it against stored rows
+    cursor.execute("DROP TABLE IF EXISTS temp.staging")
+    cursor.execute(f"CREATE TEMP TABLE staging AS SELECT {column_names_str} FROM {name_table} WHERE 0")
+    cursor.executemany(f"INSERT INTO temp.staging ({column_names_str}) VALUES ({placeholder_str})", rows)
+
+    values_differ_str = " OR ".join(f"t.{col} IS NOT s.{col}" for col in value_columns) or "0"
+    query_count = f"""
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(t.{key_columns[0]} IS NULL), 0),
+                COALESCE(SUM(t.{key_columns[0]} IS NOT NULL AND ({values_differ_str})), 0)
+            FROM temp.staging s
+            LEFT JOIN {name_table} t ON {" AND ".join(f"t.{col} = s.{col}" for col in key_columns)}
+            """
+    cursor.execute(query_count)
+    total, inserted, updated = cursor.fetchone()
+
+    # Only touch stored rows whose values actually changed
+    update_str = ", ".join(f"{col} = excluded.{col}" for col in value_columns)
+    excluded_differ_str = " OR ".join(f"{col} IS NOT excluded.{col}" for col in value_columns)
+    query_upsert = f"""
+            INSERT INTO {name_table} ({column_names_str})
+            SELECT {column_names_str} FROM temp.staging WHERE 1
+            ON CONFLICT({key_columns_str}) DO UPDATE SET {update_str}
+            WHERE {excluded_differ_str}
+            """
+    if not value_columns:
+        query_upsert = f"""
+            INSERT INTO {name_table} ({column_names_str})
+            SELECT {column_names_str} FROM temp.staging WHERE 1
+            ON CONFLICT({key_columns_str}) DO NOTHING
+            """
+    cursor.execute(query_upsert)
+    conn.commit()
+    cursor.execute("DROP TABLE temp.staging")
+
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": total - inserted - updated,
+        }
+
+def sql_record_failures(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        key_column: str,
+        failures: dict[str, str],
+        attempt_date: str,
+        dimensions: dict[str, str | int | float] | None = None,
+        ) -> None:
+    """Record failed attempts in a ledger table.
+
+    The ledger table needs the columns 'key_column', 'attempts',
+    'last_error' and 'last_attempt_date', and a UNIQUE constraint on the
+    dimension columns and 'key_column'. A key's attempt counter is increased
+    by one for every call in which it failed.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the ledger table.
+        key_column (str): The name of the UNIQUE key column, e.g. 'weather_date'.
+        failures (dict[str, str]): The reason of failure by key.
+        attempt_date (str): The date of the attempt ('YYYY-MM-DD').
+        dimensions (dict[str, str | int | float] | None): Values stored with
+            every failure, e.g. {"location_id": "vienna"}.
+    """
+    if dimensions is None:
+        dimensions = {}
+    key_columns_str = ", ".join([*dimensions, key_column])
+    placeholder_str = "".join("?, " for _ in dimensions)
+
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    query = f"""
+            INSERT INTO {name_table} ({key_columns_str}, attempts, last_error, last_attempt_date)
+            VALUES ({placeholder_str}?, 1, ?, ?)
+            ON CONFLICT({key_columns_str}) DO UPDATE SET
+                attempts = attempts + 1,
+                last_error = excluded.last_error,
+                last_attempt_date = excluded.last_attempt_date
+            """
+    dimension_values = tuple(dimensions.values())
+    cursor.executemany(
+        query,
+        ((*dimension_values, key, reason, attempt_date) for key, reason in failures.items()),
+        )
+    conn.commit()
+
+def sql_delete_values(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        column_name: str,
+        values: list[str | int | float],
+        filter_col_and_value: dict[str, str | int | float] | None = None,
+        ) -> None:
+    """Delete all rows whose value in 'column_name' is one of 'values'.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to delete from.
+        column_name (str): The name of the column to match.
+        values (list[str | int | float]): The values of the rows to delete.
+        filter_col_and_value (dict[str, str | int | float] | None): Only consider
+            rows matching these column values, e.g. {"location_id": "vienna"}.
+    """
+    if filter_col_and_value is None:
+        filter_col_and_value = {}
+    filter_str = "".join(f" AND {col_name} = ?" for col_name in filter_col_and_value)
+    filter_values = tuple(filter_col_and_value.values())
+
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    query = f"DELETE FROM {name_table} WHERE {column_name} = ?{filter_str}"
+    cursor.executemany(query, ((value, *filter_values) for value in values))
+    conn.commit()
+
+def sql_get_failed_keys(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        key_column: str,
+        max_attempts: int | None = None,
+        filter_col_and_value: dict[str, str | int | float] | None = None,
+        ) -> list[str]:
+    """Return the keys in a ledger table (see sql_record_failures()).
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the ledger table.
+        key_column (str): The name of the UNIQUE key column, e.g. 'weather_date'.
+        max_attempts (int | None): Leave out keys that already failed this
+            many times. None to return all keys.
+        filter_col_and_value (dict[str, str | int | float] | None): Only consider
+            rows matching these column values, e.g. {"location_id": "vienna"}.
+
+    Returns:
+        list[str]: The failed keys, least recently attempted first.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    conditions = [f"{col_name} = ?" for col_name in (filter_col_and_value or {})]
+    values = tuple((filter_col_and_value or {}).values())
+    if max_attempts is not None:
+        conditions.append("attempts < ?")
+        values += (max_attempts, )
+
+    query = f"SELECT {key_column} FROM {name_table}"
+    if conditions:
+        query += f" WHERE {" AND ".join(conditions)}"
+    query += f" ORDER BY last_attempt_date, {key_column}"
+    cursor.execute(query, values)
+    return [row[0] for row in cursor.fetchall()]
+
+def sql_replace_rows(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        data: "pd.DataFrame",
+        filter_col_and_value: dict[str, str | int | float] | None = None,
+        ) -> None:
+    """Replace all rows of an SQL table with the rows of a dataframe.
+
+    Deleting the old rows and inserting the new ones happens in a single
+    transaction. With 'filter_col_and_value' only the matching rows are
+    replaced, e.g. those of one location. The dataframe's column names must match the SQL column
+    names; NaN values are stored as NULL.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the table to rewrite.
+        data (pd.DataFrame): The new rows.
+        filter_col_and_value (dict[str, str | int | float] | None): Only delete
+            rows matching these column values.
+    """
+    if filter_col_and_value is None:
+        filter_col_and_value = {}
+    column_names_str = ", ".join(data.columns)
+    placeholder_str = ", ".join(["?" for _ in data.columns])
+    rows = data.astype(object).where(data.notna(), None).itertuples(index=False, name=None)
+
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    query_delete = f"DELETE FROM {name_table}"
+    if filter_col_and_value:
+        query_delete += f" WHERE {" AND ".join(f"{col_name} = ?" for col_name in filter_col_and_value)}"
+    # A failed insert must not leave the DELETE pending on the shared connection
+    try:
+        cursor.execute(query_delete, tuple(filter_col_and_value.values()))
+        cursor.executemany(f"INSERT INTO {name_table} ({column_names_str}) VALUES ({placeholder_str})", rows)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
 # TODO: fix this method, it'a mess! let it take a json file!
 def sql_insert_multiple_from_json_as_list(
         folder_db: str,
@@ -384,8 +1004,7 @@ def sql_insert_multiple_from_json_as_list(
         ) -> None:
     """Insert data into SQL table via executemany().
     """
-    path_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
     # Assume all inner dicts have the same keys
@@ -420,8 +1039,7 @@ def store_in_sql(
     """
     # Store all new values from data in SQL table
     # Connect to db
-    path_db = f"{folder_db}/{name_db}"
-    conn = sqlite3.connect(path_db)
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
     cursor = conn.cursor()
 
 
@@ -447,7 +1065,6 @@ def store_in_sql(
         cursor.execute(query, (date, usage))
 
     conn.commit()
-    conn.close()
 
 def user_choice_api_call(performed_calls:int, limit:int) -> bool:
     print("The next API request to OpenWeatherMap will exceed the free tier.")
@@ -455,16 +1072,15 @@ def user_choice_api_call(performed_calls:int, limit:int) -> bool:
     print(f"You have performed {performed_calls} / {limit} API calls today.")
     print("To continue with the request, confirm with Y and press ENTER.")
     print("Press any other key (and ENTER) to stop making API calls.")
-    choice = input().lower()
-    if choice != "y":
-        return False
-    elif choice == "":
-        return True
+    choice = input().strip().lower()
+    return choice == "y"
 
 def api_get(
         api_params: dict,
         url: str,
         ):
+    import requests  # noqa: PLC0415
+
     response = requests.get(url=url, params=api_params)
     if response.status_code == 200:
         return response
@@ -491,8 +1107,7 @@ def sql_subtract_column_values(
             A list of distinct values from the reference table's column
             that are not present in the incomplete table's column.
         """
-        path_db = f"{folder_db}/{name_db}"
-        conn = sqlite3.connect(path_db)
+        conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
         cursor = conn.cursor()
 
         reference_table_name = data.get("reference_table")
@@ -501,7 +1116,6 @@ def sql_subtract_column_values(
         incomplete_column = data.get("incomplete_column")
 
         if not all([reference_table_name, incomplete_table_name, reference_column, incomplete_column]):
-            conn.close()
             raise ValueError("The 'data' dictionary is missing required keys.")
 
         sql_query = f"""
@@ -517,9 +1131,140 @@ def sql_subtract_column_values(
         cursor.execute(sql_query)
         results = [row[0] for row in cursor.fetchall()]
 
-        conn.close()
         return results
 
+def sql_store_raw_responses(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        responses: dict[str, dict],
+        lat: float,
+        lon: float,
+        retrieval_date: str | None,
+        ) -> int:
+    """Append raw API responses to a table of the raw response store.
+
+    The table needs the columns 'response_date', 'lat', 'lon',
+    'retrieval_date' and 'response' with a UNIQUE constraint on
+    (response_date, lat, lon). Responses already stored for a date and
+    location are kept; each write only appends new rows.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the raw response table.
+        responses (dict[str, dict]): The parsed JSON responses by date ('YYYY-MM-DD').
+        lat (float): The latitude the responses were requested for.
+        lon (float): The longitude the responses were requested for.
+        retrieval_date (str | None): The date the responses were fetched, if known.
+
+    Returns:
+        int: The number of responses added.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    query = f"""
+            INSERT OR IGNORE INTO {name_table} (response_date, lat, lon, retrieval_date, response)
+            VALUES (?, ?, ?, ?, ?)
+            """
+    rows = [
+        (date, lat, lon, retrieval_date, json.dumps(response))
+        for date, response in responses.items()
+        ]
+    changes_before = conn.total_changes
+    cursor.executemany(query, rows)
+    conn.commit()
+    return conn.total_changes - changes_before
+
+def build_query_raw_responses(name_table: str, columns_select_list: list[str]) -> str:
+    """Return the query for the raw responses of a location, ordered by date; placeholders are lat and lon.
+
+    Uses the index on (lat, lon, response_date) created by pipeline.setup_databases().
+    """
+    return f"""
+            SELECT {", ".join(columns_select_list)} FROM {name_table}
+            WHERE lat = ? AND lon = ?
+            ORDER BY response_date
+            """
+
+def sql_get_raw_responses(
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        lat: float,
+        lon: float,
+        dates: list[str] | None = None,
+        ) -> dict[str, dict]:
+    """Load raw API responses for a location from the raw response store.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the raw response table.
+        lat (float): The latitude of the location.
+        lon (float): The longitude of the location.
+        dates (list[str] | None): The dates to load. None to load all dates.
+
+    Returns:
+        dict[str, dict]: The parsed JSON responses by date, ordered by date.
+    """
+    conn = get_sql_connection(folder_db=folder_db, name_db=name_db)
+    cursor = conn.cursor()
+
+    query = build_query_raw_responses(name_table=name_table, columns_select_list=["response_date", "response"])
+    cursor.execute(query, (lat, lon))
+    if dates is None:
+        return {date: json.loads(response) for date, response in cursor}
+    dates_set = set(dates)
+    return {date: json.loads(response) for date, response in cursor if date in dates_set}
+
+def migrate_json_responses_to_sql(
+        filepath: str,
+        folder_db: str,
+        name_db: str,
+        name_table: str,
+        lat: float,
+        lon: float,
+        ) -> int:
+    """Move responses from a JSON backup file into the raw response store.
+
+    Reads a file written by add_to_json_file_if_is_not_key() once, stores
+    all responses via sql_store_raw_responses() and renames the file to
+    '<filepath>.migrated' so the migration doesn't run again.
+
+    Args:
+        filepath (str): The path to the JSON file, e.g. 'api_responses.json'.
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table (str): The name of the raw response table.
+        lat (float): The latitude the responses were requested for.
+        lon (float): The longitude the responses were requested for.
+
+    Returns:
+        int: The number of responses added; 0 if there is no file.
+    """
+    if not os.path.exists(filepath):
+        return 0
+
+    with open(filepath, "r") as f:  # noqa: PTH123
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError:
+            data = {}  # File is empty or invalid
+
+    added = sql_store_raw_responses(
+        folder_db=folder_db,
+        name_db=name_db,
+        name_table=name_table,
+        responses=data,
+        lat=lat,
+        lon=lon,
+        retrieval_date=None,
+        )
+    os.replace(filepath, f"{filepath}.migrated")
+    return added
+
 def add_to_json_file_if_is_not_key(filepath, key, value):
     data = {}
     if os.path.exists(filepath):
@@ -0,0 +1,80 @@
+"""Watch folders for new or changed CSV files.
+
+Folders are polled with os.scandir(), which reads size and modification
+time of all entries in one pass per folder. For folders with hundreds of
+exports a poll takes milliseconds, so no platform specific notification API
+(inotify etc.) or extra dependency is needed. Memory use is bounded by the
+number of files watched: only their last seen state is kept.
+"""
+import os
+import threading
+from typing import Iterator
+
+
+def scan_folder(folder: str, suffix: str = ".csv") -> dict[str, tuple[int, int]]:
+    """Return size and modification time (ns) of the files in a folder by path.
+
+    Paths are built like utils.find_csv_paths_abs() builds them.
+    """
+    states = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                stat = entry.stat()
+                states[f"{folder}/{entry.name}"] = (stat.st_size, stat.st_mtime_ns)
+    return states
+
+
+def watch_folders(
+        folders: dict[str, str],
+        interval_s: float = 10.0,
+        suffix: str = ".csv",
+        stop_event: threading.Event | None = None,
+        ) -> Iterator[set[str]]:
+    """Yield the keys of folders whose files were added or changed, after every poll.
+
+    The current content of the folders counts as known. A new or changed
+    file is reported once it has kept its size and modification time for
+    one polling interval, so files still being copied are picked up only when
+    complete. Deleted files are forgotten. A folder that can't be read (e.g.
+    a network share that is briefly gone) is skipped in that poll and keeps
+    its state. Runs until 'stop_event' is set.
+
+    Args:
+        folders (dict[str, str]): The folders to watch by key (e.g. meter id).
+        interval_s (float): Seconds between two polls.
+        suffix (str): Only files ending with 'suffix' are watched.
+        stop_event (threading.Event | None): Set to end the generator.
+
+    Yields:
+        set[str]: The keys of the folders with new or changed files (empty if
+        nothing changed, so callers can do periodic work).
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def scan_or_none(folder: str) -> dict[str, tuple[int, int]] | None:
+        try:
+            return scan_folder(folder, suffix=suffix)
+        except OSError:
+            return None
+
+    # State already handled and state seen in the previous poll, by folder key
+    known = {key: scan_or_none(folder) or {} for key, folder in folders.items()}
+    previous = {key: dict(states) for key, states in known.items()}
+
+    while not stop_event.wait(interval_s):
+        changed = set()
+        for key, folder in folders.items():
+            current = scan_or_none(folder)
+            if current is None:
+                continue
+            for path, state in current.items():
+                # Report once the file is unchanged since the previous poll
+                if state != known[key].get(path) and state == previous[key].get(path):
+                    known[key][path] = state
+                    changed.add(key)
+            known[key] = {path: state for path, state in known[key].items() if path in current}
+            previous[key] = current
+        yield changed
+
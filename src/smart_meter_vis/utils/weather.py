@@ -0,0 +1,386 @@
+"""Fetch daily weather summaries from the OpenWeatherMap API concurrently."""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from smart_meter_vis.utils import metrics, utils
+
+# Endpoint for daily aggregations of historical weather data
+# For JSON schema see API documentation: https://openweathermap.org/api/one-call-3#hist_agr_parameter
+URL_DAY_SUMMARY = "https://api.openweathermap.org/data/3.0/onecall/day_summary"
+
+# Columns of the weather table taken directly from a day_summary response
+# and the path of keys leading to each value
+WEATHER_FIELDS = {
+    "temp_min": ("temperature", "min"),
+    "temp_max": ("temperature", "max"),
+    "temp_morning": ("temperature", "morning"),
+    "temp_afternoon": ("temperature", "afternoon"),
+    "temp_evening": ("temperature", "evening"),
+    "temp_night": ("temperature", "night"),
+    "humidity": ("humidity", "afternoon"),
+    "precipitation": ("precipitation", "total"),
+    "wind_speed": ("wind", "max", "speed"),
+    "wind_direction": ("wind", "max", "direction"),
+    }
+
+# Temperatures of the four times of day, used for the derived medians
+TEMP_COLUMNS_NO_MINMAX = ["temp_morning", "temp_afternoon", "temp_evening", "temp_night"]
+
+# Response codes worth retrying: rate limited or temporary server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Tokens are refilled continuously at 'rate' tokens per second up to
+    'capacity'. Each call to acquire() takes one token and blocks until one
+    is available.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, waiting until it becomes available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """Return a keep-alive HTTP session with a connection pool of 'pool_size'."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def retry_delay(
+        attempt: int,
+        retry_after: str | None = None,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        ) -> float:
+    """Return the number of seconds to wait before retrying a request.
+
+    A 'Retry-After' header (seconds or HTTP date) takes precedence. Otherwise
+    the delay grows exponentially with the attempt number and is randomised
+    ("full jitter") so that parallel requests don't retry in lockstep.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+        retry_after (str | None): The value of the 'Retry-After' header, if any.
+        backoff_base (float): The maximum delay after the first attempt.
+        backoff_max (float): The upper bound for any delay.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                retry_at = None
+            delay = (retry_at - datetime.now(timezone.utc)).total_seconds() if retry_at else None
+        if delay is not None:
+            return min(backoff_max, max(0.0, delay))
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+
+def fetch_day_summaries(
+        dates: list[str],
+        api_params: dict,
+        url: str = URL_DAY_SUMMARY,
+        max_calls: int | None = None,
+        max_requests: int | None = None,
+        requests_per_second: float = 10,
+        requests_per_minute: float | None = 600,
+        max_workers: int = 8,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        session: requests.Session | None = None,
+        ) -> tuple[dict[str, dict], dict[str, str], int]:
+    """Fetch the day summary for several dates in parallel.
+
+    Requests share one keep-alive session and are throttled by a token
+    bucket per second and (optionally) per minute. At most 'max_calls'
+    dates are requested (e.g. API_GET_LIMIT). Connection errors and
+    responses with a code in RETRY_STATUS_CODES are retried up to
+    'max_retries' times with exponential backoff (see retry_delay()). Every
+    request counts against 'max_requests', retries and failed ones included
+    (a daily quota may bill them too); once it is used up, a date being
+    retried fails and dates not requested yet are left out of the result,
+    like those beyond 'max_calls'.
+
+    Args:
+        dates (list[str]): The dates ('YYYY-MM-DD') to fetch, in order of priority.
+        api_params (dict): Parameters sent with every request, e.g. lat, lon,
+            appid and units. The date is added per request.
+        url (str): The API endpoint; point this to a local server for testing.
+        max_calls (int | None): The maximum number of dates. None for no limit.
+        max_requests (int | None): The maximum number of requests, retries
+            included. None for no limit.
+        requests_per_second (float): Sustained request rate.
+        requests_per_minute (float | None): Additional per minute limit. None for no limit.
+        max_workers (int): The number of concurrent requests.
+        max_retries (int): The number of retries per date after the first attempt.
+        backoff_base (float): The maximum delay before the first retry in seconds.
+        backoff_max (float): The upper bound for any delay in seconds.
+        session (requests.Session | None): Session to use. A new one is created
+            (and closed) if None.
+
+    Returns:
+        tuple[dict[str, dict], dict[str, str], int]: The parsed JSON responses
+        by date (in the order of 'dates'), the reason of failure by date for
+        all dates requested that could not be fetched and the number of
+        requests made.
+    """
+    if max_calls is not None:
+        dates = dates[:max(0, max_calls)]
+    if not dates:
+        return {}, {}, 0
+
+    buckets = [TokenBucket(rate=requests_per_second)]
+    if requests_per_minute is not None:
+        buckets.append(TokenBucket(rate=requests_per_minute / 60, capacity=requests_per_minute))
+
+    own_session = session is None
+    if own_session:
+        session = create_session(pool_size=max_workers)
+
+    # Requests made (retries included), shared by the worker threads
+    requests_made = 0
+    requests_lock = threading.Lock()
+
+    def take_request() -> bool:
+        nonlocal requests_made
+        with requests_lock:
+            if max_requests is not None and requests_made >= max_requests:
+                return False
+            requests_made += 1
+            return True
+
+    # Latency and outcome of every request, retries included (see utils.metrics)
+    def record_request(start: float, status: str, attempt: int) -> None:
+        metrics.observe("api_request_seconds", time.perf_counter() - start, status=status)
+        metrics.count("api_requests_total", status=status)
+        if attempt:
+            metrics.count("api_retries_total")
+
+    def fetch(date: str) -> tuple[dict | None, str | None]:
+        for attempt in range(max_retries + 1):
+            if not take_request():
+                if not attempt:
+                    return None, None
+                reason = f"{reason} (API request limit reached)"
+                break
+            for bucket in buckets:
+                bucket.acquire()
+            retry_after = None
+            request_start = time.perf_counter()
+            try:
+                response = session.get(url=url, params={**api_params, "date": date})
+            except requests.RequestException as error:
+                record_request(start=request_start, status=type(error).__name__, attempt=attempt)
+                reason = f"{type(error).__name__}: {error}"
+            else:
+                record_request(start=request_start, status=str(response.status_code), attempt=attempt)
+                if response.status_code == 200:
+                    # A 200 without JSON (e.g. the page of a proxy) fails this date only; not retried
+                    try:
+                        return response.json(), None
+                    except ValueError as error:
+                        reason = f"invalid JSON in response: {error}"
+                        break
+                reason = f"response code: {response.status_code}"
+                if response.status_code not in RETRY_STATUS_CODES:
+                    break
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt < max_retries:
+                time.sleep(retry_delay(
+                    attempt=attempt,
+                    retry_after=retry_after,
+                    backoff_base=backoff_base,
+                    backoff_max=backoff_max,
+                    ))
+
+        print(f"API call failed for {date} - {reason}")
+        return None, reason
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetch, dates))
+    finally:
+        if own_session:
+            session.close()
+
+    responses = {}
+    failures = {}
+    for date, (response, reason) in zip(dates, results):
+        if response is not None:
+            responses[date] = response
+        elif reason is not None:
+            failures[date] = reason
+    return responses, failures, requests_made
+
+
+def weather_frame_from_responses(responses: dict[str, dict]) -> pd.DataFrame:
+    """Build rows for the weather table from day_summary responses.
+
+    Extracts the values listed in WEATHER_FIELDS (missing values become NaN)
+    and computes the derived columns for all rows at once:
+    'temp_median_no_minmax' (median of the four times of day) and
+    'temp_median' (median including min and max).
+
+    Args:
+        responses (dict[str, dict]): The parsed JSON responses by date ('YYYY-MM-DD').
+
+    Returns:
+        pd.DataFrame: One row per date with the column 'weather_date', the
+        columns of WEATHER_FIELDS and the derived columns.
+    """
+    def get_value(response: dict, path: tuple[str, ...]) -> float | None:
+        for key in path:
+            if not isinstance(response, dict):
+                return None
+            response = response.get(key)
+        return response
+
+    df_weather = pd.DataFrame(
+        [[get_value(response, path) for path in WEATHER_FIELDS.values()] for response in responses.values()],
+        columns=list(WEATHER_FIELDS),
+        dtype="float64",
+        )
+    df_weather.insert(0, "weather_date", list(responses.keys()))
+
+    # Calculate temp median for all rows; without temp min & max, and one with min & max
+    df_weather["temp_median_no_minmax"] = df_weather[TEMP_COLUMNS_NO_MINMAX].median(axis=1)
+    df_weather["temp_median"] = df_weather[["temp_min", "temp_max", *TEMP_COLUMNS_NO_MINMAX]].median(axis=1)
+    return df_weather
+
+
+def replay_weather_table(
+        folder_db: str,
+        name_db: str,
+        name_table_raw: str,
+        name_table_weather: str,
+        location_id: str,
+        lat: float,
+        lon: float,
+        ) -> dict[str, float]:
+    """Rebuild a location's weather rows from the raw response store without API calls.
+
+    All responses stored for the location are read in one query, every
+    column (including derived ones) is recomputed by
+    weather_frame_from_responses() and the rows are upserted into the
+    weather table in a single transaction. The original retrieval dates are
+    kept: responses stored without one (moved from the former JSON backup)
+    keep the date of the weather row, so the daily API call count stays
+    right. Rows without a stored response (e.g. fetched before the raw store
+    existed, or stored under other coordinates) are left as they are.
+
+    Args:
+        folder_db (str): The path to the directory containing the database file.
+        name_db (str): The name of the SQLite database file.
+        name_table_raw (str): The name of the raw response table.
+        name_table_weather (str): The name of the weather table to rebuild.
+        location_id (str): The location's value in the weather table's 'location_id' column.
+        lat (float): The latitude of the location.
+        lon (float): The longitude of the location.
+
+    Returns:
+        dict[str, float]: The number of 'rows' written, the 'seconds' taken
+        and the throughput in 'rows_per_second'.
+    """
+    time_start = time.perf_counter()
+
+    conn = utils.get_sql_connection(folder_db=folder_db, name_db=name_db)
+    query = utils.build_query_raw_responses(
+        name_table=name_table_raw,
+        columns_select_list=["response_date", "retrieval_date", "response"],
+        )
+    df_raw = pd.read_sql_query(sql=query, con=conn, params=(lat, lon))
+
+    responses = dict(zip(df_raw["response_date"], map(json.loads, df_raw["response"])))
+    df_weather = weather_frame_from_responses(responses=responses)
+    df_weather.insert(0, "location_id", location_id)
+    df_weather["retrieval_date"] = df_raw["retrieval_date"].to_numpy()
+    if df_weather["retrieval_date"].isna().any():
+        query_stored = utils.build_query_filter_where(
+            name_table=name_table_weather,
+            filter_columns=["location_id"],
+            columns_select_list=["weather_date", "retrieval_date"],
+            )
+        df_stored = pd.read_sql_query(sql=query_stored, con=conn, params=(location_id, ))
+        retrieval_dates_stored = dict(zip(df_stored["weather_date"], df_stored["retrieval_date"]))
+        df_weather["retrieval_date"] = df_weather["retrieval_date"].fillna(
+            df_weather["weather_date"].map(retrieval_dates_stored),
+            )
+
+    if not df_weather.empty:
+        utils.sql_upsert_rows(
+            folder_db=folder_db,
+            name_db=name_db,
+            name_table=name_table_weather,
+            key_column=["location_id", "weather_date"],
+            data=df_weather,
+            )
+
+    seconds = time.perf_counter() - time_start
+    return {
+        "rows": len(df_weather),
+        "seconds": seconds,
+        "rows_per_second": len(df_weather) / seconds if seconds else 0.0,
+        }
+
+
+def plan_weather_requests(
+        missing_dates_by_meter: dict[str, list[str]],
+        meter_locations: dict[str, str],
+        ) -> dict[str, list[str]]:
+    """Merge the dates missing for each meter into one request list per location.
+
+    Meters at the same location share their weather data, so each date is
+    requested only once per location.
+
+    Args:
+        missing_dates_by_meter (dict[str, list[str]]): Dates without weather
+            data by meter id.
+        meter_locations (dict[str, str]): The location id of each meter.
+
+    Returns:
+        dict[str, list[str]]: The dates to request by location id, in order of
+        first appearance and without duplicates.
+    """
+    dates_by_location = {}
+    for meter_id, dates in missing_dates_by_meter.items():
+        location_dates = dates_by_location.setdefault(meter_locations[meter_id], {})
+        location_dates.update(dict.fromkeys(dates))
+    return {location_id: list(dates) for location_id, dates in dates_by_location.items()}